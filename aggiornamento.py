@@ -0,0 +1,67 @@
+# Aggiornamento generico valido per tutte le tabelle: la riga viene letta una sola volta,
+# si confrontano i nuovi valori con quelli attuali e si scrivono solo le colonne cambiate.
+# Se non cambia nulla non viene eseguito nessun UPDATE.
+# Uso: python aggiornamento.py   (controlla il numero di query su SQLite in memoria e termina con codice 1 se non torna)
+from lotto import conferma
+from repliche import primario
+
+def differenze(riga, valori):
+    return {k: v for k, v in valori.items() if getattr(riga, k) != v}
+
+def applica(session, riga, valori):
+    # riga è già caricata (ad esempio da controllo()); restituisce le colonne effettivamente modificate
+    cambiati = differenze(riga, valori)
+    if cambiati:
+        for k, v in cambiati.items():
+            setattr(riga, k, v)
+        conferma(session)
+    return cambiati
+
+def archiviata(session, chiave):
+    # le spedizioni archiviate (archivio.py) si possono solo leggere o cancellare
+    import archivio
+    a = archivio.anno_di(session, chiave)
+    if a is not None: raise ValueError("Spedizione %s archiviata in spedizione_%d: non si può modificare" % (chiave, a))
+
+def aggiorna(session, tabella, chiave, valori):
+    # chiave è l'Id, oppure la tupla (IdIntervento, IdPezzo) per Usando; None se la riga non esiste
+    # (ValueError se è una spedizione archiviata). La riga si legge dal principale: su una replica in ritardo
+    # il confronto con i nuovi valori potrebbe non vedere cambiamenti e l'aggiornamento andrebbe perso
+    primario(session)
+    riga = session.get(tabella, chiave)
+    if riga is None:
+        if tabella.__name__=='Spedizione': archiviata(session, chiave)
+        return None
+    return applica(session, riga, valori)
+
+def verifica(engine):
+    # conta le query di aggiorna() su una riga nuova: (caso, SELECT, UPDATE, attesi) per ogni caso che non torna
+    from sqlalchemy.orm import Session
+    from modelli import Proprietario
+    from strumentazione import ContaQuery
+    with Session(engine) as session:
+        p = Proprietario(Nome='Mario', Cognome='Rossi', Telefono='061234')
+        session.add(p)
+        session.commit()
+        chiave = p.Id
+    casi = (('valore cambiato', chiave, {'Telefono': '3331234'}, (1, 1)),
+            ('valore uguale', chiave, {'Telefono': '3331234'}, (1, 0)),
+            ('riga inesistente', chiave + 1, {'Telefono': '3331234'}, (1, 0)))
+    errori = []
+    for caso, k, valori, attesi in casi:
+        with Session(engine) as session, ContaQuery(engine) as q:
+            aggiorna(session, Proprietario, k, valori)
+        if (q['SELECT'], q['UPDATE']) != attesi or q.totale != sum(attesi):
+            errori.append((caso, q['SELECT'], q['UPDATE'], attesi))
+    return errori
+
+if __name__ == '__main__':
+    import sys
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine('sqlite://')
+    prepara_schema(engine)
+    errori = verifica(engine)
+    for caso, select, update, attesi in errori:
+        print('%s: %d SELECT e %d UPDATE invece di %d e %d' % (caso, select, update, *attesi))
+    print('query degli aggiornamenti: %s' % ('corrette' if not errori else '%d casi non tornano' % len(errori)))
+    sys.exit(1 if errori else 0)
@@ -0,0 +1,147 @@
+# Inserimento delle anagrafiche (Fornitore, Marca, Meccanico, Modello) senza controllo preventivo: ogni blocco di
+# righe è scritto con un solo statement che gestisce da sé le righe già presenti, quindi niente doppio viaggio
+# verso il database e niente corse tra due utenti che controllano e poi inseriscono.
+#
+# Dove la chiave è univoca nel database (Fornitore.Nome, Meccanico.CF) si usa INSERT ... ON CONFLICT su SQLite e
+# INSERT ... ON DUPLICATE KEY UPDATE su MySQL. Marca.Nome e Modello (Nome, IdMarca) non sono univoci, perché dal menu
+# si può confermare un doppione: lì si usa INSERT ... SELECT ... WHERE NOT EXISTS, sempre uno statement per blocco.
+#
+# In caso di conflitto: IGNORA lascia la riga esistente, AGGIORNA le copia sopra le altre colonne, SEGNALA non
+# scrive e restituisce le chiavi già presenti (con una SELECT in più per blocco). Per una riga sola, come dal menu,
+# inserisci_se_manca() scrive con un solo statement e dice se la riga era già presente.
+#
+# Uso: python anagrafiche.py Marca marche.csv [--conflitto ignora|aggiorna|segnala] [--blocco 1000] [--url URL]
+from sqlalchemy import insert, update, select, exists, and_, tuple_, bindparam, UniqueConstraint
+from sqlalchemy.dialects import sqlite, mysql
+
+from modelli import *
+from cache_nomi import cache
+from lotto import conferma
+
+BLOCCO = 1000
+IGNORA, AGGIORNA, SEGNALA = 'ignora', 'aggiorna', 'segnala'
+
+# tabella -> colonne che identificano una riga già presente
+CHIAVI = {
+    Fornitore: ('Nome',),
+    Marca: ('Nome',),
+    Meccanico: ('CF',),
+    Modello: ('Nome', 'IdMarca'),
+}
+
+def univoca(tabella, chiave):
+    # True se il database ha un vincolo o un indice univoco esattamente su queste colonne
+    t = tabella.__table__
+    if len(chiave)==1 and t.c[chiave[0]].unique: return True
+    gruppi = [v.columns for v in t.constraints if isinstance(v, UniqueConstraint)] + [i.columns for i in t.indexes if i.unique]
+    return any(sorted(c.key for c in g)==sorted(chiave) for g in gruppi)
+
+def _nativo(dialetto, tabella, chiave, colonne, conflitto):
+    altre = [c for c in colonne if c not in chiave]
+    if dialetto=='mysql':
+        s = mysql.insert(tabella.__table__)
+        # senza colonne da aggiornare si riassegna la chiave: la riga resta com'è e non è un errore
+        valori = {c: s.inserted[c] for c in altre} if conflitto==AGGIORNA and altre else {chiave[0]: tabella.__table__.c[chiave[0]]}
+        return s.on_duplicate_key_update(valori)
+    s = sqlite.insert(tabella.__table__)
+    if conflitto==AGGIORNA and altre:
+        return s.on_conflict_do_update(index_elements=list(chiave), set_={c: s.excluded[c] for c in altre})
+    return s.on_conflict_do_nothing(index_elements=list(chiave))
+
+def _se_manca(tabella, chiave, colonne):
+    # INSERT ... SELECT :valori WHERE NOT EXISTS (riga con la stessa chiave)
+    colonna = {c.key: c for c in tabella.__table__.columns}
+    return insert(tabella.__table__).from_select(list(colonne), select(*[bindparam(c, type_=colonna[c].type) for c in colonne])
+                                       .where(~exists().where(and_(*[colonna[c]==bindparam(c, type_=colonna[c].type) for c in chiave]))))
+
+def _aggiorna(tabella, chiave, colonne):
+    colonna = {c.key: c for c in tabella.__table__.columns}
+    altre = [c for c in colonne if c not in chiave]
+    # i bindparam della WHERE hanno un prefisso: update() riserva i nomi delle colonne ai valori da scrivere
+    return (update(tabella.__table__).where(and_(*[colonna[c]==bindparam('k_' + c) for c in chiave]))
+            .values({c: bindparam(c) for c in altre})) if altre else None
+
+def presenti(session, tabella, chiave, righe):
+    # chiavi delle righe già presenti, con una query per blocco
+    colonne = [getattr(tabella, c) for c in chiave]
+    valori = {tuple(r.get(c) for c in chiave) for r in righe}
+    valori = [v for v in valori if None not in v]
+    if not valori: return set()
+    condizione = colonne[0].in_([v[0] for v in valori]) if len(chiave)==1 else tuple_(*colonne).in_(valori)
+    return {tuple(r) for r in session.execute(select(*colonne).where(condizione))}
+
+def upsert(session, tabella, righe, conflitto=IGNORA, blocco=BLOCCO):
+    # righe: dizionari colonna -> valore già convertito; restituisce le chiavi in conflitto (solo con SEGNALA)
+    if tabella not in CHIAVI: raise ValueError("upsert non previsto per %s" % tabella.__name__)
+    if conflitto not in (IGNORA, AGGIORNA, SEGNALA): raise ValueError("conflitto %s non valido" % conflitto)
+    chiave = CHIAVI[tabella]
+    nativo = univoca(tabella, chiave) and session.get_bind().dialect.name in ('sqlite', 'mysql')
+    righe = list(righe)
+    conflitti = []
+    for i in range(0, len(righe), blocco):
+        parte = righe[i:i+blocco]
+        if conflitto==SEGNALA:
+            esistenti = presenti(session, tabella, chiave, parte)
+            conflitti.extend(sorted(esistenti, key=str))
+            parte = [r for r in parte if tuple(r.get(c) for c in chiave) not in esistenti]
+            if not parte: continue
+        # le righe di un blocco devono avere le stesse colonne: si raggruppano per insieme di colonne
+        gruppi = {}
+        for r in parte:
+            gruppi.setdefault(tuple(sorted(r)), []).append(r)
+        for colonne, gruppo in gruppi.items():
+            if any(c not in colonne for c in chiave): raise ValueError("campo %s obbligatorio" % next(c for c in chiave if c not in colonne))
+            if nativo:
+                session.execute(_nativo(session.get_bind().dialect.name, tabella, chiave, colonne, conflitto), gruppo)
+                continue
+            if conflitto==AGGIORNA:
+                s = _aggiorna(tabella, chiave, colonne)
+                if s is not None: session.execute(s, [dict(r, **{'k_' + c: r[c] for c in chiave}) for r in gruppo])
+            session.execute(_se_manca(tabella, chiave, colonne), gruppo)
+        conferma(session)
+        # gli statement sulla Table non passano dagli eventi ORM che tengono aggiornata la cache dei nomi
+        cache.invalida(tabella)
+    return conflitti
+
+def inserisci_se_manca(session, tabella, valori):
+    # valori: colonna -> valore di una riga; True se è stata inserita, False se la chiave era già presente
+    if tabella not in CHIAVI: raise ValueError("upsert non previsto per %s" % tabella.__name__)
+    chiave, colonne = CHIAVI[tabella], tuple(sorted(valori))
+    if any(c not in colonne for c in chiave): raise ValueError("campo %s obbligatorio" % next(c for c in chiave if c not in colonne))
+    # su MySQL ON DUPLICATE KEY UPDATE conta come scritta anche la riga lasciata com'è, INSERT ... WHERE NOT EXISTS no
+    if univoca(tabella, chiave) and session.get_bind().dialect.name=='sqlite':
+        s = _nativo('sqlite', tabella, chiave, colonne, IGNORA)
+    else:
+        s = _se_manca(tabella, chiave, colonne)
+    inserita = session.execute(s, valori).rowcount==1
+    conferma(session)
+    cache.invalida(tabella)
+    return inserita
+
+if __name__ == '__main__':
+    import argparse
+    import importazione
+
+    parser = argparse.ArgumentParser(description='Sincronizza Fornitore, Marca, Meccanico o Modello da un file CSV o JSONL')
+    parser.add_argument('tabella', choices=[t.__name__ for t in CHIAVI])
+    parser.add_argument('file')
+    parser.add_argument('--conflitto', choices=(IGNORA, AGGIORNA, SEGNALA), default=IGNORA)
+    parser.add_argument('--blocco', type=int, default=BLOCCO)
+    parser.add_argument('--url', help='URL del database')
+    args = parser.parse_args()
+
+    from sqlalchemy.orm import sessionmaker
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    session = sessionmaker(bind=engine)()
+    tabella = cerca_tabella(args.tabella)
+    righe = []
+    for n, riga in importazione.leggi(args.file):
+        if isinstance(riga, str): riga = importazione.decodifica(riga)
+        righe.append(importazione.valori_riga(session, tabella, riga))
+    conflitti = upsert(session, tabella, righe, args.conflitto, args.blocco)
+    for k in conflitti:
+        print('Già presente: %s' % ', '.join(map(str, k)))
+    print('%s: %d righe lette, %d già presenti' % (tabella.__name__, len(righe), len(conflitti)) if args.conflitto==SEGNALA
+          else '%s: %d righe sincronizzate' % (tabella.__name__, len(righe)))
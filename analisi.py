@@ -0,0 +1,174 @@
+# Analisi di costi e margini con NumPy: ricavo per intervento (somma di Quantità * PrezzoUnitario in Usando),
+# costo medio d'acquisto per pezzo (somma dei Prezzo diviso somma delle QuantitàSpedita in tutte le spedizioni, anche
+# quelle archiviate da archivio.py) e da
+# questi i margini per pezzo e per meccanico, più la spesa per mese di spedizione (gli interventi non hanno una
+# data, quindi i mesi sono quelli delle spedizioni).
+#
+# Le righe sono lette a blocchi (yield_per) e ogni blocco diventa un array NumPy sommato con bincount in array
+# indicizzati per Id o per mese: la memoria dipende dal blocco e dal numero di chiavi, non dalle righe lette.
+# Le somme intere coincidono con i GROUP BY di sql(); i costi medi e i margini per pezzo sono calcolati con le
+# stesse operazioni e coincidono anch'essi, il costo per meccanico è una somma di decimali e può differire
+# solo nell'ultima cifra (l'ordine delle somme non è lo stesso).
+#
+# Uso: python analisi.py [--url URL] [--blocco 50000] [--formato testo|csv] {interventi,pezzi,meccanici,mesi}
+#      python analisi.py [--url URL] --verifica     (confronta tutti i risultati con i GROUP BY in SQL)
+import itertools
+
+import numpy as np
+from sqlalchemy import select, func, extract, case
+
+from modelli import *
+
+BLOCCO = 50000
+
+class Somme:
+    # somme per chiave intera non negativa (Id o mese) in array che crescono fino alla chiave più grande vista
+    def __init__(self, *colonne, decimali=()):
+        self.righe = np.zeros(0, np.int64)
+        self.somme = {c: np.zeros(0, np.float64 if c in decimali else np.int64) for c in colonne}
+
+    def aggiungi(self, chiavi, **valori):
+        if not len(chiavi): return
+        n = max(len(self.righe), int(chiavi.max()) + 1)
+        if n > len(self.righe):
+            self.righe = np.pad(self.righe, (0, n - len(self.righe)))
+            for c in self.somme: self.somme[c] = np.pad(self.somme[c], (0, n - len(self.somme[c])))
+        self.righe += np.bincount(chiavi, minlength=n)
+        for c, v in valori.items():
+            # bincount somma in float64: per gli interi il risultato è esatto fino a 2**53 per blocco
+            parziale = np.bincount(chiavi, weights=v, minlength=n)
+            self.somme[c] += parziale if self.somme[c].dtype==np.float64 else parziale.astype(np.int64)
+
+    def chiavi(self):
+        return np.flatnonzero(self.righe)
+
+def blocchi(conn, statement, blocco):
+    # un array (righe, colonne) di interi per ogni blocco letto; np.array sulle Row sarebbe trenta volte più lento
+    colonne = len(statement.selected_columns)
+    for righe in conn.execute(statement.execution_options(yield_per=blocco)).partitions():
+        yield np.fromiter(itertools.chain.from_iterable(righe), np.int64, len(righe) * colonne).reshape(len(righe), colonne)
+
+def mese(colonna):
+    return extract('year', colonna) * 12 + extract('month', colonna) - 1
+
+def testo_mese(m):
+    return '%04d-%02d' % (m // 12, m % 12 + 1)
+
+def _spedizioni():
+    s = spedizione_tutte.c
+    return select(s.IdPezzo, mese(s.DataSpedizione), func.coalesce(s.Prezzo, 0), func.coalesce(s.QuantitàSpedita, 0))
+
+def _utilizzi():
+    return (select(Usando.IdIntervento, Intervento.IdMeccanico, Usando.IdPezzo, func.coalesce(Usando.Quantità, 0), func.coalesce(Usando.PrezzoUnitario, 0))
+            .join(Intervento, Intervento.Id==Usando.IdIntervento))
+
+def costo_medio(spesa, quantità):
+    # costo unitario medio; 0 se non è stato spedito nulla (come in sql())
+    costo = np.zeros(len(spesa))
+    np.divide(spesa, quantità, out=costo, where=quantità > 0)
+    return costo
+
+def analizza(conn, blocco=BLOCCO):
+    # tabella -> colonna -> array, con le righe ordinate per chiave
+    pezzi = Somme('spesa', 'spediti', 'usati', 'ricavo')
+    mesi = Somme('spesa', 'spediti')
+    for a in blocchi(conn, _spedizioni(), blocco):
+        pezzi.aggiungi(a[:, 0], spesa=a[:, 2], spediti=a[:, 3])
+        mesi.aggiungi(a[:, 1], spesa=a[:, 2], spediti=a[:, 3])
+    costo = costo_medio(pezzi.somme['spesa'], pezzi.somme['spediti'])
+
+    interventi = Somme('ricavo')
+    meccanici = Somme('ricavo', 'costo', decimali=('costo',))
+    for a in blocchi(conn, _utilizzi(), blocco):
+        ricavo = a[:, 3] * a[:, 4]
+        interventi.aggiungi(a[:, 0], ricavo=ricavo)
+        pezzi.aggiungi(a[:, 2], usati=a[:, 3], ricavo=ricavo)
+        # un pezzo usato ma mai spedito ha Id oltre la fine di costo: costo 0
+        costo_riga = np.zeros(len(a))
+        noti = a[:, 2] < len(costo)
+        costo_riga[noti] = a[noti, 3] * costo[a[noti, 2]]
+        meccanici.aggiungi(a[:, 1], ricavo=ricavo, costo=costo_riga)
+    costo = costo_medio(pezzi.somme['spesa'], pezzi.somme['spediti'])
+
+    k = interventi.chiavi()
+    risultato = {'interventi': {'IdIntervento': k, 'Ricavo': interventi.somme['ricavo'][k]}}
+    k = pezzi.chiavi()
+    s = pezzi.somme
+    risultato['pezzi'] = {'IdPezzo': k, 'Spesa': s['spesa'][k], 'Spediti': s['spediti'][k], 'CostoMedio': costo[k],
+                          'Usati': s['usati'][k], 'Ricavo': s['ricavo'][k], 'Margine': s['ricavo'][k] - s['usati'][k] * costo[k]}
+    k = meccanici.chiavi()
+    s = meccanici.somme
+    risultato['meccanici'] = {'IdMeccanico': k, 'Ricavo': s['ricavo'][k], 'Costo': s['costo'][k], 'Margine': s['ricavo'][k] - s['costo'][k]}
+    k = mesi.chiavi()
+    s = mesi.somme
+    risultato['mesi'] = {'Mese': k, 'Spedizioni': mesi.righe[k], 'Spesa': s['spesa'][k], 'Spediti': s['spediti'][k],
+                         'CostoMedio': costo_medio(s['spesa'], s['spediti'])[k]}
+    return risultato
+
+def sql():
+    # gli stessi risultati di analizza() con GROUP BY, per la verifica
+    sp = spedizione_tutte.c
+    spesa, spediti = func.sum(func.coalesce(sp.Prezzo, 0)), func.sum(func.coalesce(sp.QuantitàSpedita, 0))
+    medio = lambda s, q: case((q > 0, s * 1.0 / q), else_=0.0)
+    acquisti = select(sp.IdPezzo, spesa.label('spesa'), spediti.label('spediti'), medio(spesa, spediti).label('costo')).group_by(sp.IdPezzo).subquery()
+    quantità = func.coalesce(Usando.Quantità, 0)
+    ricavo = quantità * func.coalesce(Usando.PrezzoUnitario, 0)
+    vendite = select(Usando.IdPezzo, func.sum(quantità).label('usati'), func.sum(ricavo).label('ricavo')).group_by(Usando.IdPezzo).subquery()
+    # pezzi spediti o usati: unione delle due chiavi
+    chiavi = select(acquisti.c.IdPezzo).union(select(vendite.c.IdPezzo)).subquery()
+    usati, ricavo_pezzo, costo = func.coalesce(vendite.c.usati, 0), func.coalesce(vendite.c.ricavo, 0), func.coalesce(acquisti.c.costo, 0.0)
+    costo_meccanico = func.sum(quantità * costo)
+    return {
+        'interventi': select(Usando.IdIntervento, func.sum(ricavo)).group_by(Usando.IdIntervento).order_by(Usando.IdIntervento),
+        'pezzi': (select(chiavi.c.IdPezzo, func.coalesce(acquisti.c.spesa, 0), func.coalesce(acquisti.c.spediti, 0), costo, usati, ricavo_pezzo,
+                         ricavo_pezzo - usati * costo)
+                  .outerjoin(acquisti, acquisti.c.IdPezzo==chiavi.c.IdPezzo).outerjoin(vendite, vendite.c.IdPezzo==chiavi.c.IdPezzo).order_by(chiavi.c.IdPezzo)),
+        'meccanici': (select(Intervento.IdMeccanico, func.sum(ricavo), costo_meccanico, func.sum(ricavo) - costo_meccanico)
+                      .join(Usando, Usando.IdIntervento==Intervento.Id).outerjoin(acquisti, acquisti.c.IdPezzo==Usando.IdPezzo)
+                      .group_by(Intervento.IdMeccanico).order_by(Intervento.IdMeccanico)),
+        'mesi': (select(mese(sp.DataSpedizione), func.count(), spesa, spediti, medio(spesa, spediti))
+                 .group_by(mese(sp.DataSpedizione)).order_by(mese(sp.DataSpedizione))),
+    }
+
+def verifica(conn, blocco=BLOCCO):
+    # elenco delle differenze tra analizza() e sql(): vuoto se coincidono
+    differenze = []
+    calcolati = analizza(conn, blocco)
+    for tabella, statement in sql().items():
+        attesi = conn.execute(statement).all()
+        colonne = calcolati[tabella]
+        if len(attesi) != len(next(iter(colonne.values()))):
+            differenze.append('%s: %d righe invece di %d' % (tabella, len(next(iter(colonne.values()))), len(attesi)))
+            continue
+        for i, (nome, valori) in enumerate(colonne.items()):
+            atteso = np.array([r[i] for r in attesi], dtype=valori.dtype)
+            # solo il costo per meccanico è una somma di decimali in ordine diverso
+            uguali = np.allclose(valori, atteso, rtol=1e-12, atol=0) if tabella=='meccanici' and nome != 'IdMeccanico' else np.array_equal(valori, atteso)
+            if not uguali: differenze.append('%s.%s diverso' % (tabella, nome))
+    return differenze
+
+if __name__ == '__main__':
+    import sys, argparse
+
+    parser = argparse.ArgumentParser(description='Ricavi, costi e margini per intervento, pezzo, meccanico e mese')
+    parser.add_argument('--url', help='URL del database')
+    parser.add_argument('--blocco', type=int, default=BLOCCO, help='righe lette per volta')
+    parser.add_argument('--formato', choices=('testo', 'csv'), default='testo')
+    parser.add_argument('--verifica', action='store_true', help='confronta i risultati con i GROUP BY in SQL')
+    parser.add_argument('tabella', nargs='?', choices=('interventi', 'pezzi', 'meccanici', 'mesi'))
+    args = parser.parse_args()
+    if not args.verifica and not args.tabella: parser.error('indicare una tabella oppure --verifica')
+
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    with engine.connect() as conn:
+        if args.verifica:
+            differenze = verifica(conn, args.blocco)
+            for d in differenze: print(d)
+            print('I risultati coincidono con SQL' if not differenze else '%d differenze' % len(differenze))
+            sys.exit(1 if differenze else 0)
+        colonne = analizza(conn, args.blocco)[args.tabella]
+    righe = zip(*[[testo_mese(m) for m in v] if nome=='Mese' else v.tolist() for nome, v in colonne.items()])
+    import comandi
+    comandi.scrivi(righe, list(colonne), args.formato, sys.stdout)
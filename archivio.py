@@ -0,0 +1,294 @@
+# Archivio delle spedizioni vecchie: archivia() sposta le spedizioni con DataSpedizione precedente a un limite in una
+# tabella per anno (spedizione_2015, spedizione_2016, ...), a blocchi di BLOCCO righe, ognuno nella sua transazione
+# (copia nell'archivio e cancellazione da spedizione insieme), così la tabella spedizione resta piccola per il menu,
+# le cascate e i backup. Le righe tengono il loro Id e le chiavi esterne verso pezzo e fornitore (con le stesse cascate
+# di spedizione). Ogni esecuzione è registrata in archiviazione: se si interrompe, riprendi() continua con lo stesso
+# limite (i blocchi già fatti sono confermati, gli altri sono ancora in spedizione).
+#
+# Le letture per data che devono vedere tutte le spedizioni (report 4, magazzino.py, analisi.py) usano la vista
+# spedizione_tutte (modelli.spedizione_tutte): spedizione e archivi in UNION ALL, ricreata quando si aggiunge un anno.
+# Il database porta la condizione sulla data dentro ogni ramo e ogni tabella ha l'indice su DataSpedizione, quindi un
+# anno fuori dall'intervallo costa una ricerca nell'indice (MySQL lo fa dalla versione 8.0.29).
+#
+# Spostare una spedizione non è una modifica dei dati: nella stessa transazione la giacenza (magazzino.py) viene
+# corretta per la cancellazione da spedizione e le cancellazioni non restano nel registro delle modifiche (modifiche.py).
+# Cancellare righe archiviate (a cascata da fornitore o pezzo, o con elimina_prima) aggiorna invece giacenza e registro
+# come per spedizione, con dei trigger sulle tabelle d'archivio; su MySQL, dove la cascata non esegue trigger, con dei
+# trigger su fornitore e pezzo.
+#
+# Gli Id non si riusano: su SQLite spedizione è AUTOINCREMENT (prepara() ricostruisce così le tabelle create prima) e il
+# contatore parte dall'Id più alto anche tra gli archivi; MySQL dalla 8.0 conserva il contatore anche al riavvio
+# (verifica controlla che non ci siano Id doppi). Una spedizione archiviata cercata per Id si può cancellare
+# (cancellazione.elimina passa all'archivio del suo anno) ma non modificare: aggiornamento la segnala come archiviata.
+#
+# Uso: python archivio.py [--url URL] archivia --prima-di 2020-01-01 [--blocco 5000]
+#      python archivio.py [--url URL] riprendi [--blocco 5000]
+#      python archivio.py [--url URL] stato | verifica
+import time, datetime
+
+from sqlalchemy import select, insert, delete, update, func, text, and_, union_all, bindparam, literal, MetaData, Table, Column, ForeignKey
+from sqlalchemy.schema import CreateTable
+
+from modelli import *
+from lotto import conferma
+from repliche import primario
+import modifiche
+
+BLOCCO = 5000
+
+_tabelle = MetaData()
+
+def tabella(anno):
+    # la tabella d'archivio di un anno: colonne, chiavi esterne e indici di Spedizione
+    nome = 'spedizione_%d' % anno
+    if nome not in _tabelle.tables:
+        colonne = []
+        for c in Spedizione.__table__.c:
+            esterne = [ForeignKey(fk.column, onupdate=fk.onupdate, ondelete=fk.ondelete) for fk in c.foreign_keys]
+            colonne.append(Column(c.name, c.type, *esterne, primary_key=c.primary_key, autoincrement=False, nullable=c.nullable,
+                                  index=bool(c.index or esterne) or None))
+        Table(nome, _tabelle, *colonne)
+    return _tabelle.tables[nome]
+
+def anni(conn):
+    return list(conn.scalars(select(Archivio.Anno).order_by(Archivio.Anno)))
+
+def vista(elenco):
+    # spedizione e gli archivi degli anni indicati, in UNION ALL con le colonne nello stesso ordine
+    rami = [select(*Spedizione.__table__.c)] + [select(*tabella(a).c) for a in elenco]
+    return union_all(*rami) if elenco else rami[0]
+
+def crea_vista(conn, elenco):
+    conn.execute(text('DROP VIEW IF EXISTS %s' % spedizione_tutte.name))
+    conn.execute(text('CREATE VIEW %s AS %s' % (spedizione_tutte.name, vista(elenco).compile(dialect=conn.dialect))))
+
+def _giacenza(riga):
+    return 'UPDATE giacenza SET Quantità = Quantità - COALESCE(%s.QuantitàSpedita, 0) WHERE IdPezzo = %s.IdPezzo;' % (riga, riga)
+
+def trigger(dialetto, elenco, registra):
+    # nome -> (momento e tabella, corpo): una riga archiviata cancellata esce dalla giacenza e, con registra,
+    # entra nel registro delle modifiche come cancellazione da spedizione
+    colonne = Spedizione.__table__.c
+    righe = {}
+    for a in elenco:
+        corpo = _giacenza('OLD')
+        if registra: corpo += modifiche.registra(dialetto, 'spedizione', 'D', modifiche.json_riga('OLD', colonne), None)
+        righe['archivio_%d_eliminata' % a] = ('AFTER DELETE ON spedizione_%d' % a, corpo)
+    if dialetto=='mysql' and elenco:
+        fornitore = pezzo = ''
+        for a in elenco:
+            fornitore += ('UPDATE giacenza g JOIN (SELECT x.IdPezzo, COALESCE(SUM(x.QuantitàSpedita), 0) AS q FROM spedizione_%d x '
+                          'WHERE x.IdFornitore = OLD.Id GROUP BY x.IdPezzo) c ON g.IdPezzo = c.IdPezzo SET g.Quantità = g.Quantità - c.q;' % a)
+            if registra:
+                fornitore += modifiche.registra(dialetto, 'spedizione', 'D', modifiche.json_riga('x', colonne), None, 'spedizione_%d x WHERE x.IdFornitore = OLD.Id' % a)
+                pezzo += modifiche.registra(dialetto, 'spedizione', 'D', modifiche.json_riga('x', colonne), None, 'spedizione_%d x WHERE x.IdPezzo = OLD.Id' % a)
+        righe['archivio_fornitore_eliminato'] = ('BEFORE DELETE ON fornitore', fornitore)
+        if pezzo: righe['archivio_pezzo_eliminato'] = ('BEFORE DELETE ON pezzo', pezzo)
+    return righe
+
+def togli_trigger(conn):
+    for nome in trigger(conn.dialect.name, anni(conn), True):
+        conn.execute(text('DROP TRIGGER IF EXISTS %s' % nome))
+
+def crea_trigger(conn):
+    # le cancellazioni vanno nel registro solo se i trigger di modifiche.py sono attivi (modifiche.py li ricrea quando cambia)
+    togli_trigger(conn)
+    for nome, (momento, corpo) in trigger(conn.dialect.name, anni(conn), modifiche.attive(conn)).items():
+        conn.execute(text('CREATE TRIGGER %s %s FOR EACH ROW BEGIN %s END' % (nome, momento, corpo)))
+
+def massimo_id(conn):
+    # Id più alto tra spedizione e archivi
+    return max([conn.scalar(select(func.max(Spedizione.Id))) or 0] + [conn.scalar(select(func.max(tabella(a).c.Id))) or 0 for a in anni(conn)])
+
+def _autoincremento(conn):
+    # SQLite: una spedizione creata senza AUTOINCREMENT si ricostruisce (copia, DROP, RENAME; il DROP non esegue i
+    # trigger, quindi la giacenza non cambia), poi il contatore parte dall'Id più alto, archivi compresi. Vista e trigger
+    # del magazzino li ricreano prepara() e magazzino.prepara(), quelli delle modifiche si ricreano qui se c'erano
+    sql = conn.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'spedizione'"))
+    if 'AUTOINCREMENT' not in sql.upper():
+        registra = modifiche.attive(conn)
+        conn.execute(text('DROP VIEW IF EXISTS %s' % spedizione_tutte.name))
+        # pezzo e fornitore nella stessa MetaData servono solo a risolvere le chiavi esterne
+        copie = MetaData()
+        for t in (Pezzo, Fornitore): t.__table__.to_metadata(copie)
+        nuova = Spedizione.__table__.to_metadata(copie, name='spedizione_nuova')
+        conn.execute(CreateTable(nuova))
+        conn.execute(insert(nuova).from_select([c.name for c in nuova.c], select(*Spedizione.__table__.c)))
+        conn.execute(text('DROP TABLE spedizione'))
+        conn.execute(text('ALTER TABLE spedizione_nuova RENAME TO spedizione'))
+        for indice in Spedizione.__table__.indexes:
+            indice.create(conn)
+        if registra: modifiche.crea_trigger(conn)
+    massimo = massimo_id(conn)
+    attuale = conn.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = 'spedizione'"))
+    if massimo > (attuale or 0):
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'spedizione'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('spedizione', :m)"), {'m': massimo})
+
+def prepara(engine):
+    # tabelle degli anni già archiviati, vista e trigger; all'avvio prima del magazzino, che legge la vista
+    with engine.begin() as conn:
+        if conn.dialect.name=='sqlite': _autoincremento(conn)
+        elenco = anni(conn)
+        for a in elenco:
+            tabella(a).create(conn, checkfirst=True)
+        crea_vista(conn, elenco)
+        crea_trigger(conn)
+
+def aggiungi_anni(engine, nuovi):
+    with engine.begin() as conn:
+        for a in sorted(nuovi):
+            tabella(a).create(conn, checkfirst=True)
+            conn.execute(insert(Archivio).values(Anno=a))
+        crea_vista(conn, anni(conn))
+        crea_trigger(conn)
+
+def sposta(conn, righe, registra):
+    # copia negli archivi e cancella da spedizione le righe (Id, DataSpedizione, IdPezzo, QuantitàSpedita)
+    colonne = Spedizione.__table__.c
+    per_anno = {}
+    for r in righe:
+        per_anno.setdefault(r.DataSpedizione.year, []).append(r.Id)
+    for a, chiavi in per_anno.items():
+        conn.execute(insert(tabella(a)).from_select([c.name for c in colonne], select(*colonne).where(Spedizione.Id.in_(chiavi))))
+    chiavi = [r.Id for r in righe]
+    ultima = conn.scalar(select(func.max(Modifica.Id))) if registra else None
+    conn.execute(delete(Spedizione).where(Spedizione.Id.in_(chiavi)))
+    # i trigger del magazzino hanno tolto i pezzi dalla giacenza: sono ancora spediti, si rimettono
+    quantità = {}
+    for r in righe:
+        quantità[r.IdPezzo] = quantità.get(r.IdPezzo, 0) + (r.QuantitàSpedita or 0)
+    valori = [{'pezzo': p, 'q': q} for p, q in quantità.items() if q]
+    if valori: conn.execute(update(Giacenza).where(Giacenza.IdPezzo==bindparam('pezzo')).values(Quantità=Giacenza.Quantità + bindparam('q')), valori)
+    if registra:
+        # e le cancellazioni appena scritte dai trigger di modifiche.py non sono modifiche dei dati
+        conn.execute(delete(Modifica).where(and_(Modifica.Id > (ultima or 0), Modifica.Tabella=='spedizione', Modifica.Operazione=='D',
+                                                 func.json_extract(Modifica.Prima, '$.Id').in_(chiavi))))
+
+def esegui(engine, esecuzione, blocco=BLOCCO, avanzamento=None):
+    # sposta a blocchi le spedizioni dell'esecuzione indicata; avanzamento(spostate, secondi) dopo ogni blocco.
+    # Restituisce (righe spostate, secondi)
+    with engine.connect() as conn:
+        limite = conn.scalar(select(Archiviazione.Limite).where(Archiviazione.Id==esecuzione))
+        registra = modifiche.attive(conn)
+        noti = set(anni(conn))
+    # l'indice su DataSpedizione dà le righe più vecchie senza leggere la tabella
+    prossime = (select(Spedizione.Id, Spedizione.DataSpedizione, Spedizione.IdPezzo, Spedizione.QuantitàSpedita)
+                .where(Spedizione.DataSpedizione < limite).order_by(Spedizione.DataSpedizione, Spedizione.Id).limit(blocco))
+    spostate, inizio = 0, time.perf_counter()
+    while True:
+        with engine.begin() as conn:
+            righe = conn.execute(prossime).all()
+            # un anno nuovo: la sua tabella si crea fuori da questa transazione (su MySQL CREATE TABLE conferma la transazione)
+            mancanti = {r.DataSpedizione.year for r in righe} - noti
+            if righe and not mancanti:
+                sposta(conn, righe, registra)
+                conn.execute(update(Archiviazione).where(Archiviazione.Id==esecuzione).values(Spostate=Archiviazione.Spostate + len(righe)))
+            elif not righe:
+                conn.execute(update(Archiviazione).where(Archiviazione.Id==esecuzione).values(Fine=datetime.datetime.now()))
+        if not righe: break
+        if mancanti:
+            aggiungi_anni(engine, mancanti)
+            noti |= mancanti
+            continue
+        spostate += len(righe)
+        if avanzamento: avanzamento(spostate, time.perf_counter() - inizio)
+    return spostate, time.perf_counter() - inizio
+
+def archivia(engine, limite, blocco=BLOCCO, avanzamento=None):
+    # nuova esecuzione: archivia le spedizioni con DataSpedizione < limite
+    with engine.begin() as conn:
+        esecuzione = conn.execute(insert(Archiviazione).values(Limite=limite, Spostate=0, Inizio=datetime.datetime.now())).inserted_primary_key[0]
+    return esegui(engine, esecuzione, blocco, avanzamento)
+
+def riprendi(engine, blocco=BLOCCO, avanzamento=None):
+    # continua l'ultima esecuzione interrotta; None se non ce ne sono
+    with engine.connect() as conn:
+        esecuzione = conn.scalar(select(func.max(Archiviazione.Id)).where(Archiviazione.Fine.is_(None)))
+    if esecuzione is None: return None
+    return esegui(engine, esecuzione, blocco, avanzamento)
+
+def anno_di(session, chiave):
+    # anno dell'archivio che contiene la spedizione con questo Id, None se non è archiviata; una sola query
+    elenco = anni(session)
+    if not elenco: return None
+    return session.scalar(union_all(*[select(literal(a)).where(tabella(a).c.Id==chiave) for a in elenco]))
+
+def elimina(session, chiave):
+    # come cancellazione.elimina per una spedizione archiviata: giacenza e registro li aggiornano i trigger dell'archivio
+    a = anno_di(session, chiave)
+    if a is None: return 0
+    n = session.execute(delete(tabella(a)).where(tabella(a).c.Id==chiave)).rowcount
+    conferma(session)
+    return n
+
+def elimina_prima(session, data, blocco=BLOCCO):
+    # come cancellazione.elimina_dove per le spedizioni archiviate con DataSpedizione < data; restituisce quante
+    primario(session)
+    totale = 0
+    for a in anni(session):
+        if datetime.date(a, 1, 1) >= data: continue
+        t = tabella(a)
+        while True:
+            chiavi = session.scalars(select(t.c.Id).where(t.c.DataSpedizione < data).order_by(t.c.Id).limit(blocco)).all()
+            if not chiavi: break
+            totale += session.execute(delete(t).where(t.c.Id.in_(chiavi))).rowcount
+            conferma(session)
+    return totale
+
+def stato(conn):
+    # (anno o 'spedizione', righe) e l'ultima esecuzione
+    righe = [('spedizione', conn.scalar(select(func.count()).select_from(Spedizione)))]
+    righe += [(a, conn.scalar(select(func.count()).select_from(tabella(a)))) for a in anni(conn)]
+    ultima = conn.execute(select(Archiviazione).order_by(Archiviazione.Id.desc()).limit(1)).first()
+    return righe, ultima
+
+def doppi(conn):
+    # Id presenti sia in spedizione sia in un archivio (o in due archivi): devono essere nessuno
+    tutte = spedizione_tutte
+    return list(conn.scalars(select(tutte.c.Id).group_by(tutte.c.Id).having(func.count() > 1)))
+
+if __name__ == '__main__':
+    import sys, argparse
+
+    parser = argparse.ArgumentParser(description='Archivio per anno delle spedizioni vecchie')
+    parser.add_argument('--url', help='URL del database')
+    sotto = parser.add_subparsers(dest='comando', required=True)
+    p = sotto.add_parser('archivia', help='sposta negli archivi le spedizioni precedenti alla data')
+    p.add_argument('--prima-di', required=True, type=datetime.date.fromisoformat, help='yyyy-mm-dd')
+    p.add_argument('--blocco', type=int, default=BLOCCO)
+    p = sotto.add_parser('riprendi', help="continua l'ultima archiviazione interrotta")
+    p.add_argument('--blocco', type=int, default=BLOCCO)
+    sotto.add_parser('stato', help='righe in spedizione e in ogni archivio, ultima archiviazione')
+    sotto.add_parser('verifica', help='Id doppi tra spedizione e archivi e giacenza calcolata su tutte le spedizioni')
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema
+    import magazzino
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    avanzamento = lambda n, secondi: print('\r%d spedizioni archiviate, %.0f al secondo' % (n, n / secondi), end='', flush=True)
+    if args.comando in ('archivia', 'riprendi'):
+        try:
+            risultato = archivia(engine, args.prima_di, args.blocco, avanzamento) if args.comando=='archivia' else riprendi(engine, args.blocco, avanzamento)
+        except KeyboardInterrupt:
+            print('\nInterrotto: python archivio.py riprendi per continuare')
+            sys.exit(1)
+        if risultato is None:
+            print('Nessuna archiviazione da riprendere')
+        else:
+            n, secondi = risultato
+            print('\r%d spedizioni archiviate in %.1f s (%.0f al secondo)' % (n, secondi, n / secondi if secondi else 0))
+    elif args.comando=='stato':
+        with engine.connect() as conn:
+            righe, ultima = stato(conn)
+        for nome, n in righe:
+            print('%-12s %10d' % (nome, n))
+        if ultima:
+            print('Ultima archiviazione: prima del %s, %d spostate, %s' % (ultima.Limite, ultima.Spostate, 'finita il %s' % ultima.Fine if ultima.Fine else 'da riprendere'))
+    else:
+        with engine.connect() as conn:
+            ripetuti, differenze = doppi(conn), magazzino.differenze(conn)
+        print('Id doppi: %s' % (', '.join(map(str, ripetuti[:20])) or 'nessuno'))
+        print('Giacenza: %s' % ('%d pezzi non tornano' % len(differenze) if differenze else 'corretta'))
+        if ripetuti or differenze: sys.exit(1)
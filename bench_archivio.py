@@ -0,0 +1,87 @@
+# Archivio delle spedizioni (archivio.py): velocità dell'archiviazione e letture per data prima e dopo.
+# Uso: python bench_archivio.py [--interventi 200000] [--prima-di 2025-01-01] [--blocco 5000] [--ripetizioni 20] [--cartella .]
+# Su una copia del database generato misura il report 4 su un periodo recente, su uno vecchio e su tutto, la giacenza
+# a una data passata, la lettura di una pagina e di tutta la tabella spedizione; poi archivia le spedizioni precedenti alla data
+# (spedizioni al secondo), ripete le misure e controlla che i risultati siano gli stessi.
+import os, time, shutil, datetime
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+
+from modelli import *
+from connessione import prepara_schema
+import generatore, report, magazzino, consultazione, archivio
+
+INTERVENTI = 200000
+RIPETIZIONI = 20
+SOLO_SPEDIZIONE = ('pagina di spedizioni', 'tutta la tabella spedizione')
+
+def prepara(n, cartella):
+    base = os.path.join(cartella, 'bench_archivio_%d.db' % n)
+    if not os.path.exists(base):
+        engine = create_engine('sqlite:///' + base)
+        prepara_schema(engine)
+        generatore.genera(engine, n)
+        engine.dispose()
+    copia = base[:-3] + '.copia.db'
+    shutil.copyfile(base, copia)
+    return copia
+
+def letture(session):
+    # nome -> funzione che restituisce il risultato della lettura
+    return {
+        'report 4 ultimo anno': lambda: sorted(map(tuple, report.esegui(session, 4, dal='2025-01-01', al='2025-12-31'))),
+        'report 4 un anno vecchio': lambda: sorted(map(tuple, report.esegui(session, 4, dal='2016-01-01', al='2016-12-31'))),
+        'report 4 tutto': lambda: sorted(map(tuple, report.esegui(session, 4))),
+        'giacenza al 2018-06-30': lambda: magazzino.giacenza_al(session.connection(), datetime.date(2018, 6, 30)),
+        'pagina di spedizioni': lambda: [tuple(r) for r in consultazione.righe(session, Spedizione, None)],
+        'tutta la tabella spedizione': lambda: sum(1 for _ in consultazione.scorri_righe(session, Spedizione)),
+    }
+
+def misura(session, ripetizioni):
+    # nome -> (millisecondi per lettura, risultato)
+    risultati = {}
+    for nome, f in letture(session).items():
+        f()
+        inizio = time.perf_counter()
+        for _ in range(ripetizioni): risultato = f()
+        risultati[nome] = ((time.perf_counter() - inizio) * 1000 / ripetizioni, risultato)
+    return risultati
+
+if __name__ == '__main__':
+    import sys, argparse
+
+    parser = argparse.ArgumentParser(description="Velocità dell'archivio delle spedizioni e letture prima e dopo")
+    parser.add_argument('--interventi', type=int, default=INTERVENTI)
+    parser.add_argument('--prima-di', type=datetime.date.fromisoformat, default=datetime.date(2025, 1, 1))
+    parser.add_argument('--blocco', type=int, default=archivio.BLOCCO)
+    parser.add_argument('--ripetizioni', type=int, default=RIPETIZIONI)
+    parser.add_argument('--cartella', default='.')
+    args = parser.parse_args()
+
+    copia = prepara(args.interventi, args.cartella)
+    engine = create_engine('sqlite:///' + copia)
+    prepara_schema(engine)
+    with Session(engine) as session:
+        prima = misura(session, args.ripetizioni)
+        calde = session.scalar(select(func.count()).select_from(Spedizione))
+    n, secondi = archivio.archivia(engine, args.prima_di, args.blocco)
+    with Session(engine) as session:
+        dopo = misura(session, args.ripetizioni)
+        rimaste = session.scalar(select(func.count()).select_from(Spedizione))
+        differenze = magazzino.differenze(session.connection())
+    print('archiviate %d spedizioni su %d in %.2f s: %.0f al secondo (blocchi da %d); in spedizione ne restano %d'
+          % (n, calde, secondi, n / secondi, args.blocco, rimaste))
+    print('%-28s %10s %10s  %s' % ('lettura', 'prima ms', 'dopo ms', 'risultato'))
+    diversi = 0
+    for nome in prima:
+        # le letture della sola tabella spedizione cambiano per forza: ora ci sono solo le spedizioni rimaste
+        solo = nome in SOLO_SPEDIZIONE
+        uguale = prima[nome][1]==dopo[nome][1]
+        diversi += not (uguale or solo)
+        esito = 'solo le rimaste' if solo else 'uguale' if uguale else 'DIVERSO'
+        print('%-28s %10.2f %10.2f  %s' % (nome, prima[nome][0], dopo[nome][0], esito))
+    print('giacenza: %s' % ('corretta' if not differenze else '%d pezzi non tornano' % len(differenze)))
+    engine.dispose()
+    os.remove(copia)
+    if diversi or differenze: sys.exit(1)
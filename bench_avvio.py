@@ -0,0 +1,34 @@
+# Tempo di avvio a freddo fino al primo menu: create_all a ogni avvio (prima)
+# contro il controllo della versione dello schema (dopo). Ogni misura è un processo nuovo.
+# Uso: python bench_avvio.py [URL] [ripetizioni]
+import sys, time, subprocess, statistics
+
+PRIMA = '''
+from sqlalchemy import create_engine
+from modelli import Base
+s = time.perf_counter()
+engine = create_engine(URL)
+Base.metadata.create_all(engine)
+'''
+
+DOPO = '''
+from connessione import crea_engine, prepara_schema
+s = time.perf_counter()
+engine = crea_engine(URL)
+prepara_schema(engine)
+'''
+
+def avvio(url, codice):
+    # restituisce (durata del processo, import, preparazione dello schema)
+    programma = 'import time\nt = time.perf_counter()\nURL = %r\n%s\nprint(s - t, time.perf_counter() - s)' % (url, codice)
+    inizio = time.perf_counter()
+    uscita = subprocess.run([sys.executable, '-c', programma], check=True, capture_output=True, text=True).stdout.split()
+    return (time.perf_counter() - inizio,) + tuple(float(x) for x in uscita)
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else 'sqlite:///bench_avvio.db'
+    ripetizioni = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    avvio(url, DOPO)  # crea lo schema e registra la versione
+    for nome, codice in (('prima', PRIMA), ('dopo', DOPO)):
+        misure = [avvio(url, codice) for _ in range(ripetizioni)]
+        print('%-6s processo %7.1f ms   import %7.1f ms   schema %7.2f ms' % ((nome,) + tuple(statistics.median(m[i] for m in misure) * 1000 for i in range(3))))
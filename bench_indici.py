@@ -0,0 +1,65 @@
+# Misura i tre report del menu (risp==4) e le ricerche più frequenti prima e dopo migrazione.py.
+# Uso: python bench_indici.py [interventi] [file.db]
+# Il database viene popolato (se non esiste), gli indici dichiarati in modelli.py vengono rimossi,
+# si misura, si esegue la migrazione e si misura di nuovo.
+import os, sys, time, random, datetime, statistics
+
+from sqlalchemy import create_engine, select, func, text
+from sqlalchemy.orm import sessionmaker
+
+from modelli import *
+import migrazione, report, generatore
+from connessione import prepara_schema
+
+def operazioni(session, n):
+    d = generatore.dimensioni(n)
+    modelli = [m for nomi in generatore.MODELLI.values() for m in nomi]
+    return [
+        ('report 1', 5, lambda: report.esegui(session, 1).all()),
+        ('report 2', 5, lambda: report.esegui(session, 2).all()),
+        ('report 3', 5, lambda: report.esegui(session, 3).all()),
+        ('Città.Nome', 200, lambda: session.scalar(select(Città.Id).where(Città.Nome==random.choice(generatore.CITTÀ)))),
+        ('Modello.Nome', 200, lambda: session.scalar(select(Modello.Id).where(Modello.Nome==random.choice(modelli)))),
+        ('Fornitore.Nome', 200, lambda: session.scalar(select(Fornitore.Id).where(Fornitore.Nome==generatore.fornitore(random.randint(1, d['Fornitore']))))),
+        ('Automobile.Targa', 200, lambda: session.scalar(select(Automobile.Id).where(Automobile.Targa==generatore.targa(random.randint(1, d['Automobile']))))),
+        ('Intervento per meccanico', 20, lambda: session.scalar(select(func.count()).where(Intervento.IdMeccanico==random.randint(1, d['Meccanico'])))),
+        ('Intervento per automobile', 200, lambda: session.execute(select(Intervento.Id).where(Intervento.IdAutomobile==random.randint(1, d['Automobile']))).all()),
+        ('Spedizione per settimana', 20, lambda: session.execute(select(Spedizione.Id).where(Spedizione.DataSpedizione.between(datetime.date(2020, 3, 2), datetime.date(2020, 3, 8)))).all()),
+        ('Usando per pezzo', 20, lambda: session.execute(select(Usando.IdIntervento).where(Usando.IdPezzo==random.randint(1, d['Pezzo']))).all()),
+        ('Recensione per intervento', 200, lambda: session.execute(select(Recensione.Id).where(Recensione.IdIntervento==random.randint(1, n))).all()),
+    ]
+
+def misura(session, n):
+    risultati = {}
+    for nome, ripetizioni, f in operazioni(session, n):
+        tempi = []
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            f()
+            tempi.append((time.perf_counter() - inizio) * 1000)
+        risultati[nome] = statistics.median(tempi)
+    return risultati
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    percorso = sys.argv[2] if len(sys.argv) > 2 else 'bench_indici.db'
+    engine = create_engine('sqlite:///' + percorso)
+    if not os.path.exists(percorso):
+        print('Popolo %s con %d interventi...' % (percorso, n))
+        prepara_schema(engine)
+        generatore.genera(engine, n)
+    with engine.begin() as conn:
+        for tabella in Base.metadata.sorted_tables:
+            for indice in tabella.indexes:
+                conn.execute(text('DROP INDEX IF EXISTS "%s"' % indice.name))
+    session = sessionmaker(bind=engine)()
+    prima = misura(session, n)
+    session.close()
+    inizio = time.perf_counter()
+    creati = migrazione.aggiungi_indici(engine)
+    print('Migrazione: %d indici creati in %.1f s' % (len(creati), time.perf_counter() - inizio))
+    session = sessionmaker(bind=engine)()
+    dopo = misura(session, n)
+    print('%-28s %12s %12s' % ('operazione', 'prima (ms)', 'dopo (ms)'))
+    for nome in prima:
+        print('%-28s %12.2f %12.2f' % (nome, prima[nome], dopo[nome]))
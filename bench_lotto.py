@@ -0,0 +1,88 @@
+# Confronto tra il commit a ogni riga e la modalità a lotti (lotto.py) su un database generato.
+# Uso: python bench_lotto.py [--righe 2000] [--blocchi 10 100 1000] [--cartella .]
+# Ogni modalità inserisce le stesse recensioni (una su cinquanta con un Voto fuori dal CheckConstraint),
+# aggiorna altrettante durate di interventi e riporta le righe al secondo; le righe rifiutate devono essere le stesse.
+import os, sys, time, random, shutil
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+from modelli import *
+from connessione import prepara_schema
+from lotto import Lotto
+import generatore, importazione, aggiornamento
+
+INTERVENTI = 10000
+
+def prepara(cartella):
+    base = os.path.join(cartella, 'bench_lotto_%d.db' % INTERVENTI)
+    if not os.path.exists(base):
+        engine = create_engine('sqlite:///' + base)
+        prepara_schema(engine)
+        generatore.genera(engine, INTERVENTI)
+        engine.dispose()
+    copia = base[:-3] + '.copia.db'
+    shutil.copyfile(base, copia)
+    return copia
+
+def operazioni(n):
+    d = generatore.dimensioni(INTERVENTI)
+    r = random.Random(1)
+    ops = []
+    for i in range(n):
+        voto = 9 if i % 50 == 7 else r.randint(0, 5)
+        ops.append((Recensione, {'Commento': 'Prova %d' % i, 'Voto': str(voto), 'IdProprietario': str(r.randint(1, d['Proprietario'])),
+                                 'IdIntervento': str(r.randint(1, d['Intervento']))}))
+        ops.append((Intervento, r.randint(1, d['Intervento']), {'Durata': r.randint(15, 480)}))
+    return ops
+
+def esegui(session, op):
+    if len(op)==2: importazione.inserisci(session, op[0], op[1])
+    else: aggiornamento.aggiorna(session, op[0], op[1], op[2])
+
+def misura(cartella, ops, blocco):
+    copia = prepara(cartella)
+    engine = create_engine('sqlite:///' + copia)
+    session = sessionmaker(bind=engine)()
+    rifiutate = []
+    inizio = time.perf_counter()
+    if blocco is None:
+        # comportamento di sempre: commit a ogni riga, rollback se fallisce
+        for n, op in enumerate(ops):
+            try:
+                esegui(session, op)
+            except Exception:
+                session.rollback()
+                rifiutate.append(n)
+    else:
+        with Lotto(session, blocco) as lotto:
+            for n, op in enumerate(ops):
+                with lotto.riga(n):
+                    esegui(session, op)
+        rifiutate = [n for n, e in lotto.errori]
+    durata = time.perf_counter() - inizio
+    recensioni = session.scalar(select(func.count()).select_from(Recensione))
+    session.close()
+    engine.dispose()
+    os.remove(copia)
+    return durata, rifiutate, recensioni
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Commit a ogni riga contro modalità a lotti')
+    parser.add_argument('--righe', type=int, default=2000, help='recensioni da inserire (e interventi da aggiornare)')
+    parser.add_argument('--blocchi', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--cartella', default='.')
+    args = parser.parse_args()
+
+    ops = operazioni(args.righe)
+    riferimento = None
+    for blocco in [None] + args.blocchi:
+        durata, rifiutate, recensioni = misura(args.cartella, ops, blocco)
+        nome = 'commit a ogni riga' if blocco is None else 'lotto da %d' % blocco
+        print('%-20s %8.2f s %10.0f operazioni/s  %d rifiutate  %d recensioni' % (nome, durata, len(ops) / durata, len(rifiutate), recensioni))
+        if riferimento is None: riferimento = (rifiutate, recensioni)
+        elif (rifiutate, recensioni) != riferimento:
+            print('ERRORE: risultato diverso dal commit a ogni riga', file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,91 @@
+# Costo del registro delle modifiche (modifiche.py) sulle scritture e velocità di spedizione nel file.
+# Uso: python bench_modifiche.py [--interventi 10000] [--ripetizioni 200] [--cartella .]
+# Le stesse scritture (modifica di un intervento con l'ORM, recensione nuova, UPDATE di 500 interventi con
+# session.execute, cancellazione di un'automobile con le sue cascate), ognuna con il suo commit, su due copie del
+# database generato: senza e con i trigger delle modifiche. Poi spedisce nel registro tutte le modifiche raccolte
+# (modifiche al secondo, dimensione del file, fsync) e rilegge il registro controllando che i numeri siano consecutivi.
+import os, time, random, shutil
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+
+from modelli import *
+from connessione import prepara_schema
+import generatore, cancellazione, modifiche
+
+INTERVENTI = 10000
+RIPETIZIONI = 200
+
+def prepara(n, cartella, nome):
+    base = os.path.join(cartella, 'bench_modifiche_%d.db' % n)
+    if not os.path.exists(base):
+        engine = create_engine('sqlite:///' + base)
+        prepara_schema(engine)
+        generatore.genera(engine, n)
+        engine.dispose()
+    copia = os.path.join(cartella, nome)
+    shutil.copyfile(base, copia)
+    return copia
+
+def scritture(session, d, r):
+    # nome -> funzione che esegue e conferma una scrittura
+    automobili = iter(r.sample(range(1, d['Automobile'] + 1), d['Automobile']))
+    def aggiorna():
+        session.get(Intervento, r.randint(1, d['Intervento'])).Durata = r.randint(15, 480)
+    def inserisci():
+        session.add(Recensione(Commento='Prova', Voto=r.randint(0, 5), IdProprietario=r.randint(1, d['Proprietario']), IdIntervento=r.randint(1, d['Intervento'])))
+    def blocco():
+        inizio = r.randint(1, d['Intervento'] - 500)
+        session.execute(update(Intervento).where(Intervento.Id.between(inizio, inizio + 499)).values(Durata=Intervento.Durata + 1))
+    def elimina():
+        cancellazione.elimina(session, Automobile, next(automobili))
+    return {'aggiorna': aggiorna, 'inserisci': inserisci, 'update 500': blocco, 'elimina': elimina}
+
+def misura(percorso, n, ripetizioni):
+    # nome -> millisecondi medi per scrittura confermata
+    engine = create_engine('sqlite:///' + percorso)
+    risultati = {}
+    with Session(engine) as session:
+        for nome, f in scritture(session, generatore.dimensioni(n), random.Random(1)).items():
+            inizio = time.perf_counter()
+            for _ in range(ripetizioni):
+                f()
+                session.commit()
+            risultati[nome] = (time.perf_counter() - inizio) * 1000 / ripetizioni
+    engine.dispose()
+    return risultati
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Costo dei trigger delle modifiche e spedizione nel registro')
+    parser.add_argument('--interventi', type=int, default=INTERVENTI)
+    parser.add_argument('--ripetizioni', type=int, default=RIPETIZIONI)
+    parser.add_argument('--cartella', default='.')
+    args = parser.parse_args()
+
+    senza = prepara(args.interventi, args.cartella, 'bench_modifiche_senza.db')
+    con = prepara(args.interventi, args.cartella, 'bench_modifiche_con.db')
+    engine = create_engine('sqlite:///' + con)
+    with engine.begin() as conn:
+        modifiche.crea_trigger(conn)
+    engine.dispose()
+    prima, dopo = misura(senza, args.interventi, args.ripetizioni), misura(con, args.interventi, args.ripetizioni)
+    print('%-12s %12s %12s %10s' % ('scrittura', 'senza ms', 'con ms', 'in più'))
+    for nome in prima:
+        print('%-12s %12.3f %12.3f %9.0f%%' % (nome, prima[nome], dopo[nome], (dopo[nome] / prima[nome] - 1) * 100))
+
+    percorso = os.path.join(args.cartella, 'bench_modifiche.log')
+    if os.path.exists(percorso): os.remove(percorso)
+    engine = create_engine('sqlite:///' + con)
+    registro = modifiche.Registro(percorso)
+    inizio = time.perf_counter()
+    n = modifiche.spedisci(engine, registro)
+    durata = time.perf_counter() - inizio
+    registro.chiudi()
+    print('spedite %d modifiche in %.2f s: %.0f al secondo, %d fsync, %.1f MB (%.0f byte a modifica)'
+          % (n, durata, n / durata, registro.sincronizzazioni, os.path.getsize(percorso) / 2**20, os.path.getsize(percorso) / max(n, 1)))
+    numeri = [r['n'] for _, r in modifiche.leggi(percorso)]
+    print('registro: %d record, numeri consecutivi: %s' % (len(numeri), 'sì' if numeri==list(range(1, len(numeri) + 1)) else 'NO'))
+    engine.dispose()
+    for f in (senza, con, percorso): os.remove(f)
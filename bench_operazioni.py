@@ -0,0 +1,252 @@
+# Benchmark delle operazioni del menu, chiamate attraverso gli stessi moduli usati da Officina2.py
+# e da comandi.py (niente input()): visualizza di ogni tabella, inserimenti, aggiornamenti,
+# cancellazioni con le loro cascate, lo storico di un'automobile e i report. Per ogni dimensione il database viene generato
+# una volta con generatore.py e ogni esecuzione lavora su una copia, così le misure restano confrontabili.
+#
+# Uso: python bench_operazioni.py [--dimensioni 1000 10000 100000] [--ripetizioni 20] [--uscita risultati.json]
+#                                 [--confronta base.json] [--soglia 0.25]
+#      python bench_operazioni.py --resistenza 100000 [--dimensioni 1000] [--crescita 20] [--sessione-unica]
+#
+# Il risultato è un JSON con, per dimensione e operazione, i percentili della latenza in ms, le query
+# eseguite e il picco di memoria allocata da Python. Con --confronta il programma termina con codice 1
+# se un'operazione è più lenta della base oltre la soglia, o se esegue più query.
+#
+# Con --resistenza le operazioni vengono eseguite a rotazione, ognuna con una sessione nuova come nel menu
+# (--sessione-unica: tutte con la stessa sessione, come prima); il JSON riporta la memoria del processo ai punti
+# di controllo e il programma termina con codice 1 se dopo il riscaldamento (il primo decimo) cresce oltre --crescita MB.
+import os, sys, json, time, random, shutil, sqlite3, datetime, platform, resource, tracemalloc, itertools
+
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from modelli import *
+from connessione import prepara_schema, sessioni
+from strumentazione import ContaQuery
+import generatore, consultazione, importazione, aggiornamento, cancellazione, report, storico
+
+DIMENSIONI = (1000, 10000, 100000)
+RIPETIZIONI = 20
+SOGLIA = 0.25
+# sotto questa differenza (in ms) un peggioramento è rumore di misura (il commit su disco oscilla di circa 1 ms)
+MINIMO_MS = 1.0
+SEME = 1
+CRESCITA_MB = 20
+PUNTI = 20
+TARGHE_STORICO = 10
+
+def prepara(n, cartella):
+    # database generato una volta sola per dimensione; si misura sempre su una copia
+    base = os.path.join(cartella, 'bench_operazioni_%d.db' % n)
+    if not os.path.exists(base):
+        engine = create_engine('sqlite:///' + base)
+        prepara_schema(engine)
+        generatore.genera(engine, n)
+        engine.dispose()
+    copia = base[:-3] + '.copia.db'
+    shutil.copyfile(base, copia)
+    return copia
+
+def operazioni(session, n):
+    # nome -> funzione che esegue una volta l'operazione; ogni chiamata usa valori nuovi
+    d = generatore.dimensioni(n)
+    r = random.Random(SEME)
+    contatore = iter(range(1, 10**9))
+    # a rotazione: nelle esecuzioni lunghe le chiavi già cancellate tornano e la cancellazione non trova nulla
+    cancellabili = {t: itertools.cycle(r.sample(range(1, d[t] + 1), d[t])) for t in ('Proprietario', 'Automobile', 'Intervento')}
+
+    def visualizza(tabella):
+        # una schermata del menu a partire da un punto qualsiasi della tabella
+        def f():
+            chiave = tabella.__mapper__.primary_key
+            dopo = (r.randint(0, d.get(tabella.__name__, n)),) + (0,) * (len(chiave) - 1)
+            for riga in consultazione.righe(session, tabella, dopo):
+                tuple(riga)
+        return f
+
+    def inserisci(tabella, valori):
+        def f():
+            importazione.inserisci(session, tabella, valori(next(contatore)))
+        return f
+
+    def aggiorna(tabella, chiave, valori):
+        def f():
+            aggiornamento.aggiorna(session, tabella, chiave(), valori())
+        return f
+
+    def elimina(nome):
+        def f():
+            cancellazione.elimina(session, cerca_tabella(nome), next(cancellabili[nome]))
+        return f
+
+    def esegui_report(numero):
+        def f():
+            report.esegui(session, numero).all()
+        return f
+
+    # targhe fisse, non estratte da r: le stesse automobili qualunque siano le operazioni scelte con --operazione
+    targhe = itertools.cycle([generatore.targa(i) for i in range(1, d['Automobile'] + 1, max(1, d['Automobile'] // TARGHE_STORICO))])
+
+    def storico_auto():
+        # il numero di query non deve dipendere dalla lunghezza dello storico (--confronta segnala se cresce)
+        session.expunge_all()
+        storico.storico(session, next(targhe))
+
+    ops = {'visualizza %s' % t.__name__: visualizza(t) for t in TABELLE}
+    ops['storico Automobile'] = storico_auto
+    ops.update({
+        'inserisci Città': inserisci(Città, lambda i: {'Nome': 'Città di prova %d' % i}),
+        'inserisci Proprietario': inserisci(Proprietario, lambda i: {'Nome': 'Mario', 'Cognome': 'Rossi', 'Email': 'prova%d@esempio.it' % i,
+                                                                      'Telefono': '061234', 'Città': r.choice(generatore.CITTÀ)}),
+        'inserisci Automobile': inserisci(Automobile, lambda i: {'Targa': generatore.targa(d['Automobile'] + i), 'IdProprietario': str(r.randint(1, d['Proprietario'])),
+                                                                  'Modello': 'Panda'}),
+        'inserisci Intervento': inserisci(Intervento, lambda i: {'Durata': '60', 'Descrizione': 'Tagliando', 'IdMeccanico': str(r.randint(1, d['Meccanico'])),
+                                                                  'Targa': generatore.targa(r.randint(1, d['Automobile']))}),
+        'inserisci Spedizione': inserisci(Spedizione, lambda i: {'Prezzo': '100', 'DataSpedizione': '2024-05-01', 'QuantitàSpedita': '10',
+                                                                  'IdPezzo': str(r.randint(1, d['Pezzo'])), 'Fornitore': generatore.fornitore(r.randint(1, d['Fornitore']))}),
+        'aggiorna Proprietario': aggiorna(Proprietario, lambda: r.randint(1, d['Proprietario']), lambda: {'Telefono': '3%09d' % r.randrange(10**9)}),
+        'aggiorna Automobile': aggiorna(Automobile, lambda: r.randint(1, d['Automobile']), lambda: {'IdModello': r.randint(1, d['Modello'])}),
+        'aggiorna Intervento': aggiorna(Intervento, lambda: r.randint(1, n), lambda: {'Durata': r.randint(15, 480)}),
+        'elimina Proprietario': elimina('Proprietario'),
+        'elimina Automobile': elimina('Automobile'),
+        'elimina Intervento': elimina('Intervento'),
+    })
+    ops.update({'report %d' % numero: esegui_report(numero) for numero in report.REPORT})
+    return ops
+
+def percentile(valori, p):
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(round(p / 100 * (len(valori) - 1))))]
+
+def misura(f, ripetizioni):
+    f()  # riscaldamento: cache del database e della compilazione delle query
+    tempi = []
+    with ContaQuery() as q:
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            f()
+            tempi.append((time.perf_counter() - inizio) * 1000)
+    # la memoria si misura a parte: tracemalloc rallenterebbe le misure dei tempi
+    tracemalloc.start()
+    f()
+    picco = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'p50_ms': percentile(tempi, 50), 'p90_ms': percentile(tempi, 90), 'p99_ms': percentile(tempi, 99),
+            'max_ms': max(tempi), 'query': q.totale / ripetizioni, 'memoria_kb': picco / 1024}
+
+def esegui(dimensioni, ripetizioni, cartella='.', filtro=None):
+    risultati = {}
+    for n in dimensioni:
+        copia = prepara(n, cartella)
+        engine = create_engine('sqlite:///' + copia)
+        session = sessionmaker(bind=engine)()
+        risultati[str(n)] = {}
+        for nome, f in operazioni(session, n).items():
+            if filtro and filtro not in nome: continue
+            risultati[str(n)][nome] = misura(f, ripetizioni)
+            print('%8d  %-26s p50 %8.2f ms  p99 %8.2f ms  %5.1f query' % (n, nome, risultati[str(n)][nome]['p50_ms'],
+                                                                        risultati[str(n)][nome]['p99_ms'], risultati[str(n)][nome]['query']), file=sys.stderr)
+        session.close()
+        engine.dispose()
+        os.remove(copia)
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin': picco //= 1024
+    return {'ambiente': {'data': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                         'sqlalchemy': sqlalchemy.__version__, 'sqlite': sqlite3.sqlite_version,
+                         'ripetizioni': ripetizioni, 'picco_rss_kb': picco},
+            'risultati': risultati}
+
+def memoria_kb():
+    # memoria residente attuale (Linux); altrove il picco, che comunque non scende
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return picco // 1024 if sys.platform=='darwin' else picco
+
+def resistenza(n, totale, cartella='.', unica=False):
+    # totale operazioni a rotazione; memoria e oggetti nella sessione ai punti di controllo
+    copia = prepara(n, cartella)
+    engine = create_engine('sqlite:///' + copia)
+    registro = sessioni(engine)
+    session = sessionmaker(bind=engine)() if unica else registro
+    ops = list(operazioni(session, n).items())
+    punti, errori = [], {}
+    passo = max(1, totale // PUNTI)
+    inizio = time.perf_counter()
+    for i in range(totale):
+        nome, f = ops[i % len(ops)]
+        try:
+            f()
+        except Exception:
+            # ad esempio un inserimento su un'automobile cancellata prima: si conta e si continua
+            errori[nome] = errori.get(nome, 0) + 1
+            session.rollback()
+        if not unica: registro.remove()
+        if (i + 1) % passo==0 or i + 1==totale:
+            oggetti = len(session.identity_map) if unica else 0
+            punti.append({'operazioni': i + 1, 'rss_kb': memoria_kb(), 'oggetti_sessione': oggetti})
+            print('%10d operazioni  %8d kB  %6d oggetti nella sessione' % (i + 1, punti[-1]['rss_kb'], oggetti), file=sys.stderr)
+    durata = time.perf_counter() - inizio
+    session.close()
+    engine.dispose()
+    os.remove(copia)
+    # crescita dopo il riscaldamento: dal punto al primo decimo delle operazioni all'ultimo
+    base = next(p for p in punti if p['operazioni'] >= totale / 10)
+    return {'dimensione': n, 'operazioni': totale, 'sessione': 'unica' if unica else 'per operazione',
+            'durata_s': durata, 'errori': errori, 'punti': punti, 'crescita_kb': punti[-1]['rss_kb'] - base['rss_kb']}
+
+def confronta(base, attuale, soglia=SOGLIA):
+    # restituisce l'elenco delle regressioni rispetto alla base (solo operazioni presenti in entrambe)
+    regressioni = []
+    for n, misure in attuale['risultati'].items():
+        for nome, m in misure.items():
+            b = base['risultati'].get(n, {}).get(nome)
+            if b is None: continue
+            if m['p50_ms'] > b['p50_ms'] * (1 + soglia) and m['p50_ms'] - b['p50_ms'] > MINIMO_MS:
+                regressioni.append('%s (%s): p50 %.2f ms, base %.2f ms' % (nome, n, m['p50_ms'], b['p50_ms']))
+            if m['query'] > b['query']:
+                regressioni.append('%s (%s): %.1f query, base %.1f' % (nome, n, m['query'], b['query']))
+    return regressioni
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark delle operazioni del menu su database SQLite generati')
+    parser.add_argument('--dimensioni', type=int, nargs='+', default=DIMENSIONI, help='numero di interventi dei database di prova')
+    parser.add_argument('--ripetizioni', type=int, default=RIPETIZIONI)
+    parser.add_argument('--operazione', help='misura solo le operazioni il cui nome contiene questo testo')
+    parser.add_argument('--cartella', default='.', help='dove tenere i database generati')
+    parser.add_argument('--uscita', help='file JSON dei risultati (altrimenti stdout)')
+    parser.add_argument('--confronta', help='JSON di una esecuzione precedente da usare come base')
+    parser.add_argument('--soglia', type=float, default=SOGLIA, help='peggioramento relativo del p50 tollerato (0.25 = 25%%)')
+    parser.add_argument('--resistenza', type=int, metavar='OPERAZIONI', help='esecuzione lunga sulla prima dimensione per controllare la memoria')
+    parser.add_argument('--crescita', type=float, default=CRESCITA_MB, help='crescita della memoria tollerata dopo il riscaldamento, in MB')
+    parser.add_argument('--sessione-unica', action='store_true', help='con --resistenza: una sola sessione per tutte le operazioni')
+    args = parser.parse_args()
+
+    if args.resistenza:
+        risultato = resistenza(args.dimensioni[0], args.resistenza, args.cartella, args.sessione_unica)
+        testo = json.dumps(risultato, indent=2, ensure_ascii=False)
+        if args.uscita:
+            with open(args.uscita, 'w', encoding='utf-8') as f: f.write(testo + '\n')
+        else:
+            print(testo)
+        if risultato['crescita_kb'] > args.crescita * 1024:
+            print('MEMORIA cresciuta di %.1f MB dopo il riscaldamento' % (risultato['crescita_kb'] / 1024), file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    risultati = esegui(args.dimensioni, args.ripetizioni, args.cartella, args.operazione)
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    if args.uscita:
+        with open(args.uscita, 'w', encoding='utf-8') as f: f.write(testo + '\n')
+    else:
+        print(testo)
+    if args.confronta:
+        with open(args.confronta, encoding='utf-8') as f:
+            regressioni = confronta(json.load(f), risultati, args.soglia)
+        for r in regressioni:
+            print('REGRESSIONE ' + r, file=sys.stderr)
+        sys.exit(1 if regressioni else 0)
@@ -0,0 +1,84 @@
+# Ricerca di targhe con l'indice in memoria (ricerca.py) contro le query SQL di oggi, su un milione di targhe.
+# Uso: python bench_ricerca.py [--targhe 1000000] [--ricerche 2000] [--sql 50]
+# Costruisce l'indice dalle targhe di generatore.targa e ne riporta tempo e memoria; poi, per prefissi di 1-2
+# caratteri (più corti di un trigramma: solo per prefisso) e parti di 3-5 caratteri prese da targhe a caso,
+# la latenza p50 e p99 dell'indice (i primi 20 risultati) e delle stesse ricerche in SQLite (tabella in memoria con
+# Id e Targa univoca come in Automobile: intervallo per il prefisso come modelli.inizia_per, LIKE '%parte%' per la parte). Le due ricerche devono trovare le stesse targhe.
+import sys, time, random, resource
+
+from sqlalchemy import create_engine, select, insert, MetaData, Table, Column, Integer, String
+
+from modelli import *
+import generatore, ricerca
+
+def percentile(valori, p):
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(round(p / 100 * (len(valori) - 1))))]
+
+def ricerche(n, quante, r):
+    # (tipo, testo): prefissi e parti di targhe esistenti
+    elenco = []
+    for _ in range(quante):
+        t = generatore.targa(r.randint(1, n))
+        if r.random() < 0.5: elenco.append(('prefisso', t[:r.randint(1, ricerca.N - 1)]))
+        else:
+            lunghezza = r.randint(3, 5)
+            inizio = r.randint(1, len(t) - lunghezza)
+            elenco.append(('parte', t[inizio:inizio + lunghezza]))
+    return elenco
+
+def misura(f, elenco):
+    tempi = {}
+    for tipo, testo in elenco:
+        inizio = time.perf_counter()
+        f(tipo, testo)
+        tempi.setdefault(tipo, []).append((time.perf_counter() - inizio) * 1e6)
+    return tempi
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Indice di ricerca in memoria contro LIKE in SQLite")
+    parser.add_argument('--targhe', type=int, default=1000000)
+    parser.add_argument('--ricerche', type=int, default=2000)
+    parser.add_argument('--sql', type=int, default=50, help='ricerche da fare anche in SQL (sono lente)')
+    args = parser.parse_args()
+
+    targhe = [(i, generatore.targa(i)) for i in range(1, args.targhe + 1)]
+    indice = ricerca.Indice(Automobile.Targa)
+    # picco di memoria del processo prima e dopo (in kB su Linux)
+    prima = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inizio = time.perf_counter()
+    indice.costruisci(targhe)
+    durata = time.perf_counter() - inizio
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - prima
+    print('indice: %d targhe in %.2f s, %.1f MB (memoria()), picco del processo +%.1f MB' % (args.targhe, durata,
+                                                                                          sum(indice.memoria().values()) / 2**20, picco / 1024))
+    for parte, byte in indice.memoria().items():
+        print('    %-10s %8.1f MB' % (parte, byte / 2**20))
+
+    r = random.Random(1)
+    elenco = ricerche(args.targhe, args.ricerche, r)
+    tempi = misura(lambda tipo, testo: indice.cerca(testo, ricerca.LIMITE), elenco)
+    for tipo, valori in sorted(tempi.items()):
+        print('indice %-9s p50 %8.1f µs  p99 %8.1f µs' % (tipo, percentile(valori, 50), percentile(valori, 99)))
+
+    # le stesse ricerche in SQL, su una parte delle ricerche
+    engine = create_engine('sqlite://')
+    tabella = Table('automobile', MetaData(), Column('Id', Integer, primary_key=True), Column('Targa', String, unique=True, nullable=False))
+    tabella.create(engine)
+    conn = engine.connect()
+    conn.execute(insert(tabella), [{'Id': i, 'Targa': t} for i, t in targhe])
+    def condizione(tipo, testo):
+        return inizia_per(tabella.c.Targa, testo) if tipo=='prefisso' else tabella.c.Targa.like('%' + testo + '%')
+    def sql(tipo, testo):
+        return conn.execute(select(tabella.c.Id).where(condizione(tipo, testo)).order_by(tabella.c.Targa).limit(ricerca.LIMITE)).scalars().all()
+    campione = elenco[:args.sql]
+    tempi = misura(sql, campione)
+    for tipo, valori in sorted(tempi.items()):
+        print('SQL    %-9s p50 %8.1f µs  p99 %8.1f µs' % (tipo, percentile(valori, 50), percentile(valori, 99)))
+    # stesse targhe trovate (l'ordine può differire: l'indice mette prima quelle che iniziano per la parte)
+    for tipo, testo in campione:
+        if set(indice.cerca(testo, 10**9)) != set(conn.execute(select(tabella.c.Id).where(condizione(tipo, testo))).scalars()):
+            print('ERRORE: risultati diversi per %s %s' % (tipo, testo), file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,78 @@
+# Confronto, per ognuna delle dodici tabelle, tra la lettura con oggetti ORM più view() (consultazione.scorri)
+# e la lettura delle stesse colonne con Core (consultazione.scorri_righe) su un database generato.
+# Uso: python bench_righe.py [--interventi 100000] [--cartella .]
+# Per ogni tabella: tempo di CPU per leggere tutte le righe e memoria per tenerle tutte in una lista,
+# riportati a 100000 righe (le tabelle piccole sono lette più volte, fino ad almeno 100000 righe).
+import os, sys, time, tracemalloc
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+from modelli import *
+from connessione import prepara_schema
+import generatore, consultazione
+
+RIGHE = 100000
+
+def prepara(interventi, cartella):
+    percorso = os.path.join(cartella, 'bench_righe_%d.db' % interventi)
+    if not os.path.exists(percorso):
+        engine = create_engine('sqlite:///' + percorso)
+        prepara_schema(engine)
+        generatore.genera(engine, interventi)
+        engine.dispose()
+    return percorso
+
+def orm(session, tabella):
+    return [r.view() for r in consultazione.scorri(session, tabella, 1000)]
+
+def core(session, tabella):
+    return consultazione.scorri_righe(session, tabella, 1000).all()
+
+def cpu(Session, leggi, tabella, n):
+    # letture ripetute fino ad almeno RIGHE righe, ognuna con una sessione nuova come un comando list
+    giri = max(1, -(-RIGHE // max(n, 1)))
+    inizio = time.process_time()
+    for _ in range(giri):
+        session = Session()
+        leggi(session, tabella)
+        session.close()
+    return (time.process_time() - inizio) / (giri * n) * RIGHE
+
+def memoria(Session, tabella, n, modo):
+    # memoria occupata tenendo tutte le righe: oggetti ORM nella sessione oppure tuple Core
+    session = Session()
+    tracemalloc.start()
+    if modo=='orm': righe = session.query(tabella).all()
+    else: righe = core(session, tabella)
+    occupata = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    session.close()
+    return occupata / n * RIGHE / 1024
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Lettura con oggetti ORM contro tuple Core, per tabella')
+    parser.add_argument('--interventi', type=int, default=100000, help='dimensione del database generato')
+    parser.add_argument('--cartella', default='.')
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite:///' + prepara(args.interventi, args.cartella))
+    Session = sessionmaker(bind=engine)
+    # secondi di CPU e MB per 100000 righe
+    print('%-12s %8s  %10s %10s %6s  %10s %10s %6s' % ('tabella', 'righe', 'CPU ORM', 'CPU Core', 'x', 'MB ORM', 'MB Core', 'x'))
+    for tabella in TABELLE:
+        with engine.connect() as conn:
+            n = conn.scalar(select(func.count()).select_from(tabella))
+        if not n: continue
+        # le due letture devono dare le stesse tuple
+        session = Session()
+        if orm(session, tabella) != [tuple(r) for r in core(session, tabella)]:
+            print('ERRORE: %s letta in modo diverso' % tabella.__name__, file=sys.stderr)
+            sys.exit(1)
+        session.close()
+        t_orm, t_core = cpu(Session, orm, tabella, n), cpu(Session, core, tabella, n)
+        m_orm, m_core = memoria(Session, tabella, n, 'orm'), memoria(Session, tabella, n, 'core')
+        print('%-12s %8d  %10.3f %10.3f %6.1f  %10.1f %10.1f %6.1f' % (tabella.__name__, n, t_orm, t_core, t_orm / t_core,
+                                                                     m_orm / 1024, m_core / 1024, m_orm / m_core))
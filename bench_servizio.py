@@ -0,0 +1,104 @@
+# Prova di carico del servizio asincrono (servizio.py): N clienti contemporanei, ognuno come un terminale che
+# fa una richiesta dopo l'altra (elenchi, report, inserimenti di recensioni, modifiche di interventi, cancellazioni
+# di pezzi usati), per un numero di secondi fisso. Per ogni numero di clienti: richieste al secondo, latenza p50 e p99
+# e richieste fallite; ogni livello lavora su una copia nuova del database generato.
+# Con SQLite in locale il database risponde subito e il limite è la CPU: --latenza aggiunge a ogni query un'attesa
+# asincrona come il viaggio di rete verso un database su un'altra macchina, che è il tempo che i clienti in
+# parallelo riescono a sovrapporre.
+# Uso: python bench_servizio.py [--clienti 1 2 4 8 16 32] [--secondi 10] [--interventi 10000] [--latenza 2] [--cartella .]
+#      python bench_servizio.py --url mysql+aiomysql://... [--clienti ...]   (database già popolato, nessuna copia)
+import os, time, random, shutil, asyncio
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.util import await_
+
+from modelli import *
+from connessione import prepara_schema
+from servizio import Servizio, crea_engine_async
+import generatore, report
+
+CLIENTI = (1, 2, 4, 8, 16, 32)
+SECONDI = 10
+INTERVENTI = 10000
+
+def prepara(interventi, cartella):
+    base = os.path.join(cartella, 'bench_servizio_%d.db' % interventi)
+    if not os.path.exists(base):
+        engine = create_engine('sqlite:///' + base)
+        prepara_schema(engine)
+        generatore.genera(engine, interventi)
+        engine.dispose()
+    copia = base[:-3] + '.copia.db'
+    shutil.copyfile(base, copia)
+    return copia
+
+def pagina(servizio, d, r):
+    # una pagina a partire da un punto qualsiasi di una tabella qualsiasi
+    tabella = r.choice(TABELLE)
+    dopo = (r.randint(0, d.get(tabella.__name__, d['Intervento'])),) + (0,) * (len(tabella.__mapper__.primary_key) - 1)
+    return servizio.elenca(tabella, dopo)
+
+def richieste(servizio, d, r):
+    # (nome, peso, funzione che restituisce la coroutine di una richiesta)
+    return [
+        ('elenca', 40, lambda: pagina(servizio, d, r)),
+        ('report', 15, lambda: servizio.report(r.choice(sorted(report.REPORT)))),
+        ('inserisci', 15, lambda: servizio.inserisci(Recensione, {'Commento': 'Carico', 'Voto': str(r.randint(0, 5)),
+                                                                  'IdProprietario': str(r.randint(1, d['Proprietario'])),
+                                                                  'IdIntervento': str(r.randint(1, d['Intervento']))})),
+        ('aggiorna', 25, lambda: servizio.aggiorna(Intervento, r.randint(1, d['Intervento']), {'Durata': str(r.randint(15, 480))})),
+        ('elimina', 5, lambda: servizio.elimina(Usando, (r.randint(1, d['Intervento']), r.randint(1, d['Pezzo'])))),
+    ]
+
+async def cliente(servizio, d, seme, fine, tempi, errori):
+    r = random.Random(seme)
+    tipi = richieste(servizio, d, r)
+    pesi = [p for _, p, _ in tipi]
+    while time.perf_counter() < fine:
+        nome, _, f = r.choices(tipi, pesi)[0]
+        inizio = time.perf_counter()
+        try:
+            await f()
+        except Exception:
+            errori[nome] = errori.get(nome, 0) + 1
+        tempi.append((time.perf_counter() - inizio) * 1000)
+
+async def livello(url, n, clienti, secondi, latenza=0):
+    engine = crea_engine_async(url, pool_size=clienti, max_overflow=0)
+    if latenza:
+        # l'attesa cede il controllo agli altri clienti, come una risposta che arriva dalla rete
+        event.listen(engine.sync_engine, 'before_cursor_execute', lambda *a: await_(asyncio.sleep(latenza / 1000)))
+    servizio = Servizio(engine)
+    d = generatore.dimensioni(n)
+    tempi, errori = [], {}
+    fine = time.perf_counter() + secondi
+    inizio = time.perf_counter()
+    await asyncio.gather(*[cliente(servizio, d, i, fine, tempi, errori) for i in range(clienti)])
+    durata = time.perf_counter() - inizio
+    await servizio.chiudi()
+    return len(tempi) / durata, tempi, errori
+
+def percentile(valori, p):
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(round(p / 100 * (len(valori) - 1))))]
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Richieste al secondo del servizio asincrono al crescere dei clienti')
+    parser.add_argument('--clienti', type=int, nargs='+', default=CLIENTI)
+    parser.add_argument('--secondi', type=float, default=SECONDI, help='durata di ogni livello')
+    parser.add_argument('--interventi', type=int, default=INTERVENTI, help='dimensione del database generato')
+    parser.add_argument('--cartella', default='.')
+    parser.add_argument('--latenza', type=float, default=0, help='millisecondi di attesa simulata per ogni query')
+    parser.add_argument('--url', help='database già popolato da usare al posto della copia SQLite')
+    args = parser.parse_args()
+
+    print('%8s %12s %10s %10s  %s' % ('clienti', 'richieste/s', 'p50 ms', 'p99 ms', 'fallite'))
+    for clienti in args.clienti:
+        copia = None if args.url else prepara(args.interventi, args.cartella)
+        url = args.url or 'sqlite:///' + copia
+        al_secondo, tempi, errori = asyncio.run(livello(url, args.interventi, clienti, args.secondi, args.latenza))
+        if copia: os.remove(copia)
+        print('%8d %12.0f %10.2f %10.2f  %s' % (clienti, al_secondo, percentile(tempi, 50), percentile(tempi, 99),
+                                                 ', '.join('%s %d' % e for e in sorted(errori.items())) or '-'))
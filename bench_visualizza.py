@@ -0,0 +1,60 @@
+# Confronto tra la vecchia visualizza() (query(...).all()) e la lettura a blocchi di consultazione.py.
+# Uso: python bench_visualizza.py [righe] [file.db]
+# Ogni modalità gira in un processo separato, così il picco di RSS è misurato in modo indipendente.
+import os, sys, time, resource, subprocess
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import consultazione
+from modelli import Base, Proprietario, Marca, Modello, Meccanico, Automobile, Intervento
+
+def popola(percorso, n):
+    engine = create_engine('sqlite:///' + percorso)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Marca), [{'Id': 1, 'Nome': 'Fiat'}])
+        conn.execute(insert(Modello), [{'Id': 1, 'Nome': 'Panda', 'IdMarca': 1}])
+        conn.execute(insert(Proprietario), [{'Id': 1, 'Nome': 'Mario', 'Cognome': 'Rossi', 'Telefono': '000'}])
+        conn.execute(insert(Meccanico), [{'Id': 1, 'Nome': 'Luigi', 'Cognome': 'Verdi'}])
+        conn.execute(insert(Automobile), [{'Id': 1, 'Targa': 'EA000AA', 'IdProprietario': 1, 'IdModello': 1}])
+        blocco = []
+        for i in range(1, n+1):
+            blocco.append({'Id': i, 'Durata': i % 300, 'Descrizione': 'Tagliando completo n. %d' % i, 'IdMeccanico': 1, 'IdAutomobile': 1})
+            if len(blocco)==10000:
+                conn.execute(insert(Intervento), blocco)
+                blocco = []
+        if blocco: conn.execute(insert(Intervento), blocco)
+    engine.dispose()
+
+def misura(percorso, modalita):
+    engine = create_engine('sqlite:///' + percorso)
+    session = sessionmaker(bind=engine)()
+    nulla = open(os.devnull, 'w')
+    inizio = time.perf_counter()
+    primo = None
+    if modalita=='all':
+        righe = session.query(Intervento).all()
+    elif modalita=='scorri':
+        righe = consultazione.scorri(session, Intervento)
+    else:
+        righe = consultazione.pagina(session, Intervento)
+    for r in righe:
+        print(r.view(), file=nulla)
+        if primo is None: primo = time.perf_counter() - inizio
+    totale = time.perf_counter() - inizio
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin': picco //= 1024
+    print('%-8s primo record %8.1f ms   totale %8.1f ms   picco RSS %7.1f MB' % (modalita, primo*1000, totale*1000, picco/1024))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1]=='--misura':
+        misura(sys.argv[2], sys.argv[3])
+        sys.exit()
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    percorso = sys.argv[2] if len(sys.argv) > 2 else 'bench_visualizza.db'
+    if not os.path.exists(percorso):
+        print('Popolo %s con %d interventi...' % (percorso, n))
+        popola(percorso, n)
+    for modalita in ('all', 'scorri', 'pagina'):
+        subprocess.run([sys.executable, __file__, '--misura', percorso, modalita], check=True)
@@ -0,0 +1,95 @@
+# Cache in memoria per tradurre nomi (Città.Nome, Modello.Nome, Automobile.Targa, Fornitore.Nome, ...)
+# nell'Id corrispondente senza interrogare ogni volta il database.
+# Le voci di una tabella vengono scartate quando l'applicazione la modifica (ORM o update/delete
+# eseguiti con session.execute); il ttl opzionale copre le modifiche fatte da altri processi.
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from modelli import Base
+
+class CacheNomi:
+    def __init__(self, capacita=1024, ttl=None):
+        self.capacita = capacita
+        self.ttl = ttl
+        self.voci = OrderedDict()
+        self.hit = 0
+        self.miss = 0
+
+    def locale(self, colonna, valore):
+        # solo memoria: restituisce l'Id oppure None se la voce manca o è scaduta
+        chiave = (colonna.class_.__tablename__, colonna.key, valore)
+        voce = self.voci.get(chiave)
+        if voce is None:
+            self.miss += 1
+            return None
+        if self.ttl is not None and time.monotonic() - voce[1] > self.ttl:
+            del self.voci[chiave]
+            self.miss += 1
+            return None
+        self.voci.move_to_end(chiave)
+        self.hit += 1
+        return voce[0]
+
+    def metti(self, colonna, valore, i):
+        chiave = (colonna.class_.__tablename__, colonna.key, valore)
+        self.voci[chiave] = (i, time.monotonic())
+        self.voci.move_to_end(chiave)
+        while len(self.voci) > self.capacita:
+            self.voci.popitem(last=False)
+
+    def cerca(self, session, colonna, valore):
+        # i nomi inesistenti non vengono memorizzati: un inserimento successivo li troverebbe comunque
+        i = self.locale(colonna, valore)
+        if i is None:
+            tabella = colonna.class_
+            i = session.scalar(select(tabella.Id).where(colonna==valore).order_by(tabella.Id).limit(1))
+            if i is not None: self.metti(colonna, valore, i)
+        return i
+
+    def invalida(self, tabella=None, cascata=False):
+        # con cascata=True si scartano anche le tabelle che il database svuota per ON DELETE CASCADE
+        if tabella is None:
+            self.voci.clear()
+            return
+        nomi = dipendenti(tabella.__table__) if cascata else {tabella.__tablename__}
+        for chiave in [k for k in self.voci if k[0] in nomi]:
+            del self.voci[chiave]
+
+    def statistiche(self):
+        totale = self.hit + self.miss
+        return {'hit': self.hit, 'miss': self.miss, 'voci': len(self.voci), 'capacita': self.capacita,
+                'hit_rate': self.hit / totale if totale else 0.0}
+
+def dipendenti(tabella):
+    nomi = {tabella.name}
+    for figlia in Base.metadata.sorted_tables:
+        if figlia.name in nomi: continue
+        for fk in figlia.foreign_keys:
+            if fk.column.table is tabella and fk.ondelete=='CASCADE':
+                nomi |= dipendenti(figlia)
+                break
+    return nomi
+
+cache = CacheNomi()
+
+@event.listens_for(Base, 'after_insert', propagate=True)
+@event.listens_for(Base, 'after_update', propagate=True)
+def _modifica_orm(mapper, connection, target):
+    cache.invalida(mapper.class_)
+
+@event.listens_for(Base, 'after_delete', propagate=True)
+def _cancellazione_orm(mapper, connection, target):
+    cache.invalida(mapper.class_, cascata=True)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _modifica_statement(stato):
+    if (stato.is_insert or stato.is_update or stato.is_delete) and stato.bind_mapper is not None:
+        cache.invalida(stato.bind_mapper.class_, cascata=stato.is_delete)
+
+@event.listens_for(Session, 'after_rollback')
+def _annullamento(session):
+    # una voce letta dentro una transazione annullata potrebbe riferirsi a una riga mai confermata
+    cache.invalida()
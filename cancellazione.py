@@ -0,0 +1,45 @@
+# Cancellazioni che lasciano le cascate al database (ON DELETE CASCADE / SET NULL sulle chiavi esterne):
+# eliminare un proprietario è un solo DELETE, anche con anni di interventi collegati,
+# invece di caricare in memoria automobili, interventi, recensioni e pezzi usati.
+from sqlalchemy import delete, select, and_, tuple_
+
+from lotto import conferma
+from repliche import primario
+
+BLOCCO = 1000
+
+def condizione_chiave(tabella, chiave):
+    # chiave è l'Id, oppure la tupla (IdIntervento, IdPezzo) per Usando
+    colonne = tabella.__mapper__.primary_key
+    if not isinstance(chiave, tuple): chiave = (chiave,)
+    return and_(*[c==v for c, v in zip(colonne, chiave)])
+
+def elimina(session, tabella, chiave):
+    # restituisce il numero di righe eliminate (0 se la chiave non esiste)
+    primario(session)
+    r = session.execute(delete(tabella).where(condizione_chiave(tabella, chiave)).execution_options(synchronize_session=False))
+    conferma(session)
+    session.expire_all()
+    if r.rowcount==0 and tabella.__name__=='Spedizione':
+        # forse è una spedizione già archiviata
+        import archivio
+        return archivio.elimina(session, chiave)
+    return r.rowcount
+
+def elimina_dove(session, tabella, condizione, blocco=BLOCCO):
+    # cancellazione per criterio a blocchi di chiavi, ognuno nella sua transazione,
+    # così da non tenere lock lunghi sulla tabella; es. elimina_dove(session, Spedizione, Spedizione.DataSpedizione < data)
+    colonne = tabella.__mapper__.primary_key
+    chiave = colonne[0] if len(colonne)==1 else tuple_(*colonne)
+    # le chiavi da cancellare si leggono dal principale, non da una replica
+    primario(session)
+    totale = 0
+    while True:
+        chiavi = session.execute(select(*colonne).where(condizione).order_by(*colonne).limit(blocco)).all()
+        if not chiavi:
+            break
+        valori = [c[0] for c in chiavi] if len(colonne)==1 else [tuple(c) for c in chiavi]
+        totale += session.execute(delete(tabella).where(chiave.in_(valori)).execution_options(synchronize_session=False)).rowcount
+        conferma(session)
+    session.expire_all()
+    return totale
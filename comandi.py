@@ -0,0 +1,303 @@
+# Comandi non interattivi: un'operazione per invocazione, oppure un file di operazioni con batch.
+#
+#   python comandi.py list Automobile --formato csv
+#   python comandi.py insert Proprietario Nome=Mario Cognome=Rossi Telefono=061234 Città=Roma
+#   python comandi.py update Proprietario 3 Telefono=067654
+#   python comandi.py delete Automobile 12
+#   python comandi.py delete Usando 5,7
+#   python comandi.py delete Spedizione --prima-di 2015-01-01
+#   python comandi.py report 3 --formato json
+#   python comandi.py report 2 città=Milano
+#   python comandi.py import Automobile automobili.csv
+#   python comandi.py storico AB123CD           (storico dell'automobile in JSON)
+#   python comandi.py batch operazioni.txt      (un comando per riga, '-' per leggere da stdin; --blocco righe per commit)
+#   python comandi.py --strumentazione report 3 (a fine esecuzione, su stderr, le query di ogni comando)
+#
+# SQLAlchemy e i modelli vengono importati solo dai comandi che li usano:
+# --help e tabelle rispondono subito senza aprire il database.
+import os, sys, argparse, shlex
+from contextlib import contextmanager
+
+TABELLE = ('Città', 'Proprietario', 'Automobile', 'Fornitore', 'Intervento', 'Marca',
+           'Meccanico', 'Modello', 'Pezzo', 'Recensione', 'Usando', 'Spedizione')
+
+class Contesto:
+    # l'engine viene creato al primo comando che ne ha bisogno e riusato per tutto il batch;
+    # ogni comando ha una sessione nuova, chiusa da fine() (tranne dentro un lotto, che la tiene aperta)
+    def __init__(self, url=None, strumenti=None, repliche=None):
+        self.url = url
+        self.repliche = repliche
+        self.strumenti = strumenti
+        self._sessioni = None
+
+    @property
+    def session(self):
+        if self._sessioni is None:
+            from connessione import crea_engine, crea_repliche, prepara_schema, sessioni
+            engine = crea_engine(self.url)
+            prepara_schema(engine)
+            self._sessioni = sessioni(engine, repliche=crea_repliche(self.repliche))
+        return self._sessioni()
+
+    def aperta(self):
+        return self._sessioni is not None and self._sessioni.registry.has()
+
+    def fine(self):
+        if self.aperta() and 'lotto' not in self._sessioni().info: self._sessioni.remove()
+
+    @contextmanager
+    def a_parte(self):
+        # i comandi eseguiti qui hanno una sessione nuova, fuori dal lotto, chiusa da fine(); poi si torna a quella del lotto
+        lotto = self._sessioni()
+        self._sessioni.registry.clear()
+        try:
+            yield
+        finally:
+            self.fine()
+            self._sessioni.registry.set(lotto)
+
+def scrivi(righe, colonne, formato, uscita):
+    if formato=='csv':
+        import csv
+        w = csv.writer(uscita)
+        w.writerow(colonne)
+        w.writerows(righe)
+    elif formato=='json':
+        import json
+        for r in righe:
+            uscita.write(json.dumps(dict(zip(colonne, r)), default=str, ensure_ascii=False) + '\n')
+    else:
+        for r in righe:
+            print(tuple(r), file=uscita)
+
+def messaggio(e):
+    # per gli errori del database basta la prima riga del messaggio del driver
+    return str(getattr(e, 'orig', None) or e).splitlines()[0]
+
+def coppie(testi):
+    # ['Nome=Mario', 'Città=Roma'] -> {'Nome': 'Mario', 'Città': 'Roma'}
+    valori = {}
+    for t in testi:
+        if '=' not in t: raise ValueError("atteso campo=valore invece di %s" % t)
+        k, v = t.split('=', 1)
+        valori[k] = v
+    return valori
+
+def chiave(testo):
+    # '12' -> 12, '5,7' -> (5, 7) per le chiavi composte di Usando
+    parti = [int(x) for x in testo.split(',')]
+    return parti[0] if len(parti)==1 else tuple(parti)
+
+def operazione(args):
+    # nome con cui la strumentazione raggruppa le query: 'update Proprietario', 'report 3', ...
+    oggetto = getattr(args, 'tabella', None) or getattr(args, 'numero', None)
+    return args.comando if oggetto is None else '%s %s' % (args.comando, oggetto)
+
+def esegui(args, contesto, uscita):
+    try:
+        if contesto.strumenti is None:
+            return args.funzione(args, contesto, uscita)
+        with contesto.strumenti.operazione(operazione(args)):
+            return args.funzione(args, contesto, uscita)
+    finally:
+        contesto.fine()
+
+def comando_tabelle(args, contesto, uscita):
+    for n, t in enumerate(TABELLE, 1):
+        print('%d. %s' % (n, t), file=uscita)
+
+def comando_list(args, contesto, uscita):
+    import itertools
+    from modelli import cerca_tabella, vista
+    import consultazione
+    tabella = cerca_tabella(args.tabella)
+    righe = consultazione.scorri_righe(contesto.session, tabella)
+    if args.limite: righe = itertools.islice(righe, args.limite)
+    scrivi(righe, [c.key for c in vista(tabella)], args.formato, uscita)
+
+def comando_insert(args, contesto, uscita):
+    from modelli import cerca_tabella
+    import importazione
+    chiave = importazione.inserisci(contesto.session, cerca_tabella(args.tabella), coppie(args.valori))
+    print(chiave[0] if len(chiave)==1 else chiave, file=uscita)
+
+def comando_update(args, contesto, uscita):
+    from modelli import cerca_tabella
+    import importazione, aggiornamento
+    tabella = cerca_tabella(args.tabella)
+    valori = importazione.valori_riga(contesto.session, tabella, coppie(args.valori))
+    cambiati = aggiornamento.aggiorna(contesto.session, tabella, chiave(args.chiave), valori)
+    if cambiati is None: raise ValueError("%s %s non trovato" % (tabella.__name__, args.chiave))
+    print('Aggiornati: ' + ', '.join(cambiati) if cambiati else 'Nessuna modifica', file=uscita)
+
+def comando_delete(args, contesto, uscita):
+    import datetime
+    from modelli import cerca_tabella, Spedizione
+    import cancellazione, archivio
+    tabella = cerca_tabella(args.tabella)
+    if args.prima_di:
+        if tabella is not Spedizione: raise ValueError("--prima-di vale solo per Spedizione")
+        # anche quelle già archiviate
+        data = datetime.date.fromisoformat(args.prima_di)
+        n = cancellazione.elimina_dove(contesto.session, Spedizione, Spedizione.DataSpedizione < data)
+        n += archivio.elimina_prima(contesto.session, data)
+    else:
+        if not args.chiavi: raise ValueError("indicare almeno una chiave oppure --prima-di")
+        n = sum(cancellazione.elimina(contesto.session, tabella, chiave(c)) for c in args.chiavi)
+    print('%d righe eliminate' % n, file=uscita)
+
+def comando_report(args, contesto, uscita):
+    import report
+    if args.numero not in report.REPORT: raise ValueError("report %d inesistente" % args.numero)
+    scrivi(report.esegui(contesto.session, args.numero, **coppie(args.parametri)), report.REPORT[args.numero].colonne, args.formato, uscita)
+    if args.statistiche:
+        for n, s in report.statistiche().items():
+            if s['hit'] + s['miss']: print('report %d: %d compilazioni riusate, %d nuove (%.0f%%)' % (n, s['hit'], s['miss'], s['hit_rate'] * 100), file=sys.stderr)
+
+def comando_import(args, contesto, uscita):
+    from modelli import cerca_tabella
+    import importazione
+    tabella = cerca_tabella(args.tabella)
+    inseriti, scartati, durata = importazione.importa(contesto.session, tabella, args.file, args.scarti, args.blocco)
+    print(importazione.riepilogo(tabella, inseriti, scartati, durata, args.scarti or importazione.file_scarti(args.file)), file=uscita)
+
+def comando_storico(args, contesto, uscita):
+    import json
+    import storico
+    risultato = storico.storico(contesto.session, args.targa)
+    if risultato is None: raise ValueError("targa %s non trovata" % args.targa)
+    print(json.dumps(risultato, ensure_ascii=False), file=uscita)
+
+def comando_cerca(args, contesto, uscita):
+    import ricerca
+    scrivi(ricerca.trova(contesto.session, args.campo, args.testo, args.limite), ('Id', ricerca.CAMPI[args.campo].key), args.formato, uscita)
+
+# comandi di una riga sola: in un batch vanno nel lotto, ognuno nel suo savepoint
+def _in_lotto(args):
+    return args.funzione in (comando_insert, comando_update) or (args.funzione is comando_delete and not args.prima_di)
+
+def comando_batch(args, contesto, uscita):
+    from lotto import Lotto
+    f = sys.stdin if args.file=='-' else open(args.file, encoding='utf-8')
+    errori = 0
+    def segnala(n, e):
+        print('riga %d: %s' % (n, messaggio(e)), file=sys.stderr)
+    with Lotto(contesto.session, args.blocco, segnala) as lotto:
+        for n, riga in enumerate(f, 1):
+            if not riga.strip() or riga.lstrip().startswith('#'): continue
+            try:
+                interno = crea_parser().parse_args(shlex.split(riga))
+                if interno.funzione is comando_batch: raise ValueError("batch annidato non ammesso")
+            except SystemExit:
+                errori += 1
+                print('riga %d: comando non valido' % n, file=sys.stderr)
+                continue
+            except Exception as e:
+                errori += 1
+                segnala(n, e)
+                continue
+            if _in_lotto(interno):
+                with lotto.riga(n):
+                    esegui(interno, contesto, uscita)
+                continue
+            # gli altri comandi (list, report, import, delete --prima-di, ...) vanno in una sessione a parte, fuori dal
+            # lotto, così import e delete --prima-di confermano ogni blocco come da soli; le righe del lotto si confermano
+            # prima, altrimenti su SQLite i loro lock fermerebbero le scritture dell'altra sessione
+            lotto.conferma()
+            try:
+                with contesto.a_parte():
+                    esegui(interno, contesto, uscita)
+            except Exception as e:
+                errori += 1
+                segnala(n, e)
+    if f is not sys.stdin: f.close()
+    errori += len(lotto.errori)
+    if errori: raise ValueError("%d comandi non eseguiti" % errori)
+
+def crea_parser():
+    parser = argparse.ArgumentParser(prog='comandi.py', description='Operazioni sul database Officina senza menu interattivo')
+    parser.add_argument('--url', help='URL del database (altrimenti OFFICINA_URL o officina.ini)')
+    parser.add_argument('--replica', action='append', dest='repliche', metavar='URL',
+                        help='replica in sola lettura per list, report e storico (ripetibile; altrimenti OFFICINA_REPLICHE)')
+    parser.add_argument('--strumentazione', action='store_true', help='riepiloga su stderr le query di ogni comando (anche con OFFICINA_STRUMENTAZIONE=1)')
+    sotto = parser.add_subparsers(dest='comando', required=True)
+
+    p = sotto.add_parser('tabelle', help='elenca le tabelle')
+    p.set_defaults(funzione=comando_tabelle)
+
+    p = sotto.add_parser('list', help='elenca le righe di una tabella')
+    p.add_argument('tabella')
+    p.add_argument('--formato', choices=('testo', 'csv', 'json'), default='testo')
+    p.add_argument('--limite', type=int, help='numero massimo di righe')
+    p.set_defaults(funzione=comando_list)
+
+    p = sotto.add_parser('insert', help='inserisce una riga: campo=valore ...')
+    p.add_argument('tabella')
+    p.add_argument('valori', nargs='+')
+    p.set_defaults(funzione=comando_insert)
+
+    p = sotto.add_parser('update', help='modifica una riga: chiave campo=valore ...')
+    p.add_argument('tabella')
+    p.add_argument('chiave', help='Id, oppure IdIntervento,IdPezzo per Usando')
+    p.add_argument('valori', nargs='+')
+    p.set_defaults(funzione=comando_update)
+
+    p = sotto.add_parser('delete', help='elimina righe per chiave (o Spedizione per data)')
+    p.add_argument('tabella')
+    p.add_argument('chiavi', nargs='*')
+    p.add_argument('--prima-di', help='solo Spedizione: elimina le spedizioni precedenti alla data (yyyy-mm-dd)')
+    p.set_defaults(funzione=comando_delete)
+
+    p = sotto.add_parser('report', help='esegue uno dei report del menu: numero parametro=valore ...')
+    p.add_argument('numero', type=int)
+    p.add_argument('parametri', nargs='*', help='ad esempio prefisso=F, città=Milano, minimo=10, dal=2020-01-01 al=2020-12-31')
+    p.add_argument('--statistiche', action='store_true', help='riporta su stderr quante esecuzioni hanno riusato la compilazione')
+    p.add_argument('--formato', choices=('testo', 'csv', 'json'), default='testo')
+    p.set_defaults(funzione=comando_report)
+
+    p = sotto.add_parser('import', help='importazione massiva da CSV o JSONL')
+    p.add_argument('tabella')
+    p.add_argument('file')
+    p.add_argument('--blocco', type=int, default=5000)
+    p.add_argument('--scarti')
+    p.set_defaults(funzione=comando_import)
+
+    p = sotto.add_parser('storico', help="storico di un'automobile per targa: interventi, meccanici, pezzi e recensioni")
+    p.add_argument('targa')
+    p.set_defaults(funzione=comando_storico)
+
+    p = sotto.add_parser('cerca', help='cerca per parte della targa, del cognome del proprietario o del nome del pezzo')
+    p.add_argument('campo', choices=('targa', 'cognome', 'pezzo'))
+    p.add_argument('testo')
+    p.add_argument('--limite', type=int, default=20)
+    p.add_argument('--formato', choices=('testo', 'csv', 'json'), default='testo')
+    p.set_defaults(funzione=comando_cerca)
+
+    p = sotto.add_parser('batch', help='esegue i comandi scritti in un file, uno per riga')
+    p.add_argument('file', help="file dei comandi, '-' per stdin")
+    p.add_argument('--blocco', type=int, default=1000, help='insert, update e delete confermati ogni BLOCCO righe (1 = a ogni riga)')
+    p.set_defaults(funzione=comando_batch)
+    return parser
+
+def main(argv=None, uscita=sys.stdout):
+    args = crea_parser().parse_args(argv)
+    strumenti = None
+    if args.strumentazione or os.environ.get('OFFICINA_STRUMENTAZIONE'):
+        from strumentazione import strumenti
+        strumenti.da_ambiente()
+        strumenti.accendi()
+    contesto = Contesto(args.url, strumenti, args.repliche)
+    try:
+        esegui(args, contesto, uscita)
+    except BrokenPipeError:
+        # l'uscita è stata chiusa prima della fine (ad esempio da head): non è un errore
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except Exception as e:
+        print('Errore: %s' % messaggio(e), file=sys.stderr)
+        return 1
+    finally:
+        if strumenti is not None: print(strumenti.rapporto(), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# Lettura delle tabelle senza caricarle per intero in memoria.
+# pagina() e scorri() restituiscono oggetti ORM; righe() e scorri_righe() le stesse tuple di view() lette con Core,
+# senza creare oggetti né riempire la identity map della sessione: per elencare ed esportare bastano queste.
+from sqlalchemy import select, tuple_
+
+from modelli import vista
+
+PAGINA = 50
+
+def scorri(session, tabella, dimensione=PAGINA):
+    # legge la tabella a blocchi di dimensione righe (cursore lato server dove il driver lo permette)
+    chiave = tabella.__mapper__.primary_key
+    return session.query(tabella).order_by(*chiave).yield_per(dimensione)
+
+def dopo_chiave(chiave, dopo):
+    return chiave[0] > dopo[0] if len(chiave)==1 else tuple_(*chiave) > tuple_(*dopo)
+
+def pagina(session, tabella, dopo=None, dimensione=PAGINA):
+    # keyset pagination: legge solo le righe con chiave primaria successiva a dopo
+    chiave = tabella.__mapper__.primary_key
+    q = session.query(tabella)
+    if dopo is not None: q = q.filter(dopo_chiave(chiave, dopo))
+    return q.order_by(*chiave).limit(dimensione).all()
+
+def righe(session, tabella, dopo=None, dimensione=PAGINA):
+    # come pagina(), con le tuple di view() al posto degli oggetti
+    chiave = tabella.__mapper__.primary_key
+    s = select(*vista(tabella))
+    if dopo is not None: s = s.where(dopo_chiave(chiave, dopo))
+    s = s.order_by(*chiave).limit(dimensione)
+    return session.connection(bind_arguments={'clause': s}).execute(s).all()
+
+def scorri_righe(session, tabella, dimensione=PAGINA):
+    # come scorri(), con le tuple di view() al posto degli oggetti
+    s = select(*vista(tabella)).order_by(*tabella.__mapper__.primary_key).execution_options(yield_per=dimensione)
+    return session.connection(bind_arguments={'clause': s}).execute(s)
+
+def chiave_riga(tabella, riga):
+    # chiave primaria di una tupla restituita da righe(), da passare come dopo per la pagina seguente
+    colonne = [c.key for c in vista(tabella)]
+    return tuple(riga[colonne.index(c.key)] for c in tabella.__mapper__.primary_key)
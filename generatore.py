@@ -0,0 +1,288 @@
+# Generatore di dati sintetici per provare l'applicazione su volumi realistici: riempie tutte le tabelle
+# con dati coerenti (chiavi esterne valide, Città.Nome, Automobile.Targa, Meccanico.CF, Proprietario.Email
+# e Fornitore.Nome unici, Voto tra 0 e 5) in proporzione al numero di interventi richiesto.
+#
+# Uso: python generatore.py --url sqlite:///prova.db --interventi 1000000 [--processi 4] [--seme 1]
+#
+# Le tabelle grandi sono divise in blocchi di Id disgiunti e ogni blocco dipende solo dal seme e dal suo
+# primo Id: i processi non devono coordinarsi e il risultato non cambia con il numero di processi.
+# Su SQLite, che ammette un solo scrittore, ogni processo scrive in un file a parte e alla fine i file
+# vengono uniti con INSERT ... SELECT. Gli indici secondari (migrazione.py) e i trigger del riepilogo (riepilogo.py)
+# e del magazzino (magazzino.py) sono tolti durante il caricamento e ricreati alla fine. Con il registro delle modifiche
+# attivo (modifiche.py) il generatore non parte: ogni riga generata finirebbe nel registro, e togliere i trigger
+# lascerebbe chi lo consuma senza quelle righe; si disattiva prima (python modifiche.py disattiva).
+import os, time, random, datetime
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, select, insert
+
+from modelli import *
+import migrazione, riepilogo, magazzino, modifiche
+
+SEME = 1
+BLOCCO = 20000
+
+NOMI = ('Marco', 'Giulia', 'Luca', 'Francesca', 'Alessandro', 'Chiara', 'Andrea', 'Sara', 'Matteo', 'Martina',
+        'Lorenzo', 'Valentina', 'Davide', 'Elena', 'Simone', 'Federica', 'Stefano', 'Alessia', 'Giuseppe', 'Silvia',
+        'Francesco', 'Laura', 'Antonio', 'Paola', 'Roberto', 'Anna', 'Fabio', 'Elisa', 'Paolo', 'Roberta')
+COGNOMI = ('Rossi', 'Russo', 'Ferrari', 'Esposito', 'Bianchi', 'Romano', 'Colombo', 'Ricci', 'Marino', 'Greco',
+           'Bruno', 'Gallo', 'Conti', 'De Luca', 'Mancini', 'Costa', 'Giordano', 'Rizzo', 'Lombardi', 'Moretti',
+           'Barbieri', 'Fontana', 'Santoro', 'Mariani', 'Rinaldi', 'Caruso', 'Ferrara', 'Galli', 'Martini', 'Leone')
+CITTÀ = ('Roma', 'Milano', 'Napoli', 'Torino', 'Palermo', 'Genova', 'Bologna', 'Firenze', 'Bari', 'Catania',
+         'Venezia', 'Verona', 'Messina', 'Padova', 'Trieste', 'Brescia', 'Parma', 'Taranto', 'Prato', 'Modena',
+         'Reggio Calabria', 'Reggio Emilia', 'Perugia', 'Ravenna', 'Livorno', 'Cagliari', 'Foggia', 'Rimini', 'Salerno', 'Ferrara',
+         'Sassari', 'Latina', 'Giugliano in Campania', 'Monza', 'Siracusa', 'Pescara', 'Bergamo', 'Forlì', 'Trento', 'Vicenza',
+         'Terni', 'Bolzano', 'Novara', 'Piacenza', 'Ancona', 'Andria', 'Arezzo', 'Udine', 'Cesena', 'Lecce',
+         'Pesaro', 'La Spezia', 'Alessandria', 'Barletta', 'Catanzaro', 'Pistoia', 'Pisa', 'Lucca', 'Brindisi', 'Como',
+         'Treviso', 'Varese', 'Grosseto', 'Asti', 'Caserta', 'Ragusa', 'Cremona', 'Pavia', 'Massa', 'Trapani',
+         'Cosenza', 'Potenza', 'Viterbo', 'Benevento', 'Avellino', 'Frosinone', 'Campobasso', "L'Aquila", 'Aosta', 'Matera')
+MODELLI = {'Fiat': ('Panda', 'Punto', '500', 'Tipo', '500X', 'Doblò'), 'Alfa Romeo': ('Giulietta', 'Giulia', 'Stelvio', 'MiTo'),
+           'Lancia': ('Ypsilon', 'Delta', 'Musa'), 'Volkswagen': ('Golf', 'Polo', 'Passat', 'T-Roc', 'Tiguan'),
+           'Renault': ('Clio', 'Captur', 'Megane', 'Twingo'), 'Peugeot': ('208', '308', '2008', '3008'),
+           'Ford': ('Fiesta', 'Focus', 'Puma', 'Kuga'), 'Toyota': ('Yaris', 'Corolla', 'C-HR', 'RAV4'),
+           'Opel': ('Corsa', 'Astra', 'Mokka'), 'Citroën': ('C3', 'C4', 'C5 Aircross'), 'Dacia': ('Sandero', 'Duster'),
+           'BMW': ('Serie 1', 'Serie 3', 'X1'), 'Audi': ('A1', 'A3', 'A4', 'Q3'), 'Mercedes': ('Classe A', 'Classe C', 'GLA'),
+           'Hyundai': ('i10', 'i20', 'Tucson'), 'Kia': ('Picanto', 'Sportage'), 'Jeep': ('Renegade', 'Compass'), 'Nissan': ('Micra', 'Qashqai')}
+PEZZI = ('Filtro olio', 'Filtro aria', 'Filtro abitacolo', 'Filtro carburante', 'Pastiglie freno anteriori', 'Pastiglie freno posteriori',
+         'Disco freno', 'Candela', 'Cinghia distribuzione', 'Pompa acqua', 'Batteria', 'Ammortizzatore', 'Frizione', 'Lampadina H7',
+         'Spazzola tergicristallo', 'Olio motore 5W30', 'Liquido freni', 'Pneumatico', 'Alternatore', 'Motorino avviamento')
+DESCRIZIONI = ('Tagliando', 'Cambio olio e filtri', 'Sostituzione pastiglie freni', 'Sostituzione dischi freno', 'Cambio gomme',
+               'Sostituzione batteria', 'Sostituzione cinghia distribuzione', 'Ricarica climatizzatore', 'Revisione',
+               'Sostituzione frizione', 'Diagnosi elettronica', 'Convergenza', 'Sostituzione ammortizzatori', 'Riparazione impianto elettrico')
+DURATE = (30, 45, 60, 90, 120, 180, 240, 480)
+PESI_DURATE = (10, 15, 25, 20, 12, 8, 6, 4)
+PEZZI_USATI = (0, 1, 1, 1, 2, 2, 3)
+QUOTA_RECENSIONI = 0.3
+VOTI = (0, 1, 2, 3, 4, 5)
+PESI_VOTI = (2, 3, 8, 20, 35, 32)
+COMMENTI = ('Pessimo', 'Scarso', 'Poco soddisfatto', 'Nella media', 'Buon lavoro', 'Ottimo, consigliato')
+FORNITORI = (('Ricambi', 'Autoricambi', 'Forniture', 'Distribuzione ricambi', 'Componenti auto'), COGNOMI, ('S.r.l.', 'S.p.A.', 'S.n.c.', '& Figli'))
+PRIMA_SPEDIZIONE = datetime.date(2015, 1, 1)
+GIORNI_SPEDIZIONI = 11 * 365
+
+def dimensioni(interventi):
+    # righe per tabella in proporzione agli interventi; Città, Marca e Modello vengono dagli elenchi qui sopra
+    return {'Città': len(CITTÀ), 'Marca': len(MODELLI), 'Modello': sum(len(m) for m in MODELLI.values()),
+            'Meccanico': min(max(interventi // 2000, 5), 5000), 'Pezzo': min(max(interventi // 2000, 50), 5000),
+            'Fornitore': min(max(interventi // 20000, 10), 500), 'Proprietario': max(interventi // 8, 10),
+            'Automobile': max(interventi // 5, 10), 'Intervento': interventi, 'Spedizione': max(interventi // 2, 1)}
+
+def targa(i):
+    # l'automobile i ha una targa nel formato AA000AA; la moltiplicazione per un primo mescola le targhe
+    # restando biunivoca, quindi targhe diverse per Id diversi (fino a 456976000 automobili)
+    lettere = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    i = i * 7919 % 456976000
+    i, a = divmod(i, 676)
+    i, n = divmod(i, 1000)
+    return lettere[a // 26] + lettere[a % 26] + '%03d' % n + lettere[(i // 26) % 26] + lettere[i % 26]
+
+def codice_fiscale(i, nome, cognome):
+    # lettere di cognome e nome come nel codice vero; anno, mese, giorno e comune ricavati da i li rendono unici
+    def lettere(s):
+        s = s.upper().replace(' ', '')
+        return (''.join(c for c in s if c not in 'AEIOU') + ''.join(c for c in s if c in 'AEIOU') + 'XXX')[:3]
+    i, anno = divmod(i, 60)
+    i, mese = divmod(i, 12)
+    i, giorno = divmod(i, 28)
+    i, comune = divmod(i, 1000)
+    cf = '%s%s%02d%s%02d%s%03d' % (lettere(cognome), lettere(nome), 50 + anno, 'ABCDEHLMPRST'[mese], giorno + 1, 'ABCDEFGHILMZ'[i % 12], comune)
+    return cf + chr(ord('A') + sum(map(ord, cf)) % 26)
+
+def fornitore(i):
+    # i da 1 a 500: combinazioni diverse di prefisso, cognome e forma societaria
+    prefissi, cognomi, forme = FORNITORI
+    i, p = divmod(i - 1, len(prefissi))
+    i, c = divmod(i, len(cognomi))
+    return '%s %s %s' % (prefissi[p], cognomi[c], forme[i % len(forme)])
+
+def proprietario_di(automobile, d):
+    # il proprietario dipende solo dall'Id dell'automobile: chi genera le recensioni lo ricalcola senza leggerlo
+    return automobile * 2654435761 % d['Proprietario'] + 1
+
+def prezzo_base(pezzo):
+    return 5 + pezzo * 7919 % 300
+
+def piccole(d):
+    meccanici = []
+    for i in range(1, d['Meccanico'] + 1):
+        nome, cognome = NOMI[i % len(NOMI)], COGNOMI[i * 7 % len(COGNOMI)]
+        meccanici.append({'Id': i, 'Nome': nome, 'Cognome': cognome, 'CF': codice_fiscale(i, nome, cognome)})
+    modelli, marche = [], []
+    for m, (marca, nomi) in enumerate(MODELLI.items(), 1):
+        marche.append({'Id': m, 'Nome': marca})
+        for nome in nomi:
+            modelli.append({'Id': len(modelli) + 1, 'Nome': nome, 'IdMarca': m})
+    return {Città: [{'Id': i, 'Nome': nome} for i, nome in enumerate(CITTÀ, 1)],
+            Marca: marche, Modello: modelli, Meccanico: meccanici,
+            Pezzo: [{'Id': i, 'Nome': '%s %s-%04d' % (PEZZI[i % len(PEZZI)], PEZZI[i % len(PEZZI)][:2].upper(), i)} for i in range(1, d['Pezzo'] + 1)],
+            Fornitore: [{'Id': i, 'Nome': fornitore(i)} for i in range(1, d['Fornitore'] + 1)]}
+
+def proprietari(r, inizio, fine, d):
+    righe = []
+    for i in range(inizio, fine):
+        nome, cognome = r.choice(NOMI), r.choice(COGNOMI)
+        righe.append({'Id': i, 'Nome': nome, 'Cognome': cognome, 'Email': '%s.%s%d@esempio.it' % (nome.lower(), cognome.lower().replace(' ', ''), i),
+                      'Telefono': '3%09d' % r.randrange(10**9), 'IdCittà': 1 if r.random() < 0.1 else r.randint(1, d['Città'])})
+    return {Proprietario: righe}
+
+def automobili(r, inizio, fine, d):
+    return {Automobile: [{'Id': i, 'Targa': targa(i), 'IdProprietario': proprietario_di(i, d),
+                          'IdModello': r.randint(1, d['Modello']) if r.random() < 0.97 else None} for i in range(inizio, fine)]}
+
+def interventi(r, inizio, fine, d):
+    # pezzi usati e recensioni nascono con il loro intervento: la recensione è del proprietario dell'automobile
+    righe, usando, recensioni = [], [], []
+    pezzi = range(1, d['Pezzo'] + 1)
+    for i in range(inizio, fine):
+        auto = r.randint(1, d['Automobile'])
+        righe.append({'Id': i, 'Durata': r.choices(DURATE, PESI_DURATE)[0], 'Descrizione': r.choice(DESCRIZIONI),
+                      'IdMeccanico': r.randint(1, d['Meccanico']), 'IdAutomobile': auto})
+        for p in r.sample(pezzi, r.choice(PEZZI_USATI)):
+            usando.append({'IdIntervento': i, 'IdPezzo': p, 'Quantità': r.randint(1, 4), 'PrezzoUnitario': prezzo_base(p) * 13 // 10})
+        if r.random() < QUOTA_RECENSIONI:
+            voto = r.choices(VOTI, PESI_VOTI)[0]
+            recensioni.append({'Id': i, 'Commento': COMMENTI[voto], 'Voto': voto, 'IdProprietario': proprietario_di(auto, d), 'IdIntervento': i})
+    return {Intervento: righe, Usando: usando, Recensione: recensioni}
+
+def spedizioni(r, inizio, fine, d):
+    righe = []
+    for i in range(inizio, fine):
+        pezzo, quantità = r.randint(1, d['Pezzo']), r.randint(1, 100)
+        righe.append({'Id': i, 'Prezzo': prezzo_base(pezzo) * quantità * 7 // 10, 'QuantitàSpedita': quantità, 'IdPezzo': pezzo,
+                      'DataSpedizione': PRIMA_SPEDIZIONE + datetime.timedelta(days=r.randrange(GIORNI_SPEDIZIONI)), 'IdFornitore': r.randint(1, d['Fornitore'])})
+    return {Spedizione: righe}
+
+GRANDI = {'Proprietario': proprietari, 'Automobile': automobili, 'Intervento': interventi, 'Spedizione': spedizioni}
+
+def compiti(d, blocco=BLOCCO):
+    return [(nome, inizio, min(inizio + blocco, d[nome] + 1)) for nome in GRANDI for inizio in range(1, d[nome] + 1, blocco)]
+
+def genera_blocco(compito, d, seme):
+    nome, inizio, fine = compito
+    return GRANDI[nome](random.Random('%d/%s/%d' % (seme, nome, inizio)), inizio, fine, d)
+
+@contextmanager
+def caricamento(engine):
+    # i dati sono coerenti per costruzione: durante il caricamento i controlli delle chiavi esterne
+    # (e su SQLite la sincronizzazione su disco) si spengono e vengono ripristinati alla fine
+    with engine.connect() as conn:
+        if engine.dialect.name=='sqlite':
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            conn.exec_driver_sql('PRAGMA synchronous=OFF')
+        elif engine.dialect.name=='mysql':
+            conn.exec_driver_sql('SET FOREIGN_KEY_CHECKS=0')
+        conn.commit()
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            if engine.dialect.name=='sqlite':
+                conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+                conn.exec_driver_sql('PRAGMA synchronous=FULL')
+            elif engine.dialect.name=='mysql':
+                conn.exec_driver_sql('SET FOREIGN_KEY_CHECKS=1')
+            conn.commit()
+
+def scrivi(conn, tabelle):
+    n = 0
+    for tabella, righe in tabelle.items():
+        if righe:
+            conn.execute(insert(tabella), righe)
+            n += len(righe)
+    conn.commit()
+    return n
+
+def togli_indici(engine):
+    for tabella in Base.metadata.sorted_tables:
+        for indice in tabella.indexes:
+            indice.drop(bind=engine, checkfirst=True)
+
+# stato di ogni processo di lavoro: l'engine su cui scrive e i parametri della generazione
+_lavoro = {}
+
+def _inizializza(url, parti, d, seme):
+    if parti:
+        # su SQLite ogni processo ha il suo file, con le tabelle ma senza indici secondari
+        url = 'sqlite:///%s.parte%d' % (url.database, os.getpid())
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        togli_indici(engine)
+    else:
+        engine = create_engine(url)
+    _lavoro.update(engine=engine, d=d, seme=seme, parte=engine.url.database if parti else None)
+
+def _esegui(compito):
+    with caricamento(_lavoro['engine']) as conn:
+        return _lavoro['parte'], scrivi(conn, genera_blocco(compito, _lavoro['d'], _lavoro['seme']))
+
+def unisci(engine, parte):
+    q = engine.dialect.identifier_preparer.quote
+    with caricamento(engine) as conn:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS parte', (parte,))
+        for tabella in TABELLE:
+            colonne = ', '.join(q(c.name) for c in tabella.__table__.columns)
+            conn.exec_driver_sql('INSERT INTO main.%s (%s) SELECT %s FROM parte.%s' % (q(tabella.__tablename__), colonne, colonne, q(tabella.__tablename__)))
+        conn.commit()
+        conn.exec_driver_sql('DETACH DATABASE parte')
+    os.remove(parte)
+
+def genera(engine, interventi, processi=1, seme=SEME):
+    # il database deve avere lo schema e tabelle vuote; restituisce il numero di righe per tabella
+    d = dimensioni(interventi)
+    with engine.connect() as conn:
+        for tabella in TABELLE:
+            if conn.scalar(select(1).select_from(tabella).limit(1)) is not None:
+                raise ValueError("La tabella %s non è vuota" % tabella.__tablename__)
+        if modifiche.attive(conn):
+            raise ValueError("Registro delle modifiche attivo: disattivarlo prima di generare (python modifiche.py disattiva)")
+    sqlite = engine.dialect.name=='sqlite'
+    if processi > 1 and sqlite and not engine.url.database:
+        raise ValueError("Con più processi serve un database SQLite su file")
+    togli_indici(engine)
+    with engine.begin() as conn:
+        riepilogo.togli_trigger(conn)
+        magazzino.togli_trigger(conn)
+    with caricamento(engine) as conn:
+        scrivi(conn, piccole(d))
+    if processi > 1:
+        import multiprocessing
+        url = engine.url if sqlite else engine.url.render_as_string(hide_password=False)
+        parti = set()
+        with multiprocessing.Pool(processi, _inizializza, (url, sqlite, d, seme)) as pool:
+            for parte, n in pool.imap_unordered(_esegui, compiti(d)):
+                parti.add(parte)
+        for parte in parti - {None}:
+            unisci(engine, parte)
+    else:
+        with caricamento(engine) as conn:
+            for compito in compiti(d):
+                scrivi(conn, genera_blocco(compito, d, seme))
+    migrazione.aggiungi_indici(engine)
+    riepilogo.prepara(engine)
+    magazzino.prepara(engine)
+    with engine.connect() as conn:
+        return {tabella.__name__: conn.scalar(select(func.count()).select_from(tabella)) for tabella in TABELLE}
+
+if __name__ == '__main__':
+    import sys, argparse
+
+    parser = argparse.ArgumentParser(description='Riempie il database Officina con dati sintetici')
+    parser.add_argument('--url', help='URL del database (altrimenti OFFICINA_URL o officina.ini)')
+    parser.add_argument('--interventi', type=int, default=100000, help='numero di interventi; le altre tabelle sono in proporzione')
+    parser.add_argument('--processi', type=int, default=1, help='processi che generano i dati in parallelo')
+    parser.add_argument('--seme', type=int, default=SEME, help='seme dei numeri casuali: stesso seme, stessi dati')
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    inizio = time.perf_counter()
+    try:
+        righe = genera(engine, args.interventi, args.processi, args.seme)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    durata = time.perf_counter() - inizio
+    for nome, n in righe.items():
+        print('%-14s %10d' % (nome, n))
+    print('%d righe in %.1f s (%.0f righe/s)' % (sum(righe.values()), durata, sum(righe.values()) / durata))
@@ -0,0 +1,240 @@
+# Importazione massiva da file CSV o JSONL (una riga JSON per record).
+# Le righe vengono lette in streaming e inserite a blocchi con un unico executemany per blocco;
+# le righe non valide finiscono nel file degli scarti insieme al motivo.
+#
+# Uso: python importazione.py Automobile automobili.csv [--blocco 5000] [--scarti file] [--url URL]
+#
+# Oltre alle colonne del modello (Id, Nome, IdCittà, ...) si possono usare le chiavi naturali
+# elencate in CHIAVI_NATURALI, ad esempio la colonna Città per Proprietario o Targa per Intervento.
+import csv, json, time, datetime
+
+from sqlalchemy import insert, select, func, exc, Integer, Date
+
+from modelli import *
+from cache_nomi import cache
+from lotto import conferma
+
+BLOCCO = 5000
+
+# colonna nel file -> (colonna su cui cercare, chiave esterna da valorizzare)
+CHIAVI_NATURALI = {
+    Proprietario: {'Città': (Città.Nome, 'IdCittà')},
+    Modello: {'Marca': (Marca.Nome, 'IdMarca')},
+    Automobile: {'Proprietario': (Proprietario.Email, 'IdProprietario'), 'Modello': (Modello.Nome, 'IdModello')},
+    Intervento: {'Meccanico': (Meccanico.CF, 'IdMeccanico'), 'Targa': (Automobile.Targa, 'IdAutomobile')},
+    Recensione: {'Proprietario': (Proprietario.Email, 'IdProprietario')},
+    Usando: {'Pezzo': (Pezzo.Nome, 'IdPezzo')},
+    Spedizione: {'Pezzo': (Pezzo.Nome, 'IdPezzo'), 'Fornitore': (Fornitore.Nome, 'IdFornitore')},
+}
+
+class Risolutore:
+    # traduce i nomi in Id: prima la cache condivisa, poi una query IN per blocco per quelli mancanti
+    def __init__(self, session, cache=cache):
+        self.session = session
+        self.cache = cache
+        self.noti = {}
+
+    def carica(self, colonna, valori):
+        noti = self.noti.setdefault(colonna, {})
+        mancanti = []
+        for v in set(valori):
+            if v in noti: continue
+            i = self.cache.locale(colonna, v)
+            if i is None: mancanti.append(v)
+            else: noti[v] = i
+        tabella = colonna.class_
+        for i in range(0, len(mancanti), 500):
+            parte = mancanti[i:i+500]
+            # su colonne non univoche (Marca.Nome, Modello.Nome, Pezzo.Nome) vince l'Id più basso
+            q = select(colonna, func.min(tabella.Id)).where(colonna.in_(parte)).group_by(colonna)
+            for nome, i_d in self.session.execute(q):
+                noti[nome] = i_d
+                self.cache.metti(colonna, nome, i_d)
+        return noti
+
+def converti(colonna, valore):
+    if valore is None or valore=='':
+        return None
+    if isinstance(colonna.type, Integer):
+        return int(valore)
+    if isinstance(colonna.type, Date):
+        if isinstance(valore, datetime.date): return valore
+        return datetime.date.fromisoformat(valore)
+    return str(valore)
+
+def leggi(percorso):
+    # restituisce (numero di riga, riga) senza caricare il file in memoria;
+    # le righe JSONL vengono decodificate dopo, così una riga illeggibile finisce tra gli scarti
+    with open(percorso, newline='', encoding='utf-8') as f:
+        if percorso.endswith('.csv'):
+            for n, riga in enumerate(csv.DictReader(f), 2):
+                yield n, riga
+        else:
+            for n, riga in enumerate(f, 1):
+                if riga.strip():
+                    yield n, riga
+
+def file_scarti(percorso):
+    return percorso + '.scarti' + ('.csv' if percorso.endswith('.csv') else '.jsonl')
+
+class Scarti:
+    # il file degli scarti viene creato solo alla prima riga rifiutata
+    def __init__(self, percorso):
+        self.percorso = percorso
+        self.f = None
+        self.csv = None
+        self.n = 0
+
+    def scrivi(self, n, riga, errore):
+        self.n += 1
+        motivo = 'riga %d: %s' % (n, str(errore).splitlines()[0])
+        if self.f is None:
+            self.f = open(self.percorso, 'w', newline='', encoding='utf-8')
+            if self.percorso.endswith('.csv'):
+                self.csv = csv.DictWriter(self.f, fieldnames=list(riga) + ['errore'], extrasaction='ignore')
+                self.csv.writeheader()
+        if self.csv is not None:
+            self.csv.writerow(dict(riga, errore=motivo))
+        else:
+            self.f.write(json.dumps(dict(riga, errore=motivo), default=str, ensure_ascii=False) + '\n')
+
+    def chiudi(self):
+        if self.f is not None: self.f.close()
+
+def decodifica(testo):
+    riga = json.loads(testo)
+    if not isinstance(riga, dict): raise ValueError("la riga non è un oggetto JSON")
+    return riga
+
+def prepara(riga, colonne, naturali):
+    valori = {}
+    for k, v in riga.items():
+        if k in colonne:
+            valori[k] = converti(colonne[k], v)
+        elif k not in naturali:
+            raise ValueError("colonna %s sconosciuta" % k)
+    return valori
+
+def obbligatorie(colonne):
+    return [k for k, c in colonne.items() if not c.nullable and c.autoincrement is not True]
+
+def valori_riga(session, tabella, riga):
+    # converte una singola riga (dizionario di stringhe) nei valori delle colonne, risolvendo le chiavi naturali
+    colonne = {c.key: c for c in tabella.__table__.columns}
+    naturali = CHIAVI_NATURALI.get(tabella, {})
+    valori = prepara(riga, colonne, naturali)
+    for nome, (colonna, chiave) in naturali.items():
+        if riga.get(nome) in (None, '') or valori.get(chiave) is not None: continue
+        i = cache.cerca(session, colonna, riga[nome])
+        if i is None: raise ValueError("%s %s non trovato" % (nome, riga[nome]))
+        valori[chiave] = i
+    return valori
+
+def inserisci(session, tabella, riga):
+    # inserimento di una riga con le stesse regole dei file; restituisce la chiave primaria
+    valori = valori_riga(session, tabella, riga)
+    mancanti = [k for k in obbligatorie({c.key: c for c in tabella.__table__.columns}) if valori.get(k) is None]
+    if mancanti: raise ValueError("campo %s obbligatorio" % mancanti[0])
+    oggetto = tabella(**valori)
+    session.add(oggetto)
+    conferma(session)
+    return tuple(tabella.__mapper__.primary_key_from_instance(oggetto))
+
+def scrivi_blocco(session, tabella, blocco, scarti):
+    try:
+        with session.begin_nested():
+            session.execute(insert(tabella), [v for n, r, v in blocco])
+        conferma(session)
+        return len(blocco)
+    except exc.SQLAlchemyError:
+        pass
+    # il blocco contiene almeno una riga non valida: la si isola riga per riga, ognuna nel suo savepoint,
+    # e il blocco si conferma una volta sola
+    inseriti = 0
+    for n, riga, valori in blocco:
+        try:
+            with session.begin_nested():
+                session.execute(insert(tabella), [valori])
+            inseriti += 1
+        except exc.SQLAlchemyError as e:
+            scarti.scrivi(n, riga, e.orig if getattr(e, 'orig', None) is not None else e)
+    conferma(session)
+    return inseriti
+
+def importa(session, tabella, percorso, scarti=None, blocco=BLOCCO):
+    scarti = Scarti(scarti or file_scarti(percorso))
+    colonne = {c.key: c for c in tabella.__table__.columns}
+    richieste = obbligatorie(colonne)
+    naturali = CHIAVI_NATURALI.get(tabella, {})
+    risolutore = Risolutore(session)
+    inseriti = 0
+    inizio = time.perf_counter()
+    righe = []
+
+    def svuota():
+        scartate = set()
+        for nome, (colonna, chiave) in naturali.items():
+            cercare = [r[nome] for n, r, v in righe if r.get(nome) not in (None, '') and v.get(chiave) is None]
+            if not cercare: continue
+            noti = risolutore.carica(colonna, cercare)
+            for n, r, v in righe:
+                if n in scartate or r.get(nome) in (None, '') or v.get(chiave) is not None: continue
+                if r[nome] in noti: v[chiave] = noti[r[nome]]
+                else:
+                    scarti.scrivi(n, r, "%s %s non trovato" % (nome, r[nome]))
+                    scartate.add(n)
+        pronte = []
+        for n, r, v in righe:
+            if n in scartate: continue
+            mancanti = [k for k in richieste if v.get(k) is None]
+            if mancanti: scarti.scrivi(n, r, "campo %s obbligatorio" % mancanti[0])
+            else: pronte.append((n, r, v))
+        return scrivi_blocco(session, tabella, pronte, scarti) if pronte else 0
+
+    try:
+        for n, riga in leggi(percorso):
+            if isinstance(riga, str):
+                try:
+                    riga = decodifica(riga)
+                except ValueError as e:
+                    scarti.scrivi(n, {'testo': riga.strip()}, e)
+                    continue
+            try:
+                valori = prepara(riga, colonne, naturali)
+            except ValueError as e:
+                scarti.scrivi(n, riga, e)
+                continue
+            righe.append((n, riga, valori))
+            if len(righe) >= blocco:
+                inseriti += svuota()
+                righe = []
+        if righe:
+            inseriti += svuota()
+    finally:
+        scarti.chiudi()
+    return inseriti, scarti.n, time.perf_counter() - inizio
+
+def riepilogo(tabella, inseriti, scartati, durata, scarti=None):
+    s = "%s: %d righe inserite, %d scartate in %.2f s (%.0f righe/s)" % (tabella.__name__, inseriti, scartati, durata, inseriti / durata if durata else 0)
+    if scartati and scarti: s += "\nRighe scartate in %s" % scarti
+    return s
+
+if __name__ == '__main__':
+    import argparse
+    from sqlalchemy.orm import sessionmaker
+
+    parser = argparse.ArgumentParser(description='Importazione massiva da CSV o JSONL')
+    parser.add_argument('tabella', help='nome del modello, ad esempio Automobile')
+    parser.add_argument('file', help='file .csv oppure .jsonl')
+    parser.add_argument('--blocco', type=int, default=BLOCCO, help='righe per executemany (default %d)' % BLOCCO)
+    parser.add_argument('--scarti', help='file per le righe rifiutate')
+    parser.add_argument('--url', help='URL del database')
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    session = sessionmaker(bind=engine)()
+    tabella = cerca_tabella(args.tabella)
+    inseriti, scartati, durata = importa(session, tabella, args.file, args.scarti, args.blocco)
+    print(riepilogo(tabella, inseriti, scartati, durata, args.scarti or file_scarti(args.file)))
@@ -0,0 +1,61 @@
+# Modalità a lotti: molte operazioni (inserimenti, aggiornamenti, cancellazioni) nella stessa transazione,
+# confermata ogni blocco righe invece che a ogni riga. Ogni riga è in un savepoint: se fallisce (ad esempio un
+# Voto fuori dal CheckConstraint) si annulla solo quella riga, l'errore viene registrato e il lotto continua.
+#
+#   with Lotto(session, blocco=500) as lotto:
+#       for n, riga in enumerate(righe, 1):
+#           with lotto.riga(n):
+#               importazione.inserisci(session, Recensione, riga)
+#   lotto.errori -> [(n, errore), ...]
+#
+# Le funzioni di importazione, aggiornamento, cancellazione e anagrafiche chiudono la transazione con conferma():
+# fuori da un lotto è un commit, dentro un lotto solo un flush e il commit lo fa il lotto.
+from contextlib import contextmanager
+
+from cache_nomi import cache
+
+BLOCCO = 1000
+
+def conferma(session):
+    if 'lotto' in session.info: session.flush()
+    else: session.commit()
+
+class Lotto:
+    def __init__(self, session, blocco=BLOCCO, segnala=None):
+        # segnala(etichetta, errore), se indicata, viene chiamata subito per ogni riga annullata
+        self.session = session
+        self.blocco = max(1, blocco)
+        self.segnala = segnala
+        self.eseguite = 0
+        self.errori = []
+        self.in_sospeso = 0
+
+    def __enter__(self):
+        if 'lotto' in self.session.info: raise ValueError("lotto già aperto su questa sessione")
+        self.session.info['lotto'] = self
+        return self
+
+    def __exit__(self, tipo, valore, traccia):
+        del self.session.info['lotto']
+        if tipo is None: self.session.commit()
+        else: self.session.rollback()
+
+    @contextmanager
+    def riga(self, etichetta=None):
+        try:
+            with self.session.begin_nested():
+                yield
+                self.session.flush()
+            self.eseguite += 1
+        except Exception as e:
+            # un Id letto nel savepoint annullato potrebbe non esistere più
+            cache.invalida()
+            self.errori.append((etichetta, e))
+            if self.segnala: self.segnala(etichetta, e)
+        self.in_sospeso += 1
+        if self.in_sospeso >= self.blocco: self.conferma()
+
+    def conferma(self):
+        # rende definitive le righe fatte finora; il lotto resta aperto
+        self.session.commit()
+        self.in_sospeso = 0
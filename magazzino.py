@@ -0,0 +1,167 @@
+# Magazzino dei pezzi: la giacenza di ogni pezzo (quantità spedite meno quantità usate) nella tabella giacenza,
+# tenuta aggiornata da trigger su spedizione e usando come il riepilogo di riepilogo.py, quindi nella stessa
+# transazione di ogni inserimento, modifica o cancellazione. I trigger ci sono solo per SQLite, che li esegue anche
+# sulle righe cancellate a cascata; su MySQL, dove la cascata non esegue trigger, prepara() si ferma con un errore
+# come in riepilogo.py.
+#
+# Le istantanee (istantanea_giacenza) salvano la giacenza di tutti i pezzi a una data: la giacenza a una data
+# passata è l'istantanea più vicina più (o meno) le spedizioni tra le due date, lette con l'indice su DataSpedizione.
+# La giacenza attuale vale come istantanea successiva a ogni spedizione. Usando non ha una data: i pezzi usati
+# contano dal momento in cui sono registrati, quindi un'istantanea comprende tutti quelli usati fino a quando
+# è stata fatta e la giacenza a una data è esatta per le spedizioni, non per gli utilizzi.
+#
+# Uso: python magazzino.py [--url URL] istantanea [--data yyyy-mm-dd]   (da eseguire periodicamente, ad esempio ogni notte)
+#      python magazzino.py [--url URL] giacenza [--data yyyy-mm-dd] [--pezzo Id]
+#      python magazzino.py [--url URL] scorta [--soglia 10]
+#      python magazzino.py [--url URL] ricostruisci [--verifica]
+import datetime
+
+from sqlalchemy import select, delete, insert, func, text, and_, union_all
+
+from modelli import *
+
+SOGLIA = 10
+
+def _crea_riga(riga):
+    return 'INSERT OR IGNORE INTO giacenza (IdPezzo, Quantità) VALUES (%s.IdPezzo, 0);' % riga
+
+def _sposta(segno, quantità, riga):
+    return 'UPDATE giacenza SET Quantità = Quantità %s COALESCE(%s.%s, 0) WHERE IdPezzo = %s.IdPezzo;' % (segno, riga, quantità, riga)
+
+def trigger(dialetto):
+    # nome -> (momento e tabella, corpo)
+    if dialetto!='sqlite':
+        raise ValueError("Trigger del magazzino non supportati su %s: provati solo su SQLite" % dialetto)
+    return {
+        'magazzino_spedizione_inserita': ('AFTER INSERT ON spedizione', _crea_riga('NEW') + _sposta('+', 'QuantitàSpedita', 'NEW')),
+        'magazzino_spedizione_modificata': ('AFTER UPDATE OF QuantitàSpedita, IdPezzo ON spedizione',
+                                            _sposta('-', 'QuantitàSpedita', 'OLD') + _crea_riga('NEW') + _sposta('+', 'QuantitàSpedita', 'NEW')),
+        'magazzino_spedizione_eliminata': ('AFTER DELETE ON spedizione', _sposta('-', 'QuantitàSpedita', 'OLD')),
+        'magazzino_usando_inserito': ('AFTER INSERT ON usando', _crea_riga('NEW') + _sposta('-', 'Quantità', 'NEW')),
+        'magazzino_usando_modificato': ('AFTER UPDATE OF Quantità, IdPezzo ON usando',
+                                        _sposta('+', 'Quantità', 'OLD') + _crea_riga('NEW') + _sposta('-', 'Quantità', 'NEW')),
+        'magazzino_usando_eliminato': ('AFTER DELETE ON usando', _sposta('+', 'Quantità', 'OLD')),
+    }
+
+def togli_trigger(conn):
+    for nome in trigger(conn.dialect.name):
+        conn.execute(text('DROP TRIGGER IF EXISTS %s' % nome))
+
+def crea_trigger(conn):
+    togli_trigger(conn)
+    for nome, (momento, corpo) in trigger(conn.dialect.name).items():
+        conn.execute(text('CREATE TRIGGER %s %s FOR EACH ROW BEGIN %s END' % (nome, momento, corpo)))
+
+def calcolo():
+    # la giacenza calcolata dai dati: una riga per ogni pezzo spedito (anche nelle spedizioni archiviate, archivio.py) o usato almeno una volta
+    s = spedizione_tutte.c
+    movimenti = union_all(select(s.IdPezzo, func.coalesce(s.QuantitàSpedita, 0).label('q')),
+                          select(Usando.IdPezzo, -func.coalesce(Usando.Quantità, 0))).subquery()
+    return select(movimenti.c.IdPezzo, func.sum(movimenti.c.q)).group_by(movimenti.c.IdPezzo)
+
+def ricostruisci(conn):
+    conn.execute(delete(Giacenza))
+    conn.execute(insert(Giacenza).from_select(['IdPezzo', 'Quantità'], calcolo()))
+
+def prepara(engine):
+    # trigger e contenuto della giacenza, in un'unica transazione (le istantanee non si toccano)
+    with engine.begin() as conn:
+        crea_trigger(conn)
+        ricostruisci(conn)
+
+def differenze(conn):
+    # (IdPezzo, giacenza attesa, giacenza nella tabella) per i pezzi la cui giacenza non torna
+    attese = dict(conn.execute(calcolo()).all())
+    attuali = dict(conn.execute(select(Giacenza.IdPezzo, Giacenza.Quantità)).all())
+    return [(p, attese.get(p, 0), attuali.get(p, 0)) for p in sorted(set(attese) | set(attuali)) if attese.get(p, 0) != attuali.get(p, 0)]
+
+def spedite(conn, dopo, fino, pezzo=None):
+    # quantità spedite per pezzo con dopo < DataSpedizione <= fino (None = senza limite), archiviate comprese:
+    # usa l'indice su DataSpedizione di spedizione e di ogni archivio
+    s = spedizione_tutte.c
+    condizioni = []
+    if dopo is not None: condizioni.append(s.DataSpedizione > dopo)
+    if fino is not None: condizioni.append(s.DataSpedizione <= fino)
+    if pezzo is not None: condizioni.append(s.IdPezzo==pezzo)
+    return dict(conn.execute(select(s.IdPezzo, func.coalesce(func.sum(s.QuantitàSpedita), 0))
+                             .where(and_(*condizioni)).group_by(s.IdPezzo)).all())
+
+def istantanea(conn, data=None):
+    # salva (o rifà) l'istantanea alla data indicata, oggi se non indicata; restituisce il numero di pezzi
+    data = data or datetime.date.today()
+    successive = spedite(conn, data, None)
+    conn.execute(delete(IstantaneaGiacenza).where(IstantaneaGiacenza.Data==data))
+    righe = [{'Data': data, 'IdPezzo': p, 'Quantità': q - successive.get(p, 0)}
+             for p, q in conn.execute(select(Giacenza.IdPezzo, Giacenza.Quantità))]
+    if righe: conn.execute(insert(IstantaneaGiacenza), righe)
+    return len(righe)
+
+def giacenza_al(conn, data, pezzo=None):
+    # IdPezzo -> giacenza alla data, partendo dall'istantanea più vicina (prima o dopo) o dalla giacenza attuale
+    prima = conn.scalar(select(func.max(IstantaneaGiacenza.Data)).where(IstantaneaGiacenza.Data <= data))
+    dopo = conn.scalar(select(func.min(IstantaneaGiacenza.Data)).where(IstantaneaGiacenza.Data > data))
+    # la giacenza attuale comprende tutte le spedizioni: va bene come istantanea alla data dell'ultima
+    ultima = conn.scalar(select(func.max(spedizione_tutte.c.DataSpedizione)))
+    if dopo is None and (ultima is None or ultima <= data):
+        base, segno, delta = None, 1, {}
+    elif prima is not None and (data - prima) <= ((dopo or ultima) - data):
+        base, segno, delta = prima, 1, spedite(conn, prima, data, pezzo)
+    else:
+        base, segno, delta = dopo, -1, spedite(conn, data, dopo, pezzo)
+    if base is None:
+        partenza = select(Giacenza.IdPezzo, Giacenza.Quantità)
+        if pezzo is not None: partenza = partenza.where(Giacenza.IdPezzo==pezzo)
+    else:
+        partenza = select(IstantaneaGiacenza.IdPezzo, IstantaneaGiacenza.Quantità).where(IstantaneaGiacenza.Data==base)
+        if pezzo is not None: partenza = partenza.where(IstantaneaGiacenza.IdPezzo==pezzo)
+    giacenze = dict(conn.execute(partenza).all())
+    for p, q in delta.items():
+        giacenze[p] = giacenze.get(p, 0) + segno * q
+    return giacenze
+
+def sotto_scorta(conn, soglia=SOGLIA):
+    # (Id, Nome, giacenza) dei pezzi con giacenza minore o uguale alla soglia, dal più scarso: usa l'indice su giacenza.Quantità
+    return conn.execute(select(Pezzo.Id, Pezzo.Nome, Giacenza.Quantità).where(and_(Pezzo.Id==Giacenza.IdPezzo, Giacenza.Quantità <= soglia))
+                        .order_by(Giacenza.Quantità, Pezzo.Id)).all()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Giacenze dei pezzi e istantanee del magazzino')
+    parser.add_argument('--url', help='URL del database')
+    sotto = parser.add_subparsers(dest='comando', required=True)
+    p = sotto.add_parser('istantanea', help='salva la giacenza di tutti i pezzi a una data')
+    p.add_argument('--data', type=datetime.date.fromisoformat, help='yyyy-mm-dd, oggi se non indicata')
+    p = sotto.add_parser('giacenza', help='giacenza dei pezzi a una data')
+    p.add_argument('--data', type=datetime.date.fromisoformat, help='yyyy-mm-dd, oggi se non indicata')
+    p.add_argument('--pezzo', type=int, help='Id di un solo pezzo')
+    p = sotto.add_parser('scorta', help='pezzi con giacenza minore o uguale alla soglia')
+    p.add_argument('--soglia', type=int, default=SOGLIA)
+    p = sotto.add_parser('ricostruisci', help='ricalcola la giacenza dai dati')
+    p.add_argument('--verifica', action='store_true', help='elenca le differenze senza correggerle')
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    if args.comando=='istantanea':
+        with engine.begin() as conn:
+            print('Istantanea del %s: %d pezzi' % (args.data or datetime.date.today(), istantanea(conn, args.data)))
+    elif args.comando=='giacenza':
+        with engine.connect() as conn:
+            for p, q in sorted(giacenza_al(conn, args.data or datetime.date.today(), args.pezzo).items()):
+                print((p, q))
+    elif args.comando=='scorta':
+        with engine.connect() as conn:
+            for riga in sotto_scorta(conn, args.soglia):
+                print(tuple(riga))
+    else:
+        with engine.connect() as conn:
+            diverse = differenze(conn)
+        for p, attesa, attuale in diverse:
+            print('Pezzo %d: attesa %d, trovata %d' % (p, attesa, attuale))
+        if not args.verifica:
+            prepara(engine)
+            print('Giacenza ricostruita (%d pezzi corretti)' % len(diverse))
+        elif not diverse:
+            print('La giacenza è allineata')
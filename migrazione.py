@@ -0,0 +1,73 @@
+# Aggiunge a un database già popolato gli indici dichiarati in modelli.py che ancora mancano,
+# senza ricreare le tabelle.
+# Su MySQL gli indici sono creati con ALGORITHM=INPLACE, LOCK=NONE: la tabella resta leggibile
+# e scrivibile durante la costruzione (se il server non lo consente l'istruzione fallisce subito).
+#
+# Uso: python migrazione.py [--url URL] [--prova]
+import time
+
+from sqlalchemy import inspect, text
+
+from modelli import Base
+
+def indici_mancanti(engine):
+    ispettore = inspect(engine)
+    mancanti = []
+    for tabella in Base.metadata.sorted_tables:
+        if not ispettore.has_table(tabella.name):
+            continue
+        esistenti = ispettore.get_indexes(tabella.name) + ispettore.get_unique_constraints(tabella.name)
+        nomi = {i['name'] for i in esistenti}
+        colonne = {tuple(i['column_names']) for i in esistenti}
+        for indice in tabella.indexes:
+            # un indice con lo stesso nome o sulle stesse colonne (anche creato a mano) basta
+            if indice.name in nomi or tuple(c.name for c in indice.columns) in colonne:
+                continue
+            mancanti.append(indice)
+    return mancanti
+
+def crea_indice(engine, indice):
+    if engine.dialect.name=='mysql':
+        q = engine.dialect.identifier_preparer.quote
+        colonne = ', '.join(q(c.name) for c in indice.columns)
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE %s ADD %sINDEX %s (%s), ALGORITHM=INPLACE, LOCK=NONE'
+                              % (q(indice.table.name), 'UNIQUE ' if indice.unique else '', q(indice.name), colonne)))
+    else:
+        indice.create(bind=engine)
+
+def aggiorna_statistiche(engine, tabelle):
+    # senza statistiche aggiornate il planner può ignorare gli indici appena creati
+    q = engine.dialect.identifier_preparer.quote
+    comando = 'ANALYZE TABLE %s' if engine.dialect.name=='mysql' else 'ANALYZE %s'
+    with engine.begin() as conn:
+        for tabella in tabelle:
+            conn.execute(text(comando % q(tabella.name)))
+
+def aggiungi_indici(engine, prova=False):
+    fatti = []
+    for indice in indici_mancanti(engine):
+        inizio = time.perf_counter()
+        if not prova:
+            crea_indice(engine, indice)
+        fatti.append((indice, time.perf_counter() - inizio))
+    if fatti and not prova:
+        aggiorna_statistiche(engine, {indice.table for indice, durata in fatti})
+    return fatti
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Aggiunge gli indici mancanti a un database esistente')
+    parser.add_argument('--url', help='URL del database')
+    parser.add_argument('--prova', action='store_true', help='elenca gli indici mancanti senza crearli')
+    args = parser.parse_args()
+
+    from connessione import crea_engine
+    engine = crea_engine(args.url)
+    fatti = aggiungi_indici(engine, args.prova)
+    for indice, durata in fatti:
+        colonne = ', '.join(c.name for c in indice.columns)
+        if args.prova: print('%s su %s(%s)' % (indice.name, indice.table.name, colonne))
+        else: print('%s su %s(%s) creato in %.2f s' % (indice.name, indice.table.name, colonne, durata))
+    if not fatti: print('Nessun indice mancante')
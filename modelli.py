@@ -0,0 +1,220 @@
+from sqlalchemy import *
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+from sqlalchemy.orm import backref
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+
+import sqlite3
+
+class Vista:
+    # view() restituisce i valori delle colonne di vista(): sono le stesse che consultazione legge con Core
+    # senza creare oggetti, quindi le due letture non possono divergere
+    def view(self):
+        return tuple(getattr(self, c.key) for c in vista(type(self)))
+
+_viste = {}
+
+def vista(tabella):
+    # attributi mostrati da view(): tutte le colonne, nell'ordine in cui sono dichiarate
+    if tabella not in _viste:
+        _viste[tabella] = tuple(getattr(tabella, p.key) for p in tabella.__mapper__.column_attrs)
+    return _viste[tabella]
+
+Base = declarative_base(cls=Vista)
+
+# le cancellazioni si appoggiano agli ON DELETE CASCADE del database (passive_deletes),
+# che SQLite applica solo se le chiavi esterne sono attive sulla connessione
+@event.listens_for(Engine, 'connect')
+def _chiavi_esterne_sqlite(connessione, record):
+    if isinstance(connessione, sqlite3.Connection):
+        connessione.execute('PRAGMA foreign_keys=ON')
+
+class Città(Base):
+    __tablename__ = 'città'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable=False, unique=True)
+
+class Proprietario(Base):
+    __tablename__ = 'proprietario'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable=False)
+    Cognome = Column(String, nullable=False)
+    Email = Column(String, unique=True)
+    Telefono = Column(String, nullable=False)
+    IdCittà = Column(Integer, ForeignKey('città.Id', onupdate="CASCADE", ondelete="SET NULL"), index=True)
+    città = relationship('Città')
+
+class Marca(Base):
+    __tablename__ = 'marca'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable=False, index=True)
+
+class Modello(Base):
+    __tablename__ = 'modello'
+    __table_args__ = (Index('ix_modello_Nome_IdMarca', 'Nome', 'IdMarca'),)
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable=False)
+    IdMarca = Column(Integer, ForeignKey('marca.Id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    marca = relationship('Marca', backref = backref('Modello', cascade='all, delete', passive_deletes=True))
+
+class Meccanico(Base):
+    __tablename__ = 'meccanico'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable=False)
+    Cognome = Column(String, nullable=False)
+    CF = Column(String, unique=True)
+
+class Automobile(Base):
+    __tablename__ = 'automobile'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Targa = Column(String, unique=True, nullable=False)
+    IdProprietario = Column(Integer, ForeignKey('proprietario.Id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    IdModello = Column(Integer, ForeignKey('modello.Id', onupdate='CASCADE', ondelete='SET NULL'), index=True)
+    proprietario = relationship('Proprietario', backref = backref('Automobile', cascade='all, delete', passive_deletes=True))
+    modello = relationship('Modello')
+
+class Pezzo(Base):
+    __tablename__ = 'pezzo'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable=False, index=True)
+
+class Intervento(Base):
+    __tablename__ = 'intervento'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Durata = Column(Integer)
+    Descrizione = Column(String)
+    IdMeccanico = Column(Integer, ForeignKey('meccanico.Id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False, index=True)
+    IdAutomobile = Column(Integer, ForeignKey('automobile.Id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    meccanico = relationship('Meccanico', backref = backref('Intervento', cascade='all,delete', passive_deletes=True))
+    automobile = relationship('Automobile', backref = backref('Intervento', cascade='all, delete', passive_deletes=True))
+
+class Recensione(Base):
+    __tablename__ = 'recensione'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Commento = Column(String)
+    Voto = Column(Integer, CheckConstraint('Voto>=0 and Voto<=5'))
+    IdProprietario = Column(Integer, ForeignKey('proprietario.Id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    IdIntervento = Column(Integer, ForeignKey('intervento.Id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    proprietario = relationship('Proprietario', backref = backref('Recensione', cascade='all, delete', passive_deletes=True))
+    intervento = relationship('Intervento', backref = backref('Recensione', cascade='all,delete', passive_deletes=True))
+
+class Fornitore(Base):
+    __tablename__ = 'fornitore'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Nome = Column(String, nullable='False', unique=True)
+
+class Spedizione(Base):
+    __tablename__ = 'spedizione'
+    # gli Id delle spedizioni archiviate (archivio.py) non vengono riusati anche se non sono più in questa tabella
+    __table_args__ = {'sqlite_autoincrement': True}
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Prezzo = Column(Integer)
+    DataSpedizione = Column(Date, nullable=False, index=True)
+    QuantitàSpedita = Column(Integer)
+    IdPezzo = Column(Integer, ForeignKey('pezzo.Id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False, index=True)
+    IdFornitore = Column(Integer, ForeignKey('fornitore.Id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False, index=True)
+    pezzo = relationship('Pezzo', backref = backref('Spedizione', cascade='all, delete', passive_deletes=True))
+    fornitore = relationship('Fornitore', backref = backref('Spedizione', cascade='all, delete', passive_deletes=True))
+
+class Usando(Base):
+    __tablename__ = 'usando'
+    IdIntervento = Column(Integer, ForeignKey('intervento.Id', onupdate='CASCADE', ondelete='CASCADE'), primary_key = True, nullable=False)
+    IdPezzo = Column(Integer, ForeignKey('pezzo.Id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True, nullable=False, index=True)
+    Quantità = Column(Integer)
+    PrezzoUnitario = Column(Integer)
+    intervento = relationship('Intervento', backref = backref('Usando', cascade='all, delete', passive_deletes=True))
+    pezzo = relationship('Pezzo', backref = backref('Usando', cascade='all,delete', passive_deletes=True))
+
+class RiepilogoMeccanico(Base):
+    # totali per meccanico tenuti aggiornati dai trigger di riepilogo.py (non è nel menu)
+    __tablename__ = 'riepilogo_meccanico'
+    IdMeccanico = Column(Integer, ForeignKey('meccanico.Id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    Interventi = Column(Integer, nullable=False, default=0, index=True)
+    Durata = Column(Integer, nullable=False, default=0)
+    Recensioni = Column(Integer, nullable=False, default=0)
+    SommaVoti = Column(Integer, nullable=False, default=0)
+
+class Giacenza(Base):
+    # pezzi in magazzino (spediti meno usati) tenuti aggiornati dai trigger di magazzino.py (non è nel menu)
+    __tablename__ = 'giacenza'
+    IdPezzo = Column(Integer, ForeignKey('pezzo.Id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    Quantità = Column(Integer, nullable=False, default=0, index=True)
+
+class IstantaneaGiacenza(Base):
+    # giacenza di ogni pezzo a una data, salvata periodicamente da magazzino.py
+    __tablename__ = 'istantanea_giacenza'
+    Data = Column(Date, primary_key=True)
+    IdPezzo = Column(Integer, ForeignKey('pezzo.Id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    Quantità = Column(Integer, nullable=False)
+
+class Modifica(Base):
+    # modifiche alle dodici tabelle scritte dai trigger di modifiche.py, in attesa di passare nel registro su file (non è nel menu)
+    __tablename__ = 'modifica'
+    # gli Id non vengono riusati anche quando la tabella si svuota
+    __table_args__ = {'sqlite_autoincrement': True}
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Tabella = Column(String, nullable=False)
+    Operazione = Column(String, nullable=False)
+    Prima = Column(Text)
+    Dopo = Column(Text)
+    Istante = Column(String, nullable=False)
+
+class ModificheSpedite(Base):
+    # per ogni file del registro delle modifiche, l'ultimo record la cui spedizione è confermata (modifiche.spedisci)
+    __tablename__ = 'modifiche_spedite'
+    File = Column(String, primary_key=True)
+    N = Column(Integer, nullable=False)
+
+class Archivio(Base):
+    # anni di spedizioni spostati da archivio.py, ognuno nella sua tabella spedizione_AAAA (non è nel menu)
+    __tablename__ = 'archivio'
+    Anno = Column(Integer, primary_key=True, autoincrement=False)
+
+class Archiviazione(Base):
+    # esecuzioni di archivio.py: Fine resta NULL finché l'esecuzione non finisce, e riprendi continua l'ultima
+    __tablename__ = 'archiviazione'
+    Id = Column(Integer, primary_key=True, autoincrement=True)
+    Limite = Column(Date, nullable=False)
+    Spostate = Column(Integer, nullable=False, default=0)
+    Inizio = Column(DateTime, nullable=False)
+    Fine = Column(DateTime)
+
+# Spedizione più le spedizioni archiviate: una vista creata da archivio.py per le letture per data che devono
+# vedere tutte le spedizioni (report 4, magazzino, analisi). Non è in Base.metadata perché non è una tabella
+spedizione_tutte = Table('spedizione_tutte', MetaData(), *[Column(c.name, c.type, primary_key=c.primary_key) for c in Spedizione.__table__.c])
+
+# da incrementare a ogni modifica di tabelle o indici: all'avvio connessione.prepara_schema()
+# confronta questo numero con quello salvato nel database e solo se diverso aggiorna lo schema
+VERSIONE_SCHEMA = 7
+versione_schema = Table('versione_schema', Base.metadata, Column('versione', Integer, nullable=False))
+
+# stesso ordine del menu: la scelta n corrisponde a TABELLE[n-1]
+TABELLE = (Città, Proprietario, Automobile, Fornitore, Intervento, Marca, Meccanico, Modello, Pezzo, Recensione, Usando, Spedizione)
+
+def cerca_tabella(nome):
+    nome = nome.lower().replace('a\'', 'à')
+    for t in TABELLE:
+        if nome in (t.__name__.lower(), t.__tablename__, t.__name__.lower().replace('à', 'a')):
+            return t
+    raise ValueError("Tabella %s inesistente" % nome)
+
+def testa_prefisso(prefisso):
+    # la parte del prefisso su cui si può usare un intervallo: fino alla prima lettera compresa. LIKE non distingue
+    # maiuscole e minuscole, quindi con più lettere ("Pa" trova anche "PANDA" e "pAnda") l'intervallo in maiuscolo
+    # e quello in minuscolo non basterebbero; con una lettera sola invece coprono tutte le righe di LIKE
+    for i, c in enumerate(prefisso):
+        if c.upper() != c.lower(): return prefisso[:i + 1]
+    return prefisso
+
+def fine_intervallo(p):
+    return p[:-1] + chr(ord(p[-1]) + 1)
+
+def inizia_per(colonna, prefisso):
+    # equivale a colonna LIKE 'prefisso%', ma con un intervallo che permette di usare l'indice
+    # (SQLite non usa l'indice per LIKE); l'intervallo copre testa_prefisso() in maiuscolo e in minuscolo
+    testa = testa_prefisso(prefisso)
+    if not testa: return colonna.like(prefisso + '%')
+    def intervallo(p):
+        return and_(colonna >= p, colonna < fine_intervallo(p))
+    return and_(colonna.like(prefisso + '%'), or_(intervallo(testa.upper()), intervallo(testa.lower())))
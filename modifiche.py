@@ -0,0 +1,344 @@
+# Registro delle modifiche alle dodici tabelle (change data capture), per il magazzino dati e gli altri sistemi a valle.
+#
+# Le modifiche le scrivono dei trigger nella tabella modifica, nella stessa transazione della scrittura, quindi vale per
+# ogni modo di scrivere: flush dell'ORM, session.execute(update(...)), cancellazione.elimina, inserimenti a blocchi,
+# cancellazioni e SET NULL a cascata del database, altri programmi; una scrittura annullata sparisce insieme alle sue
+# modifiche. Sulla scrittura pesa solo un inserimento in più per riga. SQLite esegue i trigger anche per le righe toccate
+# dalla cascata; MySQL no: lì dei trigger BEFORE DELETE sulle tabelle madri registrano prima della
+# cancellazione le righe che la cascata cancellerà o metterà a NULL (non le chiavi primarie cambiate con ON UPDATE CASCADE).
+#
+# spedisci() sposta le modifiche dalla tabella al file del registro a blocchi: ogni blocco è una sola scrittura in coda al
+# file seguita da un fsync, e solo dopo le sue righe vengono tolte dalla tabella. Una riga JSON per modifica:
+#   {"n":12,"modifica":845,"tabella":"Intervento","op":"U","chiave":{"Id":3},"prima":{"Durata":60},"dopo":{"Durata":90},"istante":"..."}
+# n è il numero progressivo nel registro (l'ordine in cui applicarle); op I ha dopo (la riga nuova), D ha prima (la riga
+# cancellata), U ha prima e dopo delle sole colonne cambiate. Insieme alla cancellazione si salva in modifiche_spedite il
+# numero dell'ultimo record confermato: se spedisci si interrompe tra fsync e cancellazione, alla ripartenza i record
+# del file dopo quel numero, quanti che siano e qualunque fosse il blocco, sono le modifiche già scritte da non ripetere.
+# Deve girare un solo spedisci per registro.
+#
+# leggi() e segui() rileggono il registro da un punto di ripresa (numero e posizione nel file, salvati in un file del
+# consumatore). Le modifiche partono da quando i trigger vengono attivati: chi consuma parte da una copia presa in quel momento.
+#
+# Uso: python modifiche.py [--url URL] attiva | disattiva | stato
+#      python modifiche.py [--url URL] spedisci [--file modifiche.log] [--continua] [--intervallo 1]
+#      python modifiche.py leggi [--file modifiche.log] [--dal N] [--punto consumatore.punto] [--segui]
+import os, json, time
+
+from sqlalchemy import select, insert, update, delete, func, text, bindparam
+
+from modelli import *
+
+REGISTRO = 'modifiche.log'
+BLOCCO = 1000
+# secondi tra un controllo e l'altro quando non c'è niente di nuovo (spedisci --continua, leggi --segui)
+INTERVALLO = 1
+# ogni quanti record letti segui() salva il punto di ripresa
+SALVA = 1000
+
+_per_nome = {t.__tablename__: t for t in TABELLE}
+
+def _istante(dialetto):
+    return 'CAST(UTC_TIMESTAMP(3) AS CHAR)' if dialetto=='mysql' else "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def json_riga(riga, colonne, valori=None):
+    # json_object('Id', OLD.Id, ...), uguale in SQLite e MySQL; valori sostituisce l'espressione di qualche colonna
+    return 'json_object(%s)' % ', '.join("'%s', %s" % (c.name, (valori or {}).get(c.name, '%s.%s' % (riga, c.name))) for c in colonne)
+
+def registra(dialetto, tabella, operazione, prima, dopo, da=None):
+    # INSERT nella tabella modifica: della riga del trigger, oppure (da) delle righe x di una SELECT
+    valori = "'%s', '%s', %s, %s, %s" % (tabella, operazione, prima or 'NULL', dopo or 'NULL', _istante(dialetto))
+    if da: return 'INSERT INTO modifica (Tabella, Operazione, Prima, Dopo, Istante) SELECT %s FROM %s;' % (valori, da)
+    return 'INSERT INTO modifica (Tabella, Operazione, Prima, Dopo, Istante) VALUES (%s);' % valori
+
+def _figlie(tabella, azione):
+    # (tabella figlia, colonna della chiave esterna, colonna riferita) per le chiavi esterne verso tabella con quell'ON DELETE
+    for t in TABELLE:
+        for fk in t.__table__.foreign_keys:
+            if fk.column.table is tabella.__table__ and (fk.ondelete or '').upper()==azione:
+                yield t, fk.parent, fk.column
+
+def _condizione(colonna, riferita, madre, condizione):
+    # le righe x della figlia che puntano alle righe della madre: la riga OLD, oppure quelle che soddisfano condizione
+    if condizione is None: return 'x.%s = OLD.%s' % (colonna.name, riferita.name)
+    return 'x.%s IN (SELECT x.%s FROM %s x WHERE %s)' % (colonna.name, riferita.name, madre.__tablename__, condizione)
+
+def _cascata(tabella, condizione, righe):
+    # tabella -> condizioni (in OR) sulle righe che la cancellazione cancellerà a cascata, a ogni livello
+    for figlia, colonna, riferita in _figlie(tabella, 'CASCADE'):
+        c = _condizione(colonna, riferita, tabella, condizione)
+        righe.setdefault(figlia, []).append(c)
+        _cascata(figlia, c, righe)
+    return righe
+
+def _compensazione(dialetto, tabella):
+    # MySQL: registra le righe cancellate o messe a NULL dalla cascata, prima di cancellare la riga OLD di tabella
+    cancellate = {figlia: '(%s)' % ' OR '.join(c) for figlia, c in _cascata(tabella, None, {}).items()}
+    corpo = ''.join(registra(dialetto, f.__tablename__, 'D', json_riga('x', f.__table__.c), None, '%s x WHERE %s' % (f.__tablename__, c))
+                    for f, c in cancellate.items())
+    for madre, condizione in [(tabella, None)] + list(cancellate.items()):
+        for figlia, colonna, riferita in _figlie(madre, 'SET NULL'):
+            colonne = list(figlia.__table__.primary_key) + [colonna]
+            corpo += registra(dialetto, figlia.__tablename__, 'U', json_riga('x', colonne), json_riga('x', colonne, {colonna.name: 'NULL'}),
+                               '%s x WHERE %s' % (figlia.__tablename__, _condizione(colonna, riferita, madre, condizione)))
+    return corpo
+
+def trigger(dialetto):
+    # nome -> (momento e tabella, condizione WHEN o None, corpo)
+    mysql = dialetto=='mysql'
+    elenco = {}
+    for t in TABELLE:
+        nome = 'modifiche_' + t.__name__.lower().replace('à', 'a')
+        tabella, colonne = t.__tablename__, t.__table__.c
+        # solo se qualche colonna cambia davvero
+        cambiata = ' OR '.join(('NOT (OLD.%s <=> NEW.%s)' if mysql else 'OLD.%s IS NOT NEW.%s') % (c.name, c.name) for c in colonne)
+        modificata = registra(dialetto, tabella, 'U', json_riga('OLD', colonne), json_riga('NEW', colonne))
+        elenco[nome + '_inserita'] = ('AFTER INSERT ON ' + tabella, None, registra(dialetto, tabella, 'I', None, json_riga('NEW', colonne)))
+        elenco[nome + '_modificata'] = (('AFTER UPDATE ON ' + tabella, None, 'IF %s THEN %s END IF;' % (cambiata, modificata)) if mysql
+                                        else ('AFTER UPDATE ON ' + tabella, cambiata, modificata))
+        elenco[nome + '_eliminata'] = ('AFTER DELETE ON ' + tabella, None, registra(dialetto, tabella, 'D', json_riga('OLD', colonne), None))
+        if mysql:
+            corpo = _compensazione(dialetto, t)
+            if corpo: elenco[nome + '_cascata'] = ('BEFORE DELETE ON ' + tabella, None, corpo)
+    return elenco
+
+def togli_trigger(conn):
+    import archivio
+    for nome in trigger(conn.dialect.name):
+        conn.execute(text('DROP TRIGGER IF EXISTS %s' % nome))
+    # i trigger delle spedizioni archiviate registrano le cancellazioni solo quando le modifiche sono attive
+    archivio.crea_trigger(conn)
+
+def crea_trigger(conn):
+    import archivio
+    togli_trigger(conn)
+    for nome, (momento, condizione, corpo) in trigger(conn.dialect.name).items():
+        quando = ' WHEN %s' % condizione if condizione else ''
+        conn.execute(text('CREATE TRIGGER %s %s FOR EACH ROW%s BEGIN %s END' % (nome, momento, quando, corpo)))
+    archivio.crea_trigger(conn)
+
+def attive(conn):
+    # True se tutti i trigger delle modifiche ci sono
+    nomi = list(trigger(conn.dialect.name))
+    if conn.dialect.name=='sqlite':
+        q = text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN :nomi")
+    else:
+        q = text('SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME IN :nomi')
+    return len(conn.execute(q.bindparams(bindparam('nomi', expanding=True)), {'nomi': nomi}).all())==len(nomi)
+
+def record(n, riga):
+    # il record del registro per una riga della tabella modifica; None se la modifica non cambia niente
+    tabella = _per_nome[riga.Tabella]
+    prima = json.loads(riga.Prima) if riga.Prima else None
+    dopo = json.loads(riga.Dopo) if riga.Dopo else None
+    chiave = {c.name: (prima or dopo)[c.name] for c in tabella.__table__.primary_key}
+    if riga.Operazione=='U':
+        cambiate = [k for k in dopo if prima.get(k) != dopo[k]]
+        if not cambiate: return None
+        prima, dopo = {k: prima[k] for k in cambiate}, {k: dopo[k] for k in cambiate}
+    r = {'n': n, 'modifica': riga.Id, 'tabella': tabella.__name__, 'op': riga.Operazione, 'chiave': chiave}
+    if prima is not None: r['prima'] = prima if dopo is not None else {k: v for k, v in prima.items() if k not in chiave}
+    if dopo is not None: r['dopo'] = dopo if prima is not None else {k: v for k, v in dopo.items() if k not in chiave}
+    r['istante'] = riga.Istante
+    return r
+
+def _coda(percorso, quante, tronca=False):
+    # gli ultimi record completi del file; con tronca toglie una riga finale lasciata a metà da una scrittura interrotta
+    try:
+        f = open(percorso, 'r+b' if tronca else 'rb')
+    except FileNotFoundError:
+        return []
+    with f:
+        fine = f.seek(0, os.SEEK_END)
+        inizio, dati = fine, b''
+        while inizio > 0 and dati.count(b'\n') <= quante:
+            inizio = max(0, inizio - 65536)
+            f.seek(inizio)
+            dati = f.read(fine - inizio)
+        completi = dati.rfind(b'\n') + 1
+        if tronca and inizio + completi < fine: f.truncate(inizio + completi)
+        righe = dati[:completi].split(b'\n')[:-1]
+        # la prima riga letta può essere solo la fine di un record
+        if inizio > 0: righe = righe[1:]
+        return [json.loads(r) for r in righe[-quante:]] if quante else []
+
+class Registro:
+    # il file del registro, aperto in aggiunta; n è il numero dell'ultimo record scritto
+    def __init__(self, percorso=REGISTRO):
+        self.percorso = percorso
+        # nome con cui il file compare in modifiche_spedite, lo stesso da qualunque cartella si parta
+        self.nome = os.path.abspath(percorso)
+        ultimo = _coda(percorso, 1, tronca=True)
+        self.n = ultimo[0]['n'] if ultimo else 0
+        self.ripreso = False
+        self.file = open(percorso, 'ab')
+        self.sincronizzazioni = 0
+
+    def scrivi(self, elenco):
+        # tutti i record del blocco con una sola scrittura, poi fsync: al ritorno sono sul disco
+        self.file.write(b''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8') + b'\n' for r in elenco))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.sincronizzazioni += 1
+        if elenco: self.n = elenco[-1]['n']
+
+    def chiudi(self):
+        self.file.close()
+
+def _confermato(conn, registro):
+    # salva l'ultimo record confermato del registro, nella transazione che cancella le sue modifiche
+    t = ModificheSpedite.__table__
+    if conn.execute(update(t).where(t.c.File==registro.nome).values(N=registro.n)).rowcount==0:
+        conn.execute(insert(t).values(File=registro.nome, N=registro.n))
+
+def riprendi(engine, registro):
+    # ripartenza dopo un'interruzione tra fsync e cancellazione: le modifiche dei record dopo l'ultimo confermato
+    # sono già nel file e si tolgono dalla tabella (stesso Id e stesso istante, perché l'Id di una modifica già
+    # spedita potrebbe essere stato riusato); senza un numero salvato si controlla l'ultimo blocco
+    with engine.begin() as conn:
+        confermato = conn.scalar(select(ModificheSpedite.N).where(ModificheSpedite.File==registro.nome))
+        quanti = BLOCCO if confermato is None else max(0, registro.n - confermato)
+        scritte = {(r['modifica'], r['istante']) for r in _coda(registro.percorso, quanti)}
+        if scritte:
+            righe = conn.execute(select(Modifica.Id, Modifica.Istante).where(Modifica.Id.in_([m for m, _ in scritte]))).all()
+            doppie = [i for i, istante in righe if (i, istante) in scritte]
+            if doppie: conn.execute(delete(Modifica).where(Modifica.Id.in_(doppie)))
+        _confermato(conn, registro)
+    registro.ripreso = True
+
+def spedisci(engine, registro, blocco=BLOCCO):
+    # sposta nel registro tutte le modifiche in attesa, un blocco alla volta; restituisce quanti record ha scritto
+    if not registro.ripreso: riprendi(engine, registro)
+    scritti = 0
+    while True:
+        with engine.begin() as conn:
+            righe = conn.execute(select(Modifica.__table__).order_by(Modifica.Id).limit(blocco)).all()
+            if not righe: return scritti
+            elenco = []
+            for riga in righe:
+                r = record(registro.n + len(elenco) + 1, riga)
+                if r is not None: elenco.append(r)
+            registro.scrivi(elenco)
+            # per Id e non per intervallo: su MySQL una transazione più lenta può confermare dopo un Id più basso
+            conn.execute(delete(Modifica).where(Modifica.Id.in_([riga.Id for riga in righe])))
+            _confermato(conn, registro)
+        scritti += len(elenco)
+
+def in_attesa(conn):
+    return conn.scalar(select(func.count()).select_from(Modifica))
+
+def leggi(percorso=REGISTRO, dal=0, posizione=0):
+    # (posizione nel file dopo il record, record) per i record con n > dal, a partire dalla posizione in byte indicata
+    try:
+        f = open(percorso, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(posizione)
+        for riga in f:
+            # un record ancora in scrittura si legge la volta dopo
+            if not riga.endswith(b'\n'): return
+            posizione += len(riga)
+            r = json.loads(riga)
+            if r['n'] > dal: yield posizione, r
+
+def punto(file):
+    # (n, posizione) del punto di ripresa salvato, (0, 0) se non c'è ancora
+    try:
+        with open(file) as f:
+            n, posizione = f.read().split()
+    except FileNotFoundError:
+        return 0, 0
+    return int(n), int(posizione)
+
+def salva_punto(file, n, posizione):
+    # scritto a parte e poi rinominato: un'interruzione lascia il punto precedente, mai uno a metà
+    with open(file + '.tmp', 'w') as f:
+        f.write('%d %d\n' % (n, posizione))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(file + '.tmp', file)
+
+def segui(percorso=REGISTRO, file_punto=None, continua=False, intervallo=INTERVALLO):
+    # i record dopo il punto di ripresa, uno alla volta; un record conta come letto quando si chiede il successivo,
+    # quindi dopo un'interruzione si rilegge al più qualche record già elaborato, mai se ne salta uno
+    n, posizione = punto(file_punto) if file_punto else (0, 0)
+    salvato = n
+    while True:
+        for dopo, r in leggi(percorso, n, posizione):
+            yield r
+            n, posizione = r['n'], dopo
+            if file_punto and n - salvato >= SALVA:
+                salva_punto(file_punto, n, posizione)
+                salvato = n
+        if file_punto and n != salvato:
+            salva_punto(file_punto, n, posizione)
+            salvato = n
+        if not continua: return
+        time.sleep(intervallo)
+
+if __name__ == '__main__':
+    import sys, argparse
+
+    parser = argparse.ArgumentParser(description='Registro delle modifiche alle tabelle')
+    parser.add_argument('--url', help='URL del database')
+    sotto = parser.add_subparsers(dest='comando', required=True)
+    sotto.add_parser('attiva', help='crea i trigger che registrano le modifiche')
+    sotto.add_parser('disattiva', help='toglie i trigger (le modifiche in attesa restano da spedire)')
+    p = sotto.add_parser('stato', help='trigger attivi, modifiche in attesa e ultimo record del registro')
+    p.add_argument('--file', help='file del registro (predefinito %s)' % REGISTRO)
+    p = sotto.add_parser('spedisci', help='sposta le modifiche in attesa nel file del registro')
+    p.add_argument('--file', help='file del registro (predefinito %s)' % REGISTRO)
+    p.add_argument('--blocco', type=int, default=BLOCCO, help='modifiche per scrittura e fsync')
+    p.add_argument('--continua', action='store_true', help='resta in esecuzione e spedisce man mano')
+    p.add_argument('--intervallo', type=float, default=INTERVALLO)
+    p = sotto.add_parser('leggi', help='stampa i record del registro')
+    p.add_argument('--file', help='file del registro (predefinito %s)' % REGISTRO)
+    p.add_argument('--dal', type=int, default=0, help='solo i record con n maggiore (senza --punto)')
+    p.add_argument('--punto', help='file del punto di ripresa: si riparte da lì e lo si aggiorna')
+    p.add_argument('--segui', action='store_true', help='resta in attesa dei record nuovi')
+    p.add_argument('--intervallo', type=float, default=INTERVALLO)
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema, impostazioni
+    percorso = getattr(args, 'file', None) or impostazioni().get('modifiche') or REGISTRO
+    if args.comando=='leggi':
+        if args.punto:
+            elenco = segui(percorso, args.punto, args.segui, args.intervallo)
+        else:
+            elenco = (r for _, r in leggi(percorso, args.dal))
+        try:
+            for r in elenco:
+                print(json.dumps(r, ensure_ascii=False), flush=True)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    if args.comando=='attiva':
+        with engine.begin() as conn:
+            crea_trigger(conn)
+        print('Registrazione delle modifiche attiva: python modifiche.py spedisci --continua le porta in %s' % percorso)
+    elif args.comando=='disattiva':
+        with engine.begin() as conn:
+            togli_trigger(conn)
+            print('Trigger tolti, %d modifiche in attesa' % in_attesa(conn))
+    elif args.comando=='stato':
+        with engine.connect() as conn:
+            print('Trigger: %s' % ('attivi' if attive(conn) else 'non attivi'))
+            print('In attesa: %d modifiche' % in_attesa(conn))
+        ultimo = _coda(percorso, 1)
+        print('Registro %s: %s' % (percorso, 'ultimo record n=%d (%s)' % (ultimo[0]['n'], ultimo[0]['istante']) if ultimo else 'vuoto'))
+    else:
+        registro = Registro(percorso)
+        try:
+            while True:
+                inizio = time.perf_counter()
+                n = spedisci(engine, registro, args.blocco)
+                if n: print('%d modifiche scritte (fino a n=%d), %.0f al secondo' % (n, registro.n, n / (time.perf_counter() - inizio)), flush=True)
+                if not args.continua: break
+                if not n: time.sleep(args.intervallo)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            registro.chiudi()
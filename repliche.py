@@ -0,0 +1,179 @@
+# Instradamento tra database principale e repliche: le scritture (insert, update, delete, flush dell'ORM, SELECT ...
+# FOR UPDATE) vanno sempre al principale, le letture (elenchi, report, ricerche per nome) a una delle repliche, a turno.
+#
+# Lettura delle proprie scritture: una sessione che ha già scritto legge dal principale fino alla fine (le sessioni
+# sono per operazione, vedi connessione.sessioni), e per ritardo secondi dopo l'ultima scrittura leggono dal principale
+# anche le sessioni seguenti, così il menu ritrova subito quello che ha appena inserito anche se la replica è indietro.
+#
+# Una replica che non risponde viene saltata per RIPROVA secondi; se non ce n'è nessuna disponibile si legge dal
+# principale. Una replica che cade a metà di una lettura fa fallire quella lettura, le successive vanno altrove.
+#
+# In locale una copia del file SQLite fa da replica (aperta in sola lettura, così una scrittura instradata male fallisce):
+#   python repliche.py copia --url sqlite:///officina.db officina_replica.db
+#   OFFICINA_REPLICHE="sqlite:///file:officina_replica.db?mode=ro&uri=true" python Officina2.py
+#   python repliche.py stato
+#   python repliche.py verifica   (con una replica rimasta indietro, update e delete per criterio vanno comunque a buon fine)
+import time, itertools
+
+from sqlalchemy import event, select, exc
+from sqlalchemy.orm import Session
+
+# secondi in cui una replica che non ha risposto non viene usata
+RIPROVA = 30
+# ogni quanti secondi una replica in uso viene verificata prima di instradarle una lettura
+VERIFICA = 5
+
+class Repliche:
+    def __init__(self, engines, leggi_scritture=True, ritardo=0, riprova=RIPROVA):
+        self.engines = list(engines)
+        self.leggi_scritture = leggi_scritture
+        self.ritardo = ritardo
+        self.riprova = riprova
+        self.fuori_uso = {}
+        self.verificate = {}
+        self.ultima_scrittura = None
+        self.letture = {e: 0 for e in self.engines}
+        self._giro = itertools.cycle(range(len(self.engines)))
+        for e in self.engines:
+            event.listen(e, 'handle_error', self._errore)
+
+    def _errore(self, contesto):
+        # connessione persa durante una lettura: la replica non si usa più per un po'
+        if contesto.is_disconnect or contesto.connection is None:
+            self.fuori_uso[contesto.engine] = time.monotonic() + self.riprova
+
+    def disponibile(self, engine):
+        ora = time.monotonic()
+        if self.fuori_uso.get(engine, 0) > ora: return False
+        if ora - self.verificate.get(engine, -VERIFICA) < VERIFICA: return True
+        try:
+            with engine.connect() as conn:
+                conn.scalar(select(1))
+        except exc.DBAPIError:
+            self.fuori_uso[engine] = ora + self.riprova
+            return False
+        self.verificate[engine] = ora
+        return True
+
+    def scegli(self):
+        # la prossima replica disponibile, oppure None
+        for _ in self.engines:
+            engine = self.engines[next(self._giro)]
+            if self.disponibile(engine):
+                self.letture[engine] += 1
+                return engine
+        return None
+
+    def scritto(self):
+        self.ultima_scrittura = time.monotonic()
+
+    def recente(self):
+        return self.ultima_scrittura is not None and time.monotonic() - self.ultima_scrittura < self.ritardo
+
+    def stato(self):
+        ora = time.monotonic()
+        return [(e.url.render_as_string(hide_password=True), self.disponibile(e), self.letture[e], max(0, self.fuori_uso.get(e, 0) - ora))
+                for e in self.engines]
+
+    def chiudi(self):
+        for e in self.engines:
+            event.remove(e, 'handle_error', self._errore)
+            e.dispose()
+
+def lettura(clause):
+    # solo le SELECT senza FOR UPDATE; text() e tutto il resto possono scrivere
+    return clause is not None and getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+class SessioneInstradata(Session):
+    # bind è il database principale; repliche un oggetto Repliche (None: tutto al principale)
+    def __init__(self, *argomenti, repliche=None, **opzioni):
+        super().__init__(*argomenti, **opzioni)
+        self.repliche = repliche
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        principale = super().get_bind(mapper, clause=clause, **kw)
+        if self.repliche is None: return principale
+        if self._flushing or not lettura(clause):
+            if clause is not None or self._flushing:
+                self.info['scritto'] = True
+                self.repliche.scritto()
+            return principale
+        if self.repliche.leggi_scritture and (self.info.get('scritto') or self.repliche.recente()): return principale
+        return self.repliche.scegli() or principale
+
+def primario(session):
+    # da qui alla fine della sessione anche le letture vanno al principale (ad esempio prima di leggere e poi scrivere)
+    session.info['scritto'] = True
+
+def verifica(cartella):
+    # principale e replica SQLite in cartella; la replica è copiata prima delle ultime scritture sul principale.
+    # Restituisce l'elenco dei controlli che non tornano
+    import os, sqlite3
+    from sqlalchemy import create_engine, update, insert
+    from modelli import Proprietario, Città
+    from connessione import prepara_schema, sessioni
+    import aggiornamento, cancellazione
+    principale = create_engine('sqlite:///' + os.path.join(cartella, 'principale.db'))
+    prepara_schema(principale)
+    with principale.begin() as conn:
+        chiave = conn.execute(insert(Proprietario).values(Nome='Mario', Cognome='Rossi', Telefono='061234')).inserted_primary_key[0]
+    with principale.connect() as conn, sqlite3.connect(os.path.join(cartella, 'replica.db')) as destinazione:
+        conn.connection.driver_connection.backup(destinazione)
+    with principale.begin() as conn:
+        conn.execute(update(Proprietario).where(Proprietario.Id==chiave).values(Telefono='111'))
+        conn.execute(insert(Città).values(Nome='Solo sul principale'))
+    repliche = Repliche([create_engine('sqlite:///file:%s?mode=ro&uri=true' % os.path.join(cartella, 'replica.db'))])
+    registro = sessioni(principale, repliche=repliche)
+    errori = []
+    try:
+        if registro().scalar(select(Proprietario.Telefono).where(Proprietario.Id==chiave)) != '061234': errori.append('la replica non è indietro')
+        registro.remove()
+        # sulla replica il telefono è già 061234: letto da lì, l'aggiornamento non cambierebbe nulla
+        if aggiornamento.aggiorna(registro(), Proprietario, chiave, {'Telefono': '061234'}) != {'Telefono': '061234'}: errori.append('update non eseguito')
+        registro.remove()
+        with principale.connect() as conn:
+            if conn.scalar(select(Proprietario.Telefono).where(Proprietario.Id==chiave)) != '061234': errori.append('update perso sul principale')
+        if cancellazione.elimina_dove(registro(), Città, Città.Nome=='Solo sul principale') != 1: errori.append('delete per criterio senza righe')
+        registro.remove()
+    finally:
+        repliche.chiudi()
+        principale.dispose()
+    return errori
+
+if __name__ == '__main__':
+    import argparse, sqlite3
+
+    parser = argparse.ArgumentParser(description='Repliche in lettura del database')
+    sotto = parser.add_subparsers(dest='comando', required=True)
+    p = sotto.add_parser('copia', help='aggiorna una copia SQLite del database principale da usare come replica in locale')
+    p.add_argument('--url', help='URL del database principale (SQLite)')
+    p.add_argument('file')
+    p = sotto.add_parser('stato', help='elenca le repliche configurate e se rispondono')
+    p = sotto.add_parser('verifica', help='controlla su SQLite che update e delete non leggano da una replica indietro')
+    args = parser.parse_args()
+
+    if args.comando=='verifica':
+        import sys, tempfile
+        with tempfile.TemporaryDirectory() as cartella:
+            errori = verifica(cartella)
+        for e in errori: print(e)
+        print('letture prima delle scritture: %s' % ('dal principale' if not errori else '%d controlli non tornano' % len(errori)))
+        sys.exit(1 if errori else 0)
+
+    from connessione import crea_engine, crea_repliche
+    if args.comando=='copia':
+        engine = crea_engine(args.url)
+        if engine.dialect.name != 'sqlite': parser.error('la copia locale funziona solo con SQLite')
+        # backup online: la copia è coerente anche se qualcuno sta scrivendo sul principale
+        with engine.connect() as conn:
+            origine = conn.connection.driver_connection
+            with sqlite3.connect(args.file) as destinazione:
+                origine.backup(destinazione)
+        print('Copiato %s in %s' % (engine.url.database, args.file))
+    else:
+        repliche = crea_repliche()
+        if repliche is None:
+            print('Nessuna replica configurata (OFFICINA_REPLICHE o repliche in officina.ini)')
+        else:
+            for url, attiva, letture, fuori in repliche.stato():
+                print('%-60s %s' % (url, 'disponibile' if attiva else 'non risponde'))
@@ -0,0 +1,133 @@
+# I report del menu "Visualizzare specifici dati".
+#
+# Ogni report è dichiarato una volta con @report(numero, titolo, colonne, parametri...): la funzione decorata
+# costruisce lo statement una sola volta, con dei bindparam al posto dei valori, e ogni esecuzione passa
+# solo i parametri. Lo statement è sempre lo stesso oggetto, quindi SQLAlchemy ne riusa la chiave di cache
+# e la compilazione; statistiche() riporta per ogni report quante esecuzioni hanno trovato lo statement
+# già compilato. I risultati sono letti a blocchi (yield_per) e possono essere stampati man mano.
+import datetime
+
+from sqlalchemy import select, func, desc, and_, or_, bindparam
+from sqlalchemy.engine.interfaces import CacheStats
+
+from modelli import *
+
+BLOCCO = 500
+
+class Parametro:
+    # tipo converte il testo digitato; espandi, se presente, trasforma il valore in più bindparam
+    def __init__(self, nome, tipo=str, predefinito=None, espandi=None):
+        self.nome = nome
+        self.tipo = tipo
+        self.predefinito = predefinito
+        self.espandi = espandi
+
+    def valori(self, valore):
+        if isinstance(valore, str) and self.tipo is not str:
+            try:
+                valore = self.tipo(valore)
+            except ValueError:
+                raise ValueError("valore non valido per %s: %s" % (self.nome, valore))
+        return self.espandi(self.nome, valore) if self.espandi else {self.nome: valore}
+
+class Report:
+    def __init__(self, numero, titolo, colonne, parametri, statement):
+        self.numero = numero
+        self.titolo = titolo
+        self.colonne = colonne
+        self.parametri = parametri
+        self.statement = statement
+        self.hit = 0
+        self.miss = 0
+
+    def valori(self, parametri):
+        nomi = {p.nome for p in self.parametri}
+        for nome in parametri:
+            if nome not in nomi: raise ValueError("il report %d non ha il parametro %s" % (self.numero, nome))
+        valori = {}
+        for p in self.parametri:
+            valori.update(p.valori(parametri.get(p.nome, p.predefinito)))
+        return valori
+
+    def esegui(self, session, **parametri):
+        # bind_arguments: con le repliche (repliche.py) la connessione è quella di una replica
+        risultato = session.connection(bind_arguments={'clause': self.statement}).execute(self.statement, self.valori(parametri))
+        if risultato.context.cache_hit is CacheStats.CACHE_HIT: self.hit += 1
+        else: self.miss += 1
+        return risultato
+
+# numero del menu -> Report
+REPORT = {}
+
+def report(numero, titolo, colonne, *parametri):
+    def registra(costruisci):
+        REPORT[numero] = Report(numero, titolo, colonne, parametri, costruisci().execution_options(yield_per=BLOCCO))
+        return costruisci
+    return registra
+
+def inizia_per_parametro(colonna, nome):
+    # come modelli.inizia_per, con il prefisso passato all'esecuzione: i limiti li calcola limiti_prefisso
+    def intervallo(caso):
+        return and_(colonna >= bindparam('%s_da_%s' % (nome, caso)), colonna < bindparam('%s_a_%s' % (nome, caso)))
+    return and_(colonna.like(bindparam(nome + '_like')), or_(intervallo('maiuscolo'), intervallo('minuscolo')))
+
+def limiti_prefisso(nome, prefisso):
+    if not prefisso: raise ValueError("il prefisso non può essere vuoto")
+    valori = {nome + '_like': prefisso + '%'}
+    testa = testa_prefisso(prefisso)
+    for caso, p in (('maiuscolo', testa.upper()), ('minuscolo', testa.lower())):
+        valori['%s_da_%s' % (nome, caso)] = p
+        valori['%s_a_%s' % (nome, caso)] = fine_intervallo(p)
+    return valori
+
+@report(1, "Il nome e il cognome dei proprietari delle automobili con la targa che inizia per un prefisso", ('Nome', 'Cognome'),
+        Parametro('prefisso', str, 'E', limiti_prefisso))
+def proprietari_targa():
+    return select(Proprietario.Nome, Proprietario.Cognome).where(and_(Proprietario.Id==Automobile.IdProprietario, inizia_per_parametro(Automobile.Targa, 'prefisso')))
+
+@report(2, "Le targhe delle automobili i cui proprietari vivono in una città", ('Targa',),
+        Parametro('città', str, 'Roma'))
+def targhe_città():
+    return select(Automobile.Targa).where(and_(Proprietario.Id==Automobile.IdProprietario, Proprietario.IdCittà==Città.Id, Città.Nome==bindparam('città')))
+
+@report(3, "Il nome dei meccanici accompagnato dal numero di interventi fatti in ordine decrescente", ('Nome', 'Interventi'),
+        Parametro('minimo', int, 1))
+def interventi_per_meccanico():
+    # letto dal riepilogo (riepilogo.py) invece di contare ogni volta tutti gli interventi
+    return (select(Meccanico.Nome, RiepilogoMeccanico.Interventi).where(and_(Meccanico.Id==RiepilogoMeccanico.IdMeccanico,
+            RiepilogoMeccanico.Interventi >= bindparam('minimo'), RiepilogoMeccanico.Interventi > 0)).order_by(desc(RiepilogoMeccanico.Interventi)))
+
+@report(4, "I fornitori con il numero di spedizioni e i pezzi spediti in un periodo", ('Fornitore', 'Spedizioni', 'Pezzi', 'Spesa'),
+        Parametro('dal', datetime.date.fromisoformat, datetime.date(1000, 1, 1)), Parametro('al', datetime.date.fromisoformat, datetime.date(9999, 12, 31)))
+def spedizioni_per_fornitore():
+    s = spedizione_tutte.c
+    return (select(Fornitore.Nome, func.count(), func.sum(s.QuantitàSpedita), func.sum(s.Prezzo))
+            .where(and_(Fornitore.Id==s.IdFornitore, s.DataSpedizione.between(bindparam('dal'), bindparam('al'))))
+            .group_by(Fornitore.Id).order_by(desc(func.sum(s.QuantitàSpedita))))
+
+@report(5, "Il nome dei meccanici con il voto medio delle recensioni in ordine decrescente", ('Nome', 'Recensioni', 'Voto medio'),
+        Parametro('minimo', int, 1))
+def voto_medio_per_meccanico():
+    voto = func.round(RiepilogoMeccanico.SommaVoti * 1.0 / RiepilogoMeccanico.Recensioni, 2)
+    return (select(Meccanico.Nome, RiepilogoMeccanico.Recensioni, voto).where(and_(Meccanico.Id==RiepilogoMeccanico.IdMeccanico,
+            RiepilogoMeccanico.Recensioni >= bindparam('minimo'), RiepilogoMeccanico.Recensioni > 0)).order_by(desc(voto)))
+
+@report(6, "I pezzi con la giacenza in magazzino minore o uguale a una soglia", ('Pezzo', 'Giacenza'),
+        Parametro('soglia', int, 10))
+def pezzi_sotto_scorta():
+    # letto dalla giacenza tenuta da magazzino.py, con l'indice su giacenza.Quantità
+    return (select(Pezzo.Nome, Giacenza.Quantità).where(and_(Pezzo.Id==Giacenza.IdPezzo, Giacenza.Quantità <= bindparam('soglia')))
+            .order_by(Giacenza.Quantità, Pezzo.Id))
+
+def descrizione(r):
+    predefiniti = ' '.join('%s=%s' % (p.nome, p.predefinito) for p in r.parametri)
+    return '%d. %s%s' % (r.numero, r.titolo, ' (%s)' % predefiniti if predefiniti else '')
+
+MENU = ''.join(descrizione(r) + '\n' for r in REPORT.values()) + 'Numero del report, seguito eventualmente da parametro=valore\n'
+
+def esegui(session, n, **parametri):
+    return REPORT[n].esegui(session, **parametri)
+
+def statistiche():
+    # per ogni report: esecuzioni con lo statement già compilato (hit) e da compilare (miss)
+    return {n: {'hit': r.hit, 'miss': r.miss, 'hit_rate': r.hit / (r.hit + r.miss) if r.hit + r.miss else 0.0} for n, r in REPORT.items()}
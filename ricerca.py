@@ -0,0 +1,307 @@
+# Ricerca per parte del testo su Automobile.Targa, Proprietario.Cognome e Pezzo.Nome con un indice in memoria:
+# i testi distinti (normalizzati: minuscole, spazi singoli) in una lista ordinata per la ricerca per prefisso con
+# bisect, e un indice di trigrammi (trigramma -> numeri dei testi che lo contengono) per la ricerca di una parte
+# qualsiasi: si legge l'elenco del trigramma più raro della parte cercata e si controllano solo quei testi.
+# I risultati sono ordinati: testo uguale, poi che inizia per la parte cercata, poi con una parola che inizia per
+# essa, poi che la contiene; a parità in ordine alfabetico. Le parti più corte di un trigramma cercano solo per prefisso.
+#
+# L'indice si costruisce alla prima ricerca (o con ricostruisci) e resta allineato con gli eventi dell'ORM:
+# inserimenti, modifiche e cancellazioni della sessione vengono applicati al commit e scartati se la transazione
+# è annullata. Quello che l'ORM non vede (cancellazioni a cascata nel database, righe di un savepoint annullato)
+# lo corregge trova(), che rilegge dal database le righe trovate; gli inserimenti con insert() (importazione) si
+# recuperano alla ricerca seguente leggendo le righe con Id maggiore dell'ultimo indicizzato.
+#
+# Uso: python ricerca.py cerca targa AB1 [--limite 20] [--url URL]
+#      python ricerca.py ricostruisci [targa cognome pezzo] [--url URL]   (tempi e memoria di ogni indice)
+import sys, time
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from modelli import *
+
+# nome usato nel menu e nei comandi -> colonna indicizzata
+CAMPI = {'targa': Automobile.Targa, 'cognome': Proprietario.Cognome, 'pezzo': Pezzo.Nome}
+N = 3
+LIMITE = 20
+BLOCCO = 50000
+
+def normalizza(testo):
+    return ' '.join(str(testo).split()).casefold()
+
+def trigrammi(testo):
+    return {testo[i:i+N] for i in range(len(testo) - N + 1)}
+
+class Indice:
+    def __init__(self, colonna):
+        self.colonna = colonna
+        self.righe = {}             # Id -> testo normalizzato
+        self.parole = []            # numero -> testo (None se non c'è più)
+        self.ids = []               # numero -> Id, oppure lista ordinata di Id se il testo è di più righe
+        self.chiavi = []            # testi in ordine alfabetico
+        self.numeri = array('I')    # numero di ogni testo di chiavi, nello stesso ordine
+        self.gruppi = {}            # trigramma -> array dei numeri dei testi che lo contengono
+        self.residui = 0            # voci di gruppi che puntano a testi tolti
+        self.ultimo = 0             # Id più alto indicizzato
+        self.ordinati = 0           # i testi con numero minore sono numerati in ordine alfabetico (dall'ultima costruzione)
+        self.spazi = False          # True se qualche testo ha più parole
+        self.da_recuperare = False
+
+    def costruisci(self, righe):
+        # righe: coppie (Id, valore); sostituisce il contenuto dell'indice
+        self.__init__(self.colonna)
+        # testo -> sé stesso: le righe con lo stesso testo condividono la stessa stringa
+        canonici = {}
+        for i, valore in righe:
+            if valore is None: continue
+            t = normalizza(valore)
+            self.righe[i] = canonici.setdefault(t, t)
+            if i > self.ultimo: self.ultimo = i
+        self.chiavi = sorted(canonici)
+        del canonici
+        self.parole = list(self.chiavi)
+        self.numeri = array('I', range(len(self.chiavi)))
+        self.ordinati = len(self.chiavi)
+        self.spazi = any(' ' in t for t in self.chiavi)
+        numero = {t: n for n, t in enumerate(self.parole)}
+        self.ids = [None] * len(self.parole)
+        for i, t in self.righe.items():
+            n = numero[t]
+            ids = self.ids[n]
+            if ids is None: self.ids[n] = i
+            elif isinstance(ids, list): ids.append(i)
+            else: self.ids[n] = [ids, i]
+        del numero
+        for ids in self.ids:
+            if isinstance(ids, list): ids.sort()
+        for n, t in enumerate(self.parole):
+            for g in trigrammi(t):
+                gruppo = self.gruppi.get(g)
+                if gruppo is None: gruppo = self.gruppi[g] = array('I')
+                gruppo.append(n)
+
+    def _numero(self, t):
+        k = bisect_left(self.chiavi, t)
+        return (k, self.numeri[k]) if k < len(self.chiavi) and self.chiavi[k]==t else (k, None)
+
+    def metti(self, i, valore):
+        # inserimento o modifica della riga i; valore None la toglie
+        t = None if valore is None else normalizza(valore)
+        vecchio = self.righe.get(i)
+        if vecchio==t: return
+        if vecchio is not None: self.togli(i)
+        if t is None: return
+        k, n = self._numero(t)
+        if n is None:
+            n = len(self.parole)
+            self.parole.append(t)
+            self.ids.append(i)
+            self.chiavi.insert(k, t)
+            self.numeri.insert(k, n)
+            if ' ' in t: self.spazi = True
+            for g in trigrammi(t):
+                self.gruppi.setdefault(g, array('I')).append(n)
+        else:
+            t = self.parole[n]
+            ids = self.ids[n]
+            if isinstance(ids, list): insort(ids, i)
+            else: self.ids[n] = sorted((ids, i))
+        self.righe[i] = t
+        if i > self.ultimo: self.ultimo = i
+
+    def togli(self, i):
+        t = self.righe.pop(i, None)
+        if t is None: return
+        k, n = self._numero(t)
+        ids = self.ids[n]
+        if isinstance(ids, list):
+            ids.remove(i)
+            if len(ids)==1: self.ids[n] = ids[0]
+            return
+        # era l'unica riga con questo testo
+        self.parole[n] = self.ids[n] = None
+        del self.chiavi[k]
+        del self.numeri[k]
+        self.residui += len(trigrammi(t))
+        if self.residui > 1000 and self.residui > sum(map(len, self.gruppi.values())) // 2: self.compatta()
+
+    def compatta(self):
+        # rinumera i testi rimasti togliendo dai trigrammi quelli cancellati
+        self.costruisci(list(self.righe.items()))
+
+    def _righe(self, numeri):
+        for n in numeri:
+            ids = self.ids[n]
+            if isinstance(ids, list): yield from ids
+            else: yield ids
+
+    def _contengono(self, q, numeri):
+        # (0 se una parola inizia per q altrimenti 1, testo, numero) dei testi che contengono q senza iniziare per q
+        for n in numeri:
+            t = self.parole[n]
+            if t is None or t.startswith(q): continue
+            p = t.find(q)
+            if p > 0: yield (0 if t[p-1]==' ' else 1, t, n)
+
+    def cerca(self, testo, limite=LIMITE):
+        # Id delle righe trovate, le migliori per prime
+        q = normalizza(testo)
+        if not q: return []
+        trovati = []
+        # testo uguale e testi che iniziano per q, già in ordine alfabetico (q stesso è il primo)
+        k = bisect_left(self.chiavi, q)
+        while k < len(self.chiavi) and len(trovati) < limite and self.chiavi[k].startswith(q):
+            trovati.extend(self._righe([self.numeri[k]]))
+            k += 1
+        if len(trovati) >= limite or len(q) < N: return trovati[:limite]
+        # le altre: si controllano solo i testi del trigramma con meno testi. I numeri di ogni trigramma sono crescenti,
+        # quindi quelli sotto ordinati sono in ordine alfabetico: se nessun testo ha più parole (le targhe) tutti i
+        # risultati hanno lo stesso peso e lì ci si ferma appena trovati quelli che mancano
+        gruppo = min((self.gruppi.get(g, ()) for g in trigrammi(q)), key=len)
+        mancano = limite - len(trovati)
+        fine = bisect_left(gruppo, self.ordinati)
+        candidati = []
+        for c in self._contengono(q, gruppo[:fine]):
+            candidati.append(c)
+            if not self.spazi and len(candidati) >= mancano: break
+        candidati.extend(self._contengono(q, gruppo[fine:]))
+        candidati.sort()
+        for _, _, n in candidati:
+            if len(trovati) >= limite: break
+            trovati.extend(self._righe([n]))
+        return trovati[:limite]
+
+    def memoria(self):
+        # byte occupati, per struttura (stringhe e interi contati una volta sola)
+        testi = sum(sys.getsizeof(t) for t in self.parole if t is not None)
+        return {'righe': sys.getsizeof(self.righe) + sum(sys.getsizeof(i) for i in self.righe),
+                'testi': testi + sys.getsizeof(self.parole) + sys.getsizeof(self.ids)
+                         + sum(sys.getsizeof(ids) for ids in self.ids if isinstance(ids, list)),
+                'prefissi': sys.getsizeof(self.chiavi) + sys.getsizeof(self.numeri),
+                'trigrammi': sys.getsizeof(self.gruppi) + sum(sys.getsizeof(g) + sys.getsizeof(a) for g, a in self.gruppi.items())}
+
+    def stato(self):
+        return {'righe': len(self.righe), 'testi': len(self.chiavi), 'trigrammi': len(self.gruppi), 'residui': self.residui,
+                'memoria_kb': sum(self.memoria().values()) // 1024}
+
+class InCostruzione:
+    # sta in indici al posto di un Indice che si costruisce altrove (servizio.py, in un thread): raccoglie le modifiche
+    # confermate nel frattempo, da riapplicare all'indice costruito prima di metterlo al suo posto
+    def __init__(self, colonna):
+        self.colonna = colonna
+        self.modifiche = []
+        self.da_recuperare = False
+
+    def metti(self, i, valore):
+        self.modifiche.append((i, valore))
+
+# campo -> Indice, per gli indici già costruiti in questo processo
+indici = {}
+
+def ricostruisci(session, campo, blocco=BLOCCO):
+    colonna = CAMPI[campo]
+    tabella = colonna.class_
+    indice = indici.get(campo) or Indice(colonna)
+    righe = session.execute(select(tabella.Id, colonna).order_by(tabella.Id).execution_options(yield_per=blocco))
+    indice.costruisci(tuple(r) for r in righe)
+    indici[campo] = indice
+    return indice
+
+def recupera(session, indice):
+    # righe inserite senza passare dall'ORM
+    tabella = indice.colonna.class_
+    for i, valore in session.execute(select(tabella.Id, indice.colonna).where(tabella.Id > indice.ultimo)):
+        indice.metti(i, valore)
+    indice.da_recuperare = False
+
+def trova(session, campo, testo, limite=LIMITE):
+    # [(Id, valore)] come cerca(), riletti dal database: le righe che non ci sono più o sono cambiate
+    # vengono corrette nell'indice e la ricerca si ripete
+    if campo not in CAMPI: raise ValueError("campo %s non previsto: %s" % (campo, ', '.join(CAMPI)))
+    indice = indici.get(campo) or ricostruisci(session, campo)
+    if indice.da_recuperare: recupera(session, indice)
+    tabella = indice.colonna.class_
+    while True:
+        ids = indice.cerca(testo, limite)
+        if not ids: return []
+        valori = dict(session.execute(select(tabella.Id, indice.colonna).where(tabella.Id.in_(ids))).all())
+        diversi = [i for i in ids if i not in valori or normalizza(valori[i]) != indice.righe.get(i)]
+        if not diversi: return [(i, valori[i]) for i in ids]
+        for i in diversi:
+            indice.metti(i, valori.get(i))
+
+def _indici_di(classe):
+    return [i for i in indici.values() if i.colonna.class_ is classe]
+
+def _in_attesa(target, cancellata=False):
+    # le modifiche si applicano all'indice solo al commit
+    session = object_session(target)
+    for indice in _indici_di(type(target)):
+        valore = None if cancellata else getattr(target, indice.colonna.key)
+        session.info.setdefault('ricerca', []).append((indice, target.Id, valore))
+
+@event.listens_for(Base, 'after_insert', propagate=True)
+@event.listens_for(Base, 'after_update', propagate=True)
+def _modifica_orm(mapper, connection, target):
+    _in_attesa(target)
+
+@event.listens_for(Base, 'after_delete', propagate=True)
+def _cancellazione_orm(mapper, connection, target):
+    _in_attesa(target, cancellata=True)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _inserimento_statement(stato):
+    if stato.is_insert and stato.bind_mapper is not None:
+        stato.session.info.setdefault('ricerca_recupera', set()).update(_indici_di(stato.bind_mapper.class_))
+
+@event.listens_for(Session, 'after_commit')
+def _conferma(session):
+    for indice, i, valore in session.info.pop('ricerca', ()):
+        indice.metti(i, valore)
+    for indice in session.info.pop('ricerca_recupera', ()):
+        indice.da_recuperare = True
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _annullamento(session, transazione):
+    # solo quando si annulla la transazione intera: dopo un savepoint annullato le righe in più le toglie trova()
+    if transazione.parent is None:
+        session.info.pop('ricerca', None)
+        session.info.pop('ricerca_recupera', None)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ricerca per targa, cognome del proprietario o nome del pezzo')
+    parser.add_argument('--url', help='URL del database')
+    sotto = parser.add_subparsers(dest='comando', required=True)
+    p = sotto.add_parser('cerca', help='le righe che contengono il testo, le migliori per prime')
+    p.add_argument('campo', choices=sorted(CAMPI))
+    p.add_argument('testo')
+    p.add_argument('--limite', type=int, default=LIMITE)
+    p = sotto.add_parser('ricostruisci', help='ricostruisce gli indici e ne riporta tempi e memoria')
+    p.add_argument('campi', nargs='*', help=', '.join(sorted(CAMPI)) + ' (predefinito: tutti)')
+    args = parser.parse_args()
+    if args.comando=='ricostruisci':
+        for c in args.campi:
+            if c not in CAMPI: parser.error('campo %s non previsto' % c)
+        args.campi = args.campi or sorted(CAMPI)
+
+    from sqlalchemy.orm import sessionmaker
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    session = sessionmaker(bind=engine)()
+    if args.comando=='cerca':
+        for i, valore in trova(session, args.campo, args.testo, args.limite):
+            print((i, valore))
+    else:
+        for campo in args.campi:
+            inizio = time.perf_counter()
+            indice = ricostruisci(session, campo)
+            durata = time.perf_counter() - inizio
+            s = indice.stato()
+            print('%-8s %9d righe %9d testi %7d trigrammi  %6.2f s  %8.1f MB' % (campo, s['righe'], s['testi'], s['trigrammi'], durata, s['memoria_kb'] / 1024))
+            for parte, byte in indice.memoria().items():
+                print('         %-10s %8.1f MB' % (parte, byte / 1024 / 1024))
@@ -0,0 +1,103 @@
+# Riepilogo per meccanico (numero e durata totale degli interventi, numero e somma dei voti delle recensioni)
+# nella tabella riepilogo_meccanico. Lo tengono aggiornato dei trigger su intervento e recensione, quindi vale
+# per ogni modo di scrivere: ORM, inserimenti a blocchi, cancellazioni a cascata, altri programmi.
+# I trigger ci sono solo per SQLite, che li esegue anche sulle righe cancellate a cascata. Su MySQL la cascata non
+# esegue trigger e servirebbero trigger BEFORE DELETE su automobile e proprietario mai provati: prepara() si ferma con
+# un errore invece di creare un riepilogo che potrebbe non tornare.
+#
+# Uso: python riepilogo.py [--url URL] [--verifica]
+# ricostruisce il riepilogo dai dati (con --verifica elenca solo i meccanici il cui riepilogo non torna)
+from sqlalchemy import select, delete, insert, func, text
+
+from modelli import *
+
+def _crea_riga(riga):
+    return ('INSERT OR IGNORE INTO riepilogo_meccanico (IdMeccanico, Interventi, Durata, Recensioni, SommaVoti) VALUES (%s.IdMeccanico, 0, 0, 0, 0);'
+            % riga)
+
+def _intervento(segno, riga):
+    return ('UPDATE riepilogo_meccanico SET Interventi = Interventi %s 1, Durata = Durata %s COALESCE(%s.Durata, 0) '
+            'WHERE IdMeccanico = %s.IdMeccanico;' % (segno, segno, riga, riga))
+
+def _recensioni_intervento(segno, riga):
+    return ('UPDATE riepilogo_meccanico SET Recensioni = Recensioni %s (SELECT COUNT(Voto) FROM recensione WHERE IdIntervento = %s.Id), '
+            'SommaVoti = SommaVoti %s (SELECT COALESCE(SUM(Voto), 0) FROM recensione WHERE IdIntervento = %s.Id) '
+            'WHERE IdMeccanico = %s.IdMeccanico;' % (segno, riga, segno, riga, riga))
+
+def _recensione(segno, riga):
+    # se l'intervento non c'è più (cancellazione a cascata) le sue recensioni sono già state tolte dal trigger dell'intervento
+    return ('UPDATE riepilogo_meccanico SET Recensioni = Recensioni %s (%s.Voto IS NOT NULL), SommaVoti = SommaVoti %s COALESCE(%s.Voto, 0) '
+            'WHERE IdMeccanico = (SELECT IdMeccanico FROM intervento WHERE Id = %s.IdIntervento);' % (segno, riga, segno, riga, riga))
+
+def trigger(dialetto):
+    # nome -> (momento e tabella, corpo)
+    if dialetto!='sqlite':
+        raise ValueError("Trigger del riepilogo non supportati su %s: provati solo su SQLite" % dialetto)
+    return {
+        'riepilogo_intervento_inserito': ('AFTER INSERT ON intervento', _crea_riga('NEW') + _intervento('+', 'NEW')),
+        'riepilogo_intervento_modificato': ('AFTER UPDATE OF IdMeccanico, Durata ON intervento',
+                                            _intervento('-', 'OLD') + _recensioni_intervento('-', 'OLD') + _crea_riga('NEW')
+                                            + _intervento('+', 'NEW') + _recensioni_intervento('+', 'NEW')),
+        'riepilogo_intervento_eliminato': ('BEFORE DELETE ON intervento', _intervento('-', 'OLD') + _recensioni_intervento('-', 'OLD')),
+        'riepilogo_recensione_inserita': ('AFTER INSERT ON recensione', _recensione('+', 'NEW')),
+        'riepilogo_recensione_modificata': ('AFTER UPDATE OF Voto, IdIntervento ON recensione',
+                                            _recensione('-', 'OLD') + _recensione('+', 'NEW')),
+        'riepilogo_recensione_eliminata': ('AFTER DELETE ON recensione', _recensione('-', 'OLD')),
+    }
+
+def togli_trigger(conn):
+    for nome in trigger(conn.dialect.name):
+        conn.execute(text('DROP TRIGGER IF EXISTS %s' % nome))
+
+def crea_trigger(conn):
+    togli_trigger(conn)
+    for nome, (momento, corpo) in trigger(conn.dialect.name).items():
+        conn.execute(text('CREATE TRIGGER %s %s FOR EACH ROW BEGIN %s END' % (nome, momento, corpo)))
+
+def calcolo():
+    # il riepilogo calcolato dai dati: una riga per ogni meccanico con almeno un intervento
+    recensioni = (select(Intervento.IdMeccanico, func.count(Recensione.Voto).label('n'), func.coalesce(func.sum(Recensione.Voto), 0).label('s'))
+                  .join(Recensione, Recensione.IdIntervento==Intervento.Id).group_by(Intervento.IdMeccanico).subquery())
+    interventi = (select(Intervento.IdMeccanico, func.count().label('n'), func.coalesce(func.sum(Intervento.Durata), 0).label('d'))
+                  .group_by(Intervento.IdMeccanico).subquery())
+    return (select(interventi.c.IdMeccanico, interventi.c.n, interventi.c.d, func.coalesce(recensioni.c.n, 0), func.coalesce(recensioni.c.s, 0))
+            .outerjoin(recensioni, recensioni.c.IdMeccanico==interventi.c.IdMeccanico))
+
+def ricostruisci(conn):
+    conn.execute(delete(RiepilogoMeccanico))
+    conn.execute(insert(RiepilogoMeccanico).from_select(['IdMeccanico', 'Interventi', 'Durata', 'Recensioni', 'SommaVoti'], calcolo()))
+
+def prepara(engine):
+    # trigger e contenuto del riepilogo, in un'unica transazione
+    with engine.begin() as conn:
+        crea_trigger(conn)
+        ricostruisci(conn)
+
+def differenze(conn):
+    # (IdMeccanico, valori attesi, valori nel riepilogo) per i meccanici il cui riepilogo non torna
+    attesi = {r[0]: tuple(r[1:]) for r in conn.execute(calcolo())}
+    attuali = {r[0]: tuple(r[1:]) for r in conn.execute(select(RiepilogoMeccanico.IdMeccanico, RiepilogoMeccanico.Interventi, RiepilogoMeccanico.Durata,
+                                                               RiepilogoMeccanico.Recensioni, RiepilogoMeccanico.SommaVoti))}
+    vuoto = (0, 0, 0, 0)
+    return [(i, attesi.get(i, vuoto), attuali.get(i, vuoto)) for i in sorted(set(attesi) | set(attuali)) if attesi.get(i, vuoto) != attuali.get(i, vuoto)]
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ricostruisce il riepilogo degli interventi per meccanico')
+    parser.add_argument('--url', help='URL del database')
+    parser.add_argument('--verifica', action='store_true', help='elenca le differenze senza correggerle')
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    with engine.connect() as conn:
+        diverse = differenze(conn)
+    for i, attesi, attuali in diverse:
+        print('Meccanico %d: atteso %s, trovato %s (interventi, durata, recensioni, somma voti)' % (i, attesi, attuali))
+    if not args.verifica:
+        prepara(engine)
+        print('Riepilogo ricostruito (%d meccanici corretti)' % len(diverse))
+    elif not diverse:
+        print('Il riepilogo è allineato')
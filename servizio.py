@@ -0,0 +1,233 @@
+# Servizio asincrono sulle dodici tabelle, per più terminali e per la dashboard web: elenco, inserimento, modifica,
+# cancellazione e report, con un engine asincrono (pool di connessioni) e una sessione nuova per ogni richiesta.
+# Le operazioni sono quelle di consultazione, importazione, aggiornamento, cancellazione e report, eseguite con
+# run_sync nella sessione della richiesta: stesse regole (chiavi naturali, cascate, cache dei nomi) del menu.
+#
+#   servizio = Servizio(crea_engine_async('sqlite:///officina.db'))
+#   await servizio.elenca('Automobile', dopo=(100,))
+#   await servizio.inserisci('Città', {'Nome': 'Lecce'})
+#   await servizio.aggiorna('Intervento', 3, {'Durata': '90'})
+#   await servizio.elimina('Usando', (3, 7))
+#   await servizio.report(2, città='Milano')
+#
+# Lo stesso servizio in HTTP con risposte JSON:
+#   python servizio.py [--url URL] [--porta 8080]
+#   GET /Automobile?dopo=100&dimensione=20   POST /Città {"Nome": "Lecce"}   PATCH /Intervento/3 {"Durata": "90"}
+#   DELETE /Usando/3,7                       GET /report/2?città=Milano      GET /cerca/targa?testo=AB1
+import json, asyncio
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from modelli import *
+from connessione import impostazioni, URL
+import consultazione, importazione, aggiornamento, cancellazione, report, ricerca
+
+DRIVER = {'sqlite': 'sqlite+aiosqlite', 'mysql': 'mysql+aiomysql'}
+PORTA = 8080
+# righe lette per volta quando si costruiscono gli indici di ricerca: blocchi piccoli per non fermare le altre richieste
+BLOCCO_INDICI = 1000
+
+def url_async(url):
+    # sqlite:///officina.db -> sqlite+aiosqlite:///officina.db, mysql+mysqlconnector://... -> mysql+aiomysql://...
+    u = make_url(url)
+    if u.get_dialect().is_async: return u
+    return u.set(drivername=DRIVER.get(u.get_backend_name(), u.drivername))
+
+def _chiavi_esterne(connessione, record):
+    # come modelli._chiavi_esterne_sqlite, per la connessione di aiosqlite
+    if connessione.__class__.__module__.endswith('aiosqlite'):
+        cursore = connessione.cursor()
+        cursore.execute('PRAGMA foreign_keys=ON')
+        cursore.close()
+
+def crea_engine_async(url=None, **opzioni):
+    # stesse impostazioni di connessione.crea_engine (ambiente, officina.ini), con il driver asincrono
+    valori = impostazioni()
+    valori.update({k: v for k, v in opzioni.items() if v is not None})
+    url = url_async(url or valori.get('url') or URL)
+    argomenti = {}
+    if 'pool_size' in valori: argomenti['pool_size'] = valori['pool_size']
+    if 'max_overflow' in valori: argomenti['max_overflow'] = valori['max_overflow']
+    if 'pre_ping' in valori: argomenti['pool_pre_ping'] = valori['pre_ping']
+    if 'recycle' in valori: argomenti['pool_recycle'] = valori['recycle']
+    if url.get_backend_name()=='sqlite' and url.database in (None, '', ':memory:'):
+        argomenti.pop('pool_size', None)
+        argomenti.pop('max_overflow', None)
+    engine = create_async_engine(url, **argomenti)
+    event.listen(engine.sync_engine, 'connect', _chiavi_esterne)
+    return engine
+
+def _tabella(tabella):
+    return cerca_tabella(tabella) if isinstance(tabella, str) else tabella
+
+def _aggiorna(session, tabella, chiave, valori):
+    return aggiornamento.aggiorna(session, tabella, chiave, importazione.valori_riga(session, tabella, valori))
+
+def _report(session, numero, parametri):
+    if numero not in report.REPORT: raise ValueError("report %d non trovato" % numero)
+    return [tuple(r) for r in report.esegui(session, numero, **parametri)]
+
+class Servizio:
+    def __init__(self, engine):
+        self.engine = engine
+        self.sessioni = async_sessionmaker(engine, expire_on_commit=False)
+        self._ricerca = None
+
+    async def _esegui(self, funzione, *argomenti):
+        # una sessione per richiesta: annullata se la richiesta fallisce, chiusa comunque
+        async with self.sessioni() as session:
+            try:
+                return await session.run_sync(funzione, *argomenti)
+            except BaseException:
+                await session.rollback()
+                raise
+
+    async def elenca(self, tabella, dopo=None, dimensione=consultazione.PAGINA):
+        # una pagina di tuple di view(); dopo è la chiave dell'ultima riga della pagina precedente
+        righe = await self._esegui(consultazione.righe, _tabella(tabella), dopo, dimensione)
+        return [tuple(r) for r in righe]
+
+    async def inserisci(self, tabella, valori):
+        # valori come nei file di importazione (stringhe, anche chiavi naturali); restituisce la chiave primaria
+        return await self._esegui(importazione.inserisci, _tabella(tabella), valori)
+
+    async def aggiorna(self, tabella, chiave, valori):
+        # le colonne cambiate, oppure None se la riga non esiste
+        return await self._esegui(_aggiorna, _tabella(tabella), chiave, valori)
+
+    async def elimina(self, tabella, chiave):
+        return await self._esegui(cancellazione.elimina, _tabella(tabella), chiave)
+
+    async def report(self, numero, **parametri):
+        return await self._esegui(_report, numero, parametri)
+
+    async def _costruisci_indici(self):
+        # le righe si leggono a blocchi con la sessione asincrona e l'indice si costruisce in un thread: con un milione
+        # di targhe sono una decina di secondi, in cui il ciclo degli eventi continua a servire le altre richieste
+        for campo, colonna in ricerca.CAMPI.items():
+            if campo in ricerca.indici: continue
+            tabella = colonna.class_
+            # registrato prima di leggere: le modifiche dell'ORM confermate da qui in poi non vanno perse
+            attesa = ricerca.indici[campo] = ricerca.InCostruzione(colonna)
+            try:
+                righe = []
+                async with self.sessioni() as session:
+                    risultato = await session.stream(select(tabella.Id, colonna).order_by(tabella.Id).execution_options(yield_per=BLOCCO_INDICI))
+                    async for parte in risultato.partitions():
+                        righe.extend(map(tuple, parte))
+                indice = ricerca.Indice(colonna)
+                await asyncio.to_thread(indice.costruisci, righe)
+            except BaseException:
+                del ricerca.indici[campo]
+                raise
+            # senza await in mezzo: nessuna conferma può arrivare tra le modifiche riapplicate e il cambio di indice
+            for i, valore in attesa.modifiche:
+                indice.metti(i, valore)
+            # le righe inserite con insert() nel frattempo si recuperano alla prima ricerca
+            indice.da_recuperare = True
+            ricerca.indici[campo] = indice
+
+    def avvia_ricerca(self):
+        # costruzione degli indici in sottofondo, chiamata all'avvio del servizio; le ricerche la aspettano
+        if self._ricerca is None: self._ricerca = asyncio.ensure_future(self._costruisci_indici())
+        return self._ricerca
+
+    async def cerca(self, campo, testo, limite=ricerca.LIMITE):
+        # [(Id, valore)] con gli indici in memoria di ricerca.py, condivisi tra le richieste
+        if campo not in ricerca.CAMPI: raise ValueError("campo %s non previsto: %s" % (campo, ', '.join(ricerca.CAMPI)))
+        try:
+            await asyncio.shield(self.avvia_ricerca())
+        except Exception:
+            # costruzione fallita (database non raggiungibile, ...): si riprova alla ricerca seguente
+            self._ricerca = None
+            raise
+        return await self._esegui(ricerca.trova, campo, testo, limite)
+
+    async def chiudi(self):
+        await self.engine.dispose()
+
+def _chiave(testo):
+    # "3" -> 3, "3,7" -> (3, 7) come in comandi.py
+    parti = [int(p) for p in testo.split(',')]
+    return parti[0] if len(parti)==1 else tuple(parti)
+
+async def richiesta(servizio, metodo, percorso, corpo):
+    # (stato HTTP, oggetto da restituire in JSON)
+    indirizzo = urlsplit(percorso)
+    parti = [unquote(p) for p in indirizzo.path.strip('/').split('/') if p]
+    parametri = dict(parse_qsl(indirizzo.query))
+    if not parti: return 200, [t.__name__ for t in TABELLE]
+    if parti[0]=='report' and len(parti)==2 and metodo=='GET':
+        return 200, await servizio.report(int(parti[1]), **parametri)
+    if parti[0]=='cerca' and len(parti)==2 and metodo=='GET':
+        return 200, await servizio.cerca(parti[1], parametri['testo'], int(parametri.get('limite', ricerca.LIMITE)))
+    tabella = _tabella(parti[0])
+    if len(parti)==1 and metodo=='GET':
+        dopo = _chiave(parametri['dopo']) if 'dopo' in parametri else None
+        if dopo is not None and not isinstance(dopo, tuple): dopo = (dopo,)
+        return 200, await servizio.elenca(tabella, dopo, int(parametri.get('dimensione', consultazione.PAGINA)))
+    if len(parti)==1 and metodo=='POST':
+        return 201, list(await servizio.inserisci(tabella, json.loads(corpo)))
+    if len(parti)==2 and metodo=='PATCH':
+        cambiati = await servizio.aggiorna(tabella, _chiave(parti[1]), json.loads(corpo))
+        return (404, {'errore': 'riga non trovata'}) if cambiati is None else (200, sorted(cambiati))
+    if len(parti)==2 and metodo=='DELETE':
+        n = await servizio.elimina(tabella, _chiave(parti[1]))
+        return (200, {'eliminate': n}) if n else (404, {'errore': 'riga non trovata'})
+    return 405, {'errore': 'operazione non prevista'}
+
+async def _connessione(servizio, lettore, scrittore):
+    # HTTP/1.1 essenziale: una richiesta per connessione, corpo con Content-Length
+    try:
+        riga = (await lettore.readline()).decode('latin-1').split()
+        intestazioni = {}
+        while True:
+            h = (await lettore.readline()).decode('latin-1').strip()
+            if not h: break
+            k, _, v = h.partition(':')
+            intestazioni[k.strip().lower()] = v.strip()
+        corpo = await lettore.readexactly(int(intestazioni.get('content-length', 0)))
+        try:
+            stato, risultato = await richiesta(servizio, riga[0], riga[1], corpo.decode('utf-8') or '{}')
+        except (ValueError, KeyError, TypeError) as e:
+            stato, risultato = 400, {'errore': str(e)}
+        except Exception as e:
+            stato, risultato = 409, {'errore': str(getattr(e, 'orig', None) or e)}
+        testo = json.dumps(risultato, ensure_ascii=False, default=str).encode('utf-8')
+        scrittore.write(b'HTTP/1.1 %d\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                        % (stato, len(testo)) + testo)
+        await scrittore.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, IndexError):
+        pass
+    finally:
+        scrittore.close()
+
+async def servi(servizio, porta=PORTA, host='127.0.0.1'):
+    servizio.avvia_ricerca()
+    server = await asyncio.start_server(lambda l, s: _connessione(servizio, l, s), host, porta)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Servizio HTTP asincrono sul database Officina')
+    parser.add_argument('--url', help='URL del database (il driver diventa quello asincrono)')
+    parser.add_argument('--porta', type=int, default=PORTA)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+
+    from connessione import crea_engine, prepara_schema
+    # lo schema si prepara una volta con l'engine normale
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    engine.dispose()
+    servizio = Servizio(crea_engine_async(args.url))
+    print('In ascolto su http://%s:%d/' % (args.host, args.porta))
+    try:
+        asyncio.run(servi(servizio, args.porta, args.host))
+    except KeyboardInterrupt:
+        pass
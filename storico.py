@@ -0,0 +1,103 @@
+# Storico di un'automobile cercata per targa: proprietario, modello e marca, interventi con meccanico,
+# pezzi usati e recensioni. Tutto viene caricato con quattro query qualunque sia la lunghezza dello storico,
+# anche per un'automobile senza interventi (automobile, interventi, pezzi usati e recensioni, ognuna con
+# joinedload per le relazioni verso un solo oggetto) invece di una query per ogni intervento e per ogni pezzo
+# seguendo le backref.
+#
+# Uso: python storico.py TARGA [--url URL]   (oppure python comandi.py storico TARGA --formato json)
+#      python storico.py --verifica          (su SQLite in memoria: stesse query con 0, 1 e 80 interventi)
+from collections import defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from modelli import *
+
+def query(targa):
+    return (select(Automobile).where(Automobile.Targa==targa)
+            .options(joinedload(Automobile.proprietario).joinedload(Proprietario.città),
+                     joinedload(Automobile.modello).joinedload(Modello.marca)))
+
+def per_intervento(session, tabella, opzioni, id_automobile):
+    # righe di Usando o Recensione degli interventi dell'automobile, raggruppate per IdIntervento
+    gruppi = defaultdict(list)
+    for riga in session.scalars(select(tabella).join(Intervento).where(Intervento.IdAutomobile==id_automobile).options(*opzioni)):
+        gruppi[riga.IdIntervento].append(riga)
+    return gruppi
+
+def storico(session, targa):
+    # dizionario annidato con lo storico dell'automobile, None se la targa non esiste
+    auto = session.execute(query(targa)).unique().scalar_one_or_none()
+    if auto is None: return None
+    interventi = session.scalars(select(Intervento).where(Intervento.IdAutomobile==auto.Id).options(joinedload(Intervento.meccanico))).all()
+    usando = per_intervento(session, Usando, (joinedload(Usando.pezzo),), auto.Id)
+    recensioni = per_intervento(session, Recensione, (), auto.Id)
+    p = auto.proprietario
+    return {
+        'Targa': auto.Targa,
+        'Modello': auto.modello.Nome if auto.modello else None,
+        'Marca': auto.modello.marca.Nome if auto.modello else None,
+        'Proprietario': {'Nome': p.Nome, 'Cognome': p.Cognome, 'Email': p.Email, 'Telefono': p.Telefono,
+                         'Città': p.città.Nome if p.città else None},
+        'Interventi': [{'Id': i.Id, 'Durata': i.Durata, 'Descrizione': i.Descrizione,
+                        'Meccanico': '%s %s' % (i.meccanico.Nome, i.meccanico.Cognome),
+                        'Pezzi': [{'Pezzo': u.pezzo.Nome, 'Quantità': u.Quantità, 'PrezzoUnitario': u.PrezzoUnitario}
+                                  for u in sorted(usando[i.Id], key=lambda u: u.IdPezzo)],
+                        'Recensioni': [{'Voto': r.Voto, 'Commento': r.Commento} for r in sorted(recensioni[i.Id], key=lambda r: r.Id)]}
+                       for i in sorted(interventi, key=lambda i: i.Id)],
+    }
+
+LUNGHEZZE = (0, 1, 80)
+
+def verifica(engine, lunghezze=LUNGHEZZE):
+    # query di storico() per automobili con lunghezze diverse di storico: {interventi: query}, tutte uguali se va bene
+    from sqlalchemy.orm import Session
+    from strumentazione import ContaQuery
+    with Session(engine) as session:
+        città = Città(Nome='Roma')
+        p = Proprietario(Nome='Mario', Cognome='Rossi', Telefono='061234', città=città)
+        m = Meccanico(Nome='Luca', Cognome='Bianchi')
+        pezzi = [Pezzo(Nome='Pezzo %d' % i) for i in range(3)]
+        modello = Modello(Nome='Panda', marca=Marca(Nome='Fiat'))
+        for n in lunghezze:
+            auto = Automobile(Targa='VER%03d' % n, proprietario=p, modello=modello)
+            for i in range(n):
+                intervento = Intervento(Durata=60, Descrizione='Tagliando', meccanico=m, automobile=auto)
+                for pezzo in pezzi[:i % 3 + 1]:
+                    session.add(Usando(intervento=intervento, pezzo=pezzo, Quantità=1, PrezzoUnitario=10))
+                session.add(Recensione(Commento='Bene', Voto=5, proprietario=p, intervento=intervento))
+            session.add(auto)
+        session.commit()
+    query_per_lunghezza = {}
+    for n in lunghezze:
+        with Session(engine) as session, ContaQuery(engine) as q:
+            if len(storico(session, 'VER%03d' % n)['Interventi']) != n: raise AssertionError('storico di VER%03d incompleto' % n)
+        query_per_lunghezza[n] = q.totale
+    return query_per_lunghezza
+
+if __name__ == '__main__':
+    import sys, json, argparse
+    from sqlalchemy.orm import Session
+
+    parser = argparse.ArgumentParser(description="Storico degli interventi di un'automobile")
+    parser.add_argument('targa', nargs='?')
+    parser.add_argument('--url', help='URL del database')
+    parser.add_argument('--verifica', action='store_true', help='controlla su SQLite in memoria che le query non dipendano dal numero di interventi')
+    args = parser.parse_args()
+    if not args.verifica and not args.targa: parser.error('indicare una targa oppure --verifica')
+
+    from connessione import crea_engine, prepara_schema
+    if args.verifica:
+        engine = crea_engine('sqlite://')
+        prepara_schema(engine)
+        query_per_lunghezza = verifica(engine)
+        for n, totale in query_per_lunghezza.items(): print('%3d interventi: %d query' % (n, totale))
+        sys.exit(0 if len(set(query_per_lunghezza.values()))==1 else 1)
+    engine = crea_engine(args.url)
+    prepara_schema(engine)
+    with Session(engine) as session:
+        risultato = storico(session, args.targa)
+    if risultato is None:
+        print('Targa %s non trovata' % args.targa, file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(risultato, indent=2, ensure_ascii=False))
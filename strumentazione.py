@@ -0,0 +1,166 @@
+# Strumenti per osservare le query inviate al database.
+#
+# ContaQuery conta le istruzioni eseguite in un blocco di codice. Strumentazione (l'istanza strumenti)
+# attribuisce ogni istruzione all'operazione logica in corso ("update Proprietario", "report 3", ...),
+# ne registra numero, tempo totale e massimo e righe, segnala i probabili N+1 (la stessa forma di query
+# ripetuta molte volte nella stessa operazione) e scrive in un registro le query più lente di una soglia.
+# Si accende e si spegne a runtime; da spenta non ha listener sull'engine e non costa nulla per query.
+#
+#   OFFICINA_STRUMENTAZIONE   1 per accenderla all'avvio di Officina2.py e comandi.py
+#   OFFICINA_QUERY_LENTE_MS   soglia del registro delle query lente (predefinita 100 ms)
+#   OFFICINA_REGISTRO_QUERY   file del registro (predefinito query_lente.log)
+import os, re, time, datetime, contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class ContaQuery:
+    # conta le istruzioni eseguite, divise per verbo (SELECT, UPDATE, ...), finché il blocco with è attivo
+    #     with ContaQuery() as q:
+    #         ...
+    #     q['SELECT'], q['UPDATE'], q.totale
+    def __init__(self, engine=Engine):
+        self.engine = engine
+        self.conteggi = Counter()
+
+    def _conta(self, conn, cursor, statement, parameters, context, executemany):
+        self.conteggi[statement.lstrip().split(None, 1)[0].upper()] += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._conta)
+        return self
+
+    def __exit__(self, *errore):
+        event.remove(self.engine, 'before_cursor_execute', self._conta)
+
+    def __getitem__(self, verbo):
+        return self.conteggi[verbo.upper()]
+
+    @property
+    def totale(self):
+        return sum(self.conteggi.values())
+
+LENTA_MS = 100
+RIPETIZIONI_N1 = 5
+REGISTRO = 'query_lente.log'
+NESSUNA = '(nessuna operazione)'
+
+# liste di segnaposto di lunghezza variabile (IN espansi): "?, ?, ?" e "%(Id_1_1)s, %(Id_1_2)s" diventano "?"
+_LISTA = re.compile(r'(?:\?|%s|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|%\(\w+\)s))+')
+
+def forma(statement):
+    return _LISTA.sub('?', ' '.join(statement.split()))
+
+class Corsa:
+    # una singola esecuzione di un'operazione: le forme delle query servono per riconoscere gli N+1
+    def __init__(self, nome):
+        self.nome = nome
+        self.forme = Counter()
+
+class Strumentazione:
+    def __init__(self, engine=Engine, lenta_ms=LENTA_MS, ripetizioni=RIPETIZIONI_N1, registro=REGISTRO):
+        self.engine = engine
+        self.lenta_ms = lenta_ms
+        self.ripetizioni = ripetizioni
+        self.registro = registro
+        self.attiva = False
+        self._corrente = contextvars.ContextVar('operazione', default=None)
+        self.azzera()
+
+    def azzera(self):
+        # operazione -> {'esecuzioni', 'query', 'totale_ms', 'max_ms', 'righe'}
+        self.statistiche = {}
+        # (operazione, forma, volte) per ogni esecuzione sospetta
+        self.sospetti = []
+
+    def accendi(self):
+        if not self.attiva:
+            event.listen(self.engine, 'before_cursor_execute', self._prima)
+            event.listen(self.engine, 'after_cursor_execute', self._dopo)
+            event.listen(self.engine, 'handle_error', self._errore)
+            self.attiva = True
+
+    def spegni(self):
+        if self.attiva:
+            event.remove(self.engine, 'before_cursor_execute', self._prima)
+            event.remove(self.engine, 'after_cursor_execute', self._dopo)
+            event.remove(self.engine, 'handle_error', self._errore)
+            self.attiva = False
+
+    def da_ambiente(self):
+        if os.environ.get('OFFICINA_QUERY_LENTE_MS'): self.lenta_ms = float(os.environ['OFFICINA_QUERY_LENTE_MS'])
+        self.registro = os.environ.get('OFFICINA_REGISTRO_QUERY', self.registro)
+        if os.environ.get('OFFICINA_STRUMENTAZIONE', '').lower() in ('1', 'true', 'si', 'sì', 'yes'):
+            self.accendi()
+
+    # attribuzione delle query all'operazione: inizia/termina per il ciclo del menu, operazione() come blocco with
+    def inizia(self, nome):
+        self.termina()
+        self._corrente.set(Corsa(nome))
+
+    def termina(self):
+        corsa = self._corrente.get()
+        if corsa is not None:
+            self._corrente.set(None)
+            self._chiudi(corsa)
+
+    @contextmanager
+    def operazione(self, nome):
+        token = self._corrente.set(Corsa(nome))
+        try:
+            yield
+        finally:
+            corsa = self._corrente.get()
+            self._corrente.reset(token)
+            self._chiudi(corsa)
+
+    def _chiudi(self, corsa):
+        if not corsa.forme: return
+        self._voce(corsa.nome)['esecuzioni'] += 1
+        for f, volte in corsa.forme.items():
+            if volte >= self.ripetizioni and f.startswith('SELECT'):
+                self.sospetti.append((corsa.nome, f, volte))
+
+    def _voce(self, nome):
+        if nome not in self.statistiche:
+            self.statistiche[nome] = {'esecuzioni': 0, 'query': 0, 'totale_ms': 0.0, 'max_ms': 0.0, 'righe': 0}
+        return self.statistiche[nome]
+
+    def _prima(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('strumenti_inizio', []).append(time.perf_counter())
+
+    def _dopo(self, conn, cursor, statement, parameters, context, executemany):
+        ms = (time.perf_counter() - conn.info['strumenti_inizio'].pop()) * 1000
+        corsa = self._corrente.get()
+        nome = corsa.nome if corsa is not None else NESSUNA
+        voce = self._voce(nome)
+        voce['query'] += 1
+        voce['totale_ms'] += ms
+        voce['max_ms'] = max(voce['max_ms'], ms)
+        # rowcount: righe scritte da INSERT/UPDATE/DELETE; per le SELECT solo con i driver che lo riportano
+        # (mysqlconnector con cursore bufferizzato sì, sqlite3 no)
+        if cursor.rowcount > 0: voce['righe'] += cursor.rowcount
+        if corsa is not None: corsa.forme[forma(statement)] += 1
+        if ms >= self.lenta_ms: self._lenta(nome, ms, statement, parameters)
+
+    def _errore(self, contesto):
+        inizi = contesto.connection.info.get('strumenti_inizio') if contesto.connection is not None else None
+        if inizi: inizi.pop()
+
+    def _lenta(self, nome, ms, statement, parameters):
+        parametri = repr(parameters)
+        if len(parametri) > 200: parametri = parametri[:200] + '...'
+        with open(self.registro, 'a', encoding='utf-8') as f:
+            f.write('%s [%s] %.1f ms: %s -- %s\n' % (datetime.datetime.now().isoformat(timespec='seconds'), nome, ms, ' '.join(statement.split()), parametri))
+
+    def rapporto(self):
+        righe = ['%-30s %6s %7s %11s %9s %9s' % ('operazione', 'volte', 'query', 'totale ms', 'max ms', 'righe')]
+        for nome, v in sorted(self.statistiche.items(), key=lambda x: -x[1]['totale_ms']):
+            righe.append('%-30s %6d %7d %11.1f %9.1f %9d' % (nome, v['esecuzioni'], v['query'], v['totale_ms'], v['max_ms'], v['righe']))
+        for nome, f, volte in self.sospetti:
+            righe.append('Possibile N+1 in %s: %d volte %s' % (nome, volte, f if len(f) <= 120 else f[:120] + '...'))
+        return '\n'.join(righe)
+
+strumenti = Strumentazione()